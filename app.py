@@ -5,673 +5,2885 @@ Aruba Configuration Analysis Tool
 Author: Lucas.Mei
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, url_for, g
 import re
 import os
+import shutil
+import sqlite3
+import struct
+import sys
 import time
+import argparse
+import atexit
+import bisect
+import codecs
+import csv
+import functools
+import glob
+import gzip
+import hashlib
+import hmac
+import heapq
+import io
+import json
+import mmap
+import multiprocessing
+import queue
+import random
+import tarfile
+import tempfile
+import threading
+import zipfile
+import zlib
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，只保证单进程内的计数正确
+    fcntl = None
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 import logging
+import logging.handlers
 
 app = Flask(__name__)
-# 设置最大文件大小为1MB
-app.config['MAX_CONTENT_LENGTH'] = 1 * 1024 * 1024
+# 设置最大文件大小为32MB，上传文件分块流式读取，不会整体读入内存
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
+# 解析/分析结果缓存的条目数和过期时间（秒）
+app.config['RESULT_CACHE_SIZE'] = 32
+app.config['RESULT_CACHE_TTL'] = 3600
+# gzip请求体解压后的最大长度
+app.config['MAX_DECOMPRESSED_LENGTH'] = 10 * 1024 * 1024
+# 批量分析：压缩包/请求体大小、文件数量、解压后总大小的上限，以及进程池大小（None为可用CPU核数）
+app.config['BATCH_MAX_ARCHIVE_SIZE'] = 50 * 1024 * 1024
+app.config['BATCH_MAX_FILES'] = 500
+app.config['BATCH_MAX_TOTAL_SIZE'] = 200 * 1024 * 1024
+app.config['BATCH_WORKERS'] = None
+# 异步分析任务：后台线程数、最多排队的任务数、完成后结果保留的时间（秒）
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_QUEUE_SIZE'] = 16
+app.config['JOB_RETENTION'] = 600
+# 同时进行解析分析的数量上限、等待队列长度和最长等待时间（秒）
+app.config['ANALYSIS_CONCURRENCY'] = 2
+app.config['ANALYSIS_QUEUE_SIZE'] = 8
+app.config['ANALYSIS_QUEUE_TIMEOUT'] = 10
+# 处理次数在内存中累积，每隔多少秒写回counters文件
+app.config['COUNTER_FLUSH_INTERVAL'] = 5
+# 上传配置的存储：最多保留的配置数、保留天数（None表示不限）、后台写入队列长度
+app.config['STORE_MAX_ENTRIES'] = 10000
+app.config['STORE_RETENTION_DAYS'] = 90
+app.config['STORE_QUEUE_SIZE'] = 64
+# 日志文件按大小轮转（LOG_ROTATE_WHEN设置为如'midnight'时按时间轮转），保留LOG_BACKUP_COUNT个
+app.config['LOG_MAX_BYTES'] = 10 * 1024 * 1024
+app.config['LOG_BACKUP_COUNT'] = 5
+app.config['LOG_ROTATE_WHEN'] = None
+# 日志队列长度，队列满时丢弃INFO等普通日志，ERROR及以上同步写入stderr
+app.config['LOG_QUEUE_SIZE'] = 10000
+# 每次请求都会产生的INFO日志（解码、上传、保存）的保留比例
+app.config['LOG_INFO_SAMPLE_RATE'] = 0.1
+# 存储配置统计分析的定期检查间隔（秒）、汇总视图中列出的最大条目数，以及重新核对时使用的进程数
+app.config['FLEET_RESCAN_INTERVAL'] = 600
+app.config['FLEET_VIEW_LIMIT'] = 100
+app.config['FLEET_SCAN_WORKERS'] = 1
+# 总耗时超过该秒数的请求记录各阶段耗时
+app.config['SLOW_REQUEST_SECONDS'] = 2.0
+# 检查基线文件是否更新的最小间隔（秒）
+app.config['BASELINE_CHECK_INTERVAL'] = 5
+# 数据目录（配置存储、计数器锁文件）和处理次数计数文件，None时使用程序目录下的data和templates/counters
+app.config['DATA_DIR'] = None
+app.config['COUNTER_FILE'] = None
+# 访问存储、检索和统计分析接口需要的令牌（请求头 Authorization: Bearer <令牌>），None时这些接口关闭
+app.config['ADMIN_TOKEN'] = None
 
-# 创建日志目录
+# 日志目录
 log_dir = os.path.join(os.path.dirname(__file__), 'log')
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(log_dir, 'app.log'), encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+
+# 控制台日志格式
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """按比例保留INFO及以下的日志，WARNING及以上全部保留"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """把日志记录放入有界队列，由后台线程格式化和写入
+
+    队列满时丢弃普通日志并计数，ERROR及以上交给fallback同步写入，保证不丢失。
+    """
+
+    def __init__(self, log_queue, fallback):
+        super().__init__(log_queue)
+        self.fallback = fallback
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 同一进程内的队列不需要提前格式化，格式化在后台线程完成
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.ERROR:
+                self.fallback.handle(record)
+            else:
+                self.dropped += 1
+
+def setup_logging():
+    """配置日志：请求线程只把记录放入队列，由QueueListener写入JSON日志文件和控制台"""
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, 'app.log')
+    if app.config['LOG_ROTATE_WHEN']:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_path, when=app.config['LOG_ROTATE_WHEN'], backupCount=app.config['LOG_BACKUP_COUNT'], encoding='utf-8')
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_path, maxBytes=app.config['LOG_MAX_BYTES'], backupCount=app.config['LOG_BACKUP_COUNT'], encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    fallback_handler = logging.StreamHandler(sys.stderr)
+    fallback_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(app.config['LOG_QUEUE_SIZE']), fallback_handler)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+
+    def start_listener():
+        listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, console_handler,
+                                                  respect_handler_level=True)
+        listener.start()
+        return listener
+
+    listeners = [start_listener()]
+    atexit.register(lambda: [listener.stop() for listener in listeners])
+
+    def log_to_console_in_child():
+        # fork出的子进程（如批量分析的进程池）没有后台线程，也不能和父进程同时写入、轮转同一个日志文件，
+        # 子进程的日志直接写到控制台
+        listeners.clear()
+        root.removeHandler(queue_handler)
+        root.addHandler(console_handler)
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=log_to_console_in_child)
+    return queue_handler
+
+# 日志队列，由init_app()配置日志时创建
+log_queue_handler = None
 logger = logging.getLogger(__name__)
+# 每次请求都会产生的INFO日志，按LOG_INFO_SAMPLE_RATE采样，比例由init_app()设置
+request_log_filter = SamplingFilter(1.0)
+request_logger = logging.getLogger(f'{__name__}.request')
+request_logger.addFilter(request_log_filter)
+
+# 默认配置基线所在目录
+templates_dir = os.path.join(os.path.dirname(__file__), 'templates')
 
-# 确保data目录存在
+# 默认的data目录，由init_app()创建
 data_dir = os.path.join(os.path.dirname(__file__), 'data')
-if not os.path.exists(data_dir):
-    os.makedirs(data_dir)
-
-def parse_config(config_text):
-    """解析Aruba配置文件"""
-    config_dict = {}
-    current_ap_group = None
-    current_profile_type = None
-    lines = config_text.splitlines()
-    
-    # 解析所有profile配置
-    virtual_ap_configs = {}
-    ssid_profile_configs = {}
-    aaa_profile_configs = {}
-    dot11a_radio_configs = {}
-    dot11g_radio_configs = {}
-    ap_system_configs = {}
-    regulatory_domain_configs = {}
-    iot_radio_configs = {}
-    dot11_6ghz_configs = {}
-    
-    # 先解析所有arm-profile配置
-    arm_profiles = {}
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        if line.startswith('rf arm-profile'):
-            parts = line.split('"')
-            if len(parts) >= 2:
-                profile_name = parts[1]
+
+# 耗时直方图的桶上限（秒）
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Prometheus格式的直方图，按标签值分别统计"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # 标签值 -> [各桶计数..., 总和, 次数]，桶计数在输出时才累加
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            if position < len(self.buckets):
+                series[position] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            labels = ''.join(f'{name}="{metric_label(value)}",' for name, value in zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels}le="+Inf"}} {series[-1]}')
+            suffix = f'{{{labels.rstrip(",")}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{suffix} {series[-1]}')
+        return lines
+
+def metric_label(value):
+    """转义Prometheus标签值"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+REQUEST_SECONDS = Histogram('aruba_request_seconds', 'Request handling time', ('endpoint', 'status'))
+STAGE_SECONDS = Histogram('aruba_stage_seconds', 'Time spent in each processing stage', ('stage', 'size_class'))
+PARSE_SECONDS = Histogram('aruba_parse_seconds', 'Profile expansion time per profile family', ('family',))
+RULE_SECONDS = Histogram('aruba_rule_seconds', 'Analysis time per rule', ('rule',))
+CONFIG_BYTES = Histogram('aruba_config_bytes', 'Size of analyzed configurations',
+                         buckets=(10 * 1024, 100 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024))
+CONFIG_LINES = Histogram('aruba_config_lines', 'Line count of analyzed configurations',
+                         buckets=(1000, 5000, 20000, 100000, 500000))
+CONFIG_AP_GROUPS = Histogram('aruba_config_ap_groups', 'AP group count of analyzed configurations',
+                             buckets=(1, 10, 100, 1000, 10000))
+HISTOGRAMS = (REQUEST_SECONDS, STAGE_SECONDS, PARSE_SECONDS, RULE_SECONDS, CONFIG_BYTES, CONFIG_LINES, CONFIG_AP_GROUPS)
+
+def size_class(size):
+    """配置大小分档，用作阶段耗时的标签"""
+    if size < 100 * 1024:
+        return 'lt100KB'
+    if size < 1024 * 1024:
+        return 'lt1MB'
+    if size < 10 * 1024 * 1024:
+        return 'lt10MB'
+    return 'ge10MB'
+
+class StageTimer:
+    """记录处理过程各阶段的耗时，进入新阶段时结束上一阶段"""
+
+    def __init__(self):
+        self.stages = []
+        self.labels = {}
+        self.started = time.perf_counter()
+        self._stage_started = None
+
+    def enter(self, stage):
+        """进入新的阶段，记录上一阶段的耗时"""
+        now = time.perf_counter()
+        if self.stages and self._stage_started is not None:
+            self.stages[-1]['seconds'] = round(now - self._stage_started, 6)
+        self.stages.append({'name': stage, 'seconds': None})
+        self._stage_started = now
+
+    def close(self):
+        """结束当前阶段，返回总耗时"""
+        now = time.perf_counter()
+        if self.stages and self._stage_started is not None:
+            self.stages[-1]['seconds'] = round(now - self._stage_started, 6)
+            self._stage_started = None
+        return now - self.started
+
+    def observe(self):
+        """把各阶段耗时计入STAGE_SECONDS"""
+        label = self.labels.get('size_class', 'unknown')
+        for stage in self.stages:
+            if stage['seconds'] is not None and stage['name'] not in ('done', 'failed'):
+                STAGE_SECONDS.observe(stage['seconds'], stage=stage['name'], size_class=label)
+
+    def breakdown(self):
+        return ' '.join(f'{stage["name"]}={stage["seconds"] * 1000:.1f}ms'
+                        for stage in self.stages if stage['seconds'] is not None)
+
+# 解析器版本，修改解析结果的结构后需要递增，使持久化的解析结果失效
+PARSER_VERSION = 1
+
+# 不带引号名称的块类型前缀，例如 "interface vlan 1" 的类型为 "interface vlan"、名称为 "1"
+UNQUOTED_BLOCK_TYPES = (
+    'ip access-list session',
+    'ip access-list eth',
+    'ip access-list route',
+    'interface gigabitethernet',
+    'interface port-channel',
+    'interface vlan',
+    'vlan',
+    'logging',
+)
+
+class ConfigBlock:
+    """配置块：一行顶格的块头加上直到 ! 为止的命令
+
+    块头、类型、名称和命令都使用驻留字符串，相同的命令在所有块和配置间只保存一份；
+    建立索引后commands为元组。块不记录所在行号（由ConfigIndex.starts记录），
+    增量分析时没有变化的块对象可以在前后两次的索引间共享。
+    """
+    __slots__ = ('header', 'type', 'name', 'commands', 'fingerprint')
+
+    def __init__(self, header):
+        self.header = sys.intern(header)
+        self.type, self.name = split_block_header(self.header)
+        self.commands = []
+        # block_fingerprint()首次计算后缓存
+        self.fingerprint = None
+
+    def __repr__(self):
+        return f'ConfigBlock({self.header!r}, {len(self.commands)} commands)'
+
+def split_block_header(header):
+    """拆分块头，返回(块类型, 名称)，没有名称时名称为None"""
+    if '"' in header:
+        parts = header.split('"')
+        return sys.intern(parts[0].strip()), sys.intern(parts[1])
+    for block_type in UNQUOTED_BLOCK_TYPES:
+        if header.startswith(block_type + ' '):
+            return block_type, sys.intern(header[len(block_type):].strip())
+    return header, None
+
+class ConfigIndex:
+    """配置块索引，按块类型和名称查找，starts为各块块头的行号（从1开始）"""
+
+    def __init__(self, blocks, starts=None):
+        self.blocks = blocks
+        self.starts = starts
+        self.by_type = {}
+        self.by_key = {}
+        for block in blocks:
+            self.by_type.setdefault(block.type, []).append(block)
+            if block.name is not None:
+                self.by_key.setdefault((block.type, block.name), []).append(block)
+        self.line_count = 0
+        self._vlans = None
+
+    @property
+    def vlans(self):
+        """VLAN索引，首次访问时建立"""
+        if self._vlans is None:
+            self._vlans = VlanIndex(self)
+        return self._vlans
+
+    def of_type(self, block_type):
+        """按出现顺序返回某类型的全部块"""
+        return self.by_type.get(block_type, [])
+
+    def get(self, block_type, name):
+        """返回某类型下指定名称的最后一个块"""
+        blocks = self.by_key.get((block_type, name))
+        return blocks[-1] if blocks else None
+
+    def named(self, block_type, name):
+        """按出现顺序返回某类型下指定名称的全部块"""
+        return self.by_key.get((block_type, name), [])
+
+# 匹配 "vlan <id>" 行：行首是vlan，后面是数字，然后是行尾或空格
+VLAN_ID_RE = re.compile(r'^\s*vlan\s+(\d+)(?:\s|$)')
+
+def vlan_id_of(line):
+    """返回 "vlan <id>" 行中的vlan-id，不是合法vlan行时返回None"""
+    if not line.startswith('vlan'):
+        return None
+    match = VLAN_ID_RE.match(line)
+    if match:
+        vlan_id = int(match.group(1))
+        # 验证vlan-id范围
+        if 1 <= vlan_id <= 4096:
+            return vlan_id
+    return None
+
+class VlanIndex:
+    """VLAN索引：一次遍历配置块，按vlan-id精确关联vlan定义、interface vlan块和引用它的块"""
+
+    def __init__(self, index):
+        self.definitions = {}
+        self.interfaces = {}
+        self.references = {}
+        for block in index.blocks:
+            if block.type == 'interface vlan':
+                if block.name and block.name.isdigit():
+                    self.interfaces[int(block.name)] = block
+                continue
+            vlan_id = vlan_id_of(block.header)
+            if vlan_id is not None:
+                if block.type == 'vlan':
+                    self.definitions[vlan_id] = block
+                else:
+                    self.references.setdefault(vlan_id, []).append(block)
+            for line in block.commands:
+                vlan_id = vlan_id_of(line)
+                if vlan_id is not None:
+                    self.references.setdefault(vlan_id, []).append(block)
+
+    def ids(self):
+        """返回所有定义或引用过的vlan-id，按数值排序"""
+        return sorted(self.definitions.keys() | self.references.keys())
+
+    def interface(self, vlan_id):
+        """返回vlan-id对应的interface vlan块，没有时返回None"""
+        return self.interfaces.get(vlan_id)
+
+    def interface_has(self, vlan_id, keyword):
+        """interface vlan块中是否有包含keyword的命令"""
+        interface = self.interfaces.get(vlan_id)
+        if interface is None:
+            return False
+        return any(keyword in line for line in interface.commands)
+
+class IndexBuilder:
+    """逐批接收行并切分成以!结束的块，供index_config和流式读取共用
+
+    顶格行开始一个新块，缩进行属于当前块；块已有命令时，顶格行也视为
+    当前块的命令（如firewall下的wireless-bridge-aging），直到遇到!为止。
+    """
+
+    def __init__(self, lineno=0):
+        self.blocks = []
+        self.starts = []
+        self.current = None
+        self.lineno = lineno
+
+    def feed_lines(self, lines):
+        """追加一批完整的行，行尾可以带换行符"""
+        blocks = self.blocks
+        starts = self.starts
+        current = self.current
+        lineno = self.lineno
+        for raw_line in lines:
+            lineno += 1
+            line = raw_line.strip()
+            if not line:
+                continue
+            if line.startswith('!'):
+                current = None
+                continue
+            if current is not None and (current.commands or raw_line[0] in ' \t'):
+                current.commands.append(sys.intern(line))
+                continue
+            current = ConfigBlock(line)
+            blocks.append(current)
+            starts.append(lineno)
+        self.current = current
+        self.lineno = lineno
+
+    def finish(self):
+        for block in self.blocks:
+            block.commands = tuple(block.commands)
+        index = ConfigIndex(self.blocks, self.starts)
+        index.line_count = self.lineno
+        return index
+
+def index_file(f):
+    """从打开的文本文件分块读取并建立块索引，不把整个文件读入内存"""
+    builder = IndexBuilder()
+    while True:
+        lines = f.readlines(INGEST_CHUNK_SIZE)
+        if not lines:
+            break
+        builder.feed_lines(lines)
+    return builder.finish()
+
+def index_config(config_text):
+    """一次遍历把配置切分成以!结束的块并建立索引"""
+    builder = IndexBuilder()
+    builder.feed_lines(config_text.splitlines())
+    return builder.finish()
+
+def quoted_value(line):
+    """返回行中第一个引号内的值（驻留字符串），没有时返回None"""
+    parts = line.split('"')
+    if len(parts) >= 2:
+        return sys.intern(parts[1])
+    return None
+
+# ap-group中引用的profile类型 -> 对应的配置块类型
+AP_GROUP_PROFILE_TYPES = {
+    'dot11a-radio-profile': 'rf dot11a-radio-profile',
+    'dot11g-radio-profile': 'rf dot11g-radio-profile',
+    'regulatory-domain-profile': 'ap regulatory-domain-profile',
+    'iot radio-profile': 'iot radio-profile',
+    'dot11-6GHz-radio-profile': 'rf dot11-6GHz-radio-profile',
+}
+
+# 同名块需要合并命令的类型，其余类型后出现的块覆盖前面的
+MERGED_PROFILE_TYPES = ('ap-group', 'iot radio-profile')
+
+# 引用关键字与块类型不能按名称对应的情况，如ap-group中的 enet1-port-profile
+REFERENCE_ALIASES = {f'enet{port}-port-profile': 'wired-port-profile' for port in range(5)}
+
+class ProfileNode:
+    """引用图中的一个profile或ap-group，每个(类型, 名称)只保存一份"""
+    __slots__ = ('graph', 'type', 'name', 'blocks', '_references')
+
+    def __init__(self, graph, profile_type, name, blocks):
+        self.graph = graph
+        self.type = profile_type
+        self.name = name
+        self.blocks = blocks
+        self._references = None
+
+    def __repr__(self):
+        return f'ProfileNode({self.type!r}, {self.name!r})'
+
+    @property
+    def commands(self):
+        """profile的命令，ap-group和iot radio-profile合并所有同名块"""
+        if self.type in MERGED_PROFILE_TYPES and len(self.blocks) > 1:
+            return tuple(line for block in self.blocks for line in block.commands)
+        return self.blocks[-1].commands
+
+    @property
+    def references(self):
+        """按出现顺序返回[(引用关键字, 被引用的节点或None, 原始行)]，首次访问时解析"""
+        if self._references is None:
+            references = []
+            for line in self.commands:
+                name = quoted_value(line)
+                if name is None:
+                    continue
+                keyword = line.split('"', 1)[0].strip()
+                profile_type = self.graph.resolve_keyword(keyword)
+                if profile_type is not None:
+                    references.append((keyword, self.graph.node(profile_type, name), line))
+            self._references = references
+        return self._references
+
+class ProfileGraph:
+    """profile引用图：ap-group -> virtual-ap -> ssid/aaa 等引用关系
+
+    每个profile只解析和保存一次，引用关系在首次访问时解析并缓存。
+    flatten() 生成result.html使用的嵌套字典，users()/groups_using() 用于反向查询。
+    group_deps 记录每个ap-group展开时读取过的节点，增量分析据此判断需要重新展开的ap-group。
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._nodes = {}
+        self._keyword_types = None
+        self._users = None
+        self._entries = {}
+        self._entry_deps = {}
+        self.group_deps = {}
+        # 每类profile展开的累计耗时（秒）
+        self.family_seconds = {}
+
+    def node(self, profile_type, name):
+        """返回指定类型和名称的profile节点，配置中没有定义时返回None"""
+        key = (profile_type, name)
+        if key not in self._nodes:
+            blocks = self.index.named(profile_type, name)
+            self._nodes[key] = ProfileNode(self, profile_type, name, blocks) if blocks else None
+        return self._nodes[key]
+
+    def nodes(self, profile_type):
+        """按出现顺序返回某类型的全部profile节点"""
+        names = dict.fromkeys(block.name for block in self.index.of_type(profile_type) if block.name is not None)
+        return [self.node(profile_type, name) for name in names]
+
+    def resolve_keyword(self, keyword):
+        """把引用行的关键字（如 ssid-profile、aaa-profile）解析为块类型，无法解析时返回None"""
+        if self._keyword_types is None:
+            named_types = [block_type for block_type, blocks in self.index.by_type.items()
+                           if any(block.name is not None for block in blocks)]
+            keyword_types = {}
+            # 先登记完整类型名，再登记去掉前缀的短名称，完整名称优先
+            for block_type in named_types:
+                keyword_types.setdefault(block_type, block_type)
+                keyword_types.setdefault(block_type.replace(' ', '-'), block_type)
+            for block_type in named_types:
+                if ' ' in block_type:
+                    keyword_types.setdefault(block_type.split(' ', 1)[1], block_type)
+                    keyword_types.setdefault(block_type.rsplit(' ', 1)[1], block_type)
+            self._keyword_types = keyword_types
+        keyword = REFERENCE_ALIASES.get(keyword, keyword)
+        return self._keyword_types.get(keyword)
+
+    def users(self, profile_type, name):
+        """返回直接引用该profile的节点列表"""
+        if self._users is None:
+            users = {}
+            for block_type in self.index.by_type:
+                for node in self.nodes(block_type):
+                    for keyword, target, line in node.references:
+                        if target is not None and node not in users.setdefault((target.type, target.name), []):
+                            users[(target.type, target.name)].append(node)
+            self._users = users
+        return self._users.get((profile_type, name), [])
+
+    def groups_using(self, profile_type, name):
+        """返回直接或间接引用该profile的ap-group名称，如使用某个aaa profile的所有ap-group"""
+        groups = []
+        seen = set()
+        pending = [(profile_type, name)]
+        while pending:
+            key = pending.pop()
+            for user in self.users(*key):
+                user_key = (user.type, user.name)
+                if user_key in seen:
+                    continue
+                seen.add(user_key)
+                if user.type == 'ap-group':
+                    groups.append(user.name)
+                else:
+                    pending.append(user_key)
+        order = {node.name: position for position, node in enumerate(self.nodes('ap-group'))}
+        return sorted(groups, key=lambda group: order.get(group, len(order)))
+
+    def _entry(self, profile_type, name):
+        """返回ap-group中某个profile的展开结果，同一个profile的结果在所有ap-group间共享"""
+        key = (profile_type, name)
+        if key in self._entries:
+            return self._entries[key]
+        started = time.perf_counter()
+        node = self.node(profile_type, name)
+        deps = [key]
+        if profile_type == 'wlan virtual-ap':
+            # virtual-ap关联ssid-profile和aaa-profile，这两行不放入commands
+            entry = ProfileEntry(name, (), kind='virtual-ap')
+            if node is not None:
                 commands = []
-                j = i + 1
-                while j < len(lines) and not lines[j].strip().startswith('!'):
-                    current_line = lines[j].strip()
-                    if current_line:
-                        commands.append(current_line)
-                    j += 1
-                arm_profiles[profile_name] = commands
-                i = j
-        i += 1
-    
-    # 解析dot11a-radio-profile配置
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        if line.startswith('rf dot11a-radio-profile'):
-            parts = line.split('"')
-            if len(parts) >= 2:
-                profile_name = parts[1]
+                ssid_name = None
+                aaa_name = None
+                for line in node.commands:
+                    if line.startswith('ssid-profile'):
+                        ssid_name = quoted_value(line) or ssid_name
+                    elif line.startswith('aaa-profile'):
+                        aaa_name = quoted_value(line) or aaa_name
+                    else:
+                        commands.append(line)
+                entry.commands = tuple(commands)
+                if ssid_name:
+                    ssid_node = self.node('wlan ssid-profile', ssid_name)
+                    entry.ssid_profile = ProfileEntry(ssid_name, ssid_node.commands if ssid_node else ())
+                    deps.append(('wlan ssid-profile', ssid_name))
+                if aaa_name:
+                    aaa_node = self.node('aaa profile', aaa_name)
+                    entry.aaa_profile = ProfileEntry(aaa_name, aaa_node.commands if aaa_node else ())
+                    deps.append(('aaa profile', aaa_name))
+        elif profile_type in ('rf dot11a-radio-profile', 'rf dot11g-radio-profile'):
+            # radio profile的arm-profile行单独关联，不放入commands
+            entry = ProfileEntry(name, (), kind='radio')
+            if node is not None:
                 commands = []
                 arm_profile_name = None
-                j = i + 1
-                while j < len(lines) and not lines[j].strip().startswith('!'):
-                    current_line = lines[j].strip()
-                    if current_line:
-                        if current_line.startswith('arm-profile'):
-                            arm_parts = current_line.split('"')
-                            if len(arm_parts) >= 2:
-                                arm_profile_name = arm_parts[1]
-                        commands.append(current_line)
-                    j += 1
-                
-                # 创建配置字典
-                profile_config = {
-                    'commands': commands,
-                }
-                
-                # 如果有arm-profile配置，添加到配置中
-                if arm_profile_name and arm_profile_name in arm_profiles:
-                    profile_config['arm_profile'] = {
-                        'name': arm_profile_name,
-                        'commands': arm_profiles[arm_profile_name]
-                    }
-                
-                dot11a_radio_configs[profile_name] = profile_config
-                i = j
-        i += 1
-    
-    # 解析radio profile配置
-    def parse_radio_profile(lines, start_index):
-        profile_name = None
+                for line in node.commands:
+                    if line.startswith('arm-profile'):
+                        arm_profile_name = quoted_value(line) or arm_profile_name
+                    else:
+                        commands.append(line)
+                entry.commands = tuple(commands)
+                arm_node = self.node('rf arm-profile', arm_profile_name) if arm_profile_name else None
+                if arm_node is not None:
+                    entry.arm_profile = ProfileEntry(arm_profile_name, arm_node.commands)
+                if arm_profile_name:
+                    deps.append(('rf arm-profile', arm_profile_name))
+        else:
+            entry = ProfileEntry(name, node.commands if node else ())
+        self._entries[key] = entry
+        self._entry_deps[key] = deps
+        self.family_seconds[profile_type] = self.family_seconds.get(profile_type, 0.0) + time.perf_counter() - started
+        return entry
+
+    def _group_entry(self, group_node):
+        """展开一个ap-group，同时记录读取过的节点"""
+        deps = {('ap-group', group_node.name)}
+
+        def entry(profile_type, profile_name):
+            result = self._entry(profile_type, profile_name)
+            deps.update(self._entry_deps[(profile_type, profile_name)])
+            return result
+
+        profiles = {
+            # 初始化时就添加默认的system-profile
+            'ap-system-profile': {
+                'default': entry('ap system-profile', 'default')
+            }
+        }
         commands = []
-        arm_profile_name = None
-        j = start_index + 1
-        
-        parts = lines[start_index].split('"')
-        if len(parts) >= 2:
-            profile_name = parts[1]
-            while j < len(lines) and not lines[j].strip().startswith('!'):
-                current_line = lines[j].strip()
-                if current_line:
-                    if current_line.startswith('arm-profile'):
-                        arm_parts = current_line.split('"')
-                        if len(arm_parts) >= 2:
-                            arm_profile_name = arm_parts[1]
-                    else:  # 只有不是arm-profile行时才添加到commands
-                        commands.append(current_line)
-                j += 1
-        
-        profile_config = {
-            'commands': commands,
+        for line in group_node.commands:
+            if line.startswith('ap-system-profile'):
+                profile_name = quoted_value(line)
+                if profile_name is not None:
+                    # 替换默认的system-profile
+                    profiles['ap-system-profile'] = {
+                        profile_name: entry('ap system-profile', profile_name)
+                    }
+                continue
+            if line.startswith('virtual-ap'):
+                profile_type = 'wlan virtual-ap'
+                keyword = 'virtual-ap'
+            else:
+                keyword = next((t for t in AP_GROUP_PROFILE_TYPES if line.startswith(t)), None)
+                profile_type = AP_GROUP_PROFILE_TYPES.get(keyword)
+            profile_name = quoted_value(line)
+            if keyword is None and profile_name is not None:
+                # 其他可以解析到profile定义的引用
+                keyword = line.split('"', 1)[0].strip()
+                profile_type = self.resolve_keyword(keyword)
+                if profile_type is not None:
+                    deps.add((profile_type, profile_name))
+                if profile_type is None or self.node(profile_type, profile_name) is None:
+                    keyword = None
+            if keyword is None:
+                commands.append(line)
+                continue
+            if profile_name is None:
+                continue
+            profiles.setdefault(keyword, {})[profile_name] = entry(profile_type, profile_name)
+        self.group_deps[group_node.name] = deps
+        return ApGroupEntry(group_node.name, profiles, tuple(commands))
+
+    def flatten(self, previous=None, changed=None):
+        """展开为 {ap-group名称: ApGroupEntry}，供result.html使用，config_to_dict可转换为字典
+
+        previous为上一次的ProfileGraph和flatten结果(graph, config)，changed为变化的(类型, 名称)集合，
+        读取的节点都没有变化的ap-group直接沿用上一次的展开结果。
+        """
+        started = time.perf_counter()
+        config = {}
+        self.reparsed = []
+        for group_node in self.nodes('ap-group'):
+            name = group_node.name
+            if previous is not None:
+                previous_graph, previous_config = previous
+                deps = previous_graph.group_deps.get(name)
+                if deps is not None and name in previous_config and deps.isdisjoint(changed):
+                    config[name] = previous_config[name]
+                    self.group_deps[name] = deps
+                    continue
+            config[name] = self._group_entry(group_node)
+            self.reparsed.append(name)
+        # ap-group一项为展开ap-group本身的耗时，不含其中profile的展开
+        total = time.perf_counter() - started
+        PARSE_SECONDS.observe(max(total - sum(self.family_seconds.values()), 0.0), family='ap-group')
+        for family, seconds in self.family_seconds.items():
+            PARSE_SECONDS.observe(seconds, family=family)
+        return config
+
+class ProfileEntry:
+    """ap-group中展开的一个profile
+
+    kind为'virtual-ap'时带ssid_profile/aaa_profile，为'radio'时带arm_profile，
+    子profile同样是ProfileEntry。模板可以像字典一样按属性访问。
+    """
+    __slots__ = ('name', 'commands', 'kind', 'ssid_profile', 'aaa_profile', 'arm_profile')
+
+    def __init__(self, name, commands, kind='profile'):
+        self.name = name
+        self.commands = commands
+        self.kind = kind
+        self.ssid_profile = None
+        self.aaa_profile = None
+        self.arm_profile = None
+
+    def to_dict(self, memo=None):
+        """转换为原来的字典结构，memo用于让共享的profile只转换一次"""
+        if memo is not None and id(self) in memo:
+            return memo[id(self)]
+        data = {'commands': list(self.commands)}
+        if self.kind == 'virtual-ap':
+            data['ssid_profile'] = self.ssid_profile.to_sub_dict() if self.ssid_profile else None
+            data['aaa_profile'] = self.aaa_profile.to_sub_dict() if self.aaa_profile else None
+        elif self.kind == 'radio':
+            data['arm_profile'] = self.arm_profile.to_sub_dict() if self.arm_profile else None
+        if memo is not None:
+            memo[id(self)] = data
+        return data
+
+    def to_sub_dict(self):
+        """子profile的字典结构：{'name': ..., 'commands': [...]}"""
+        return {'name': self.name, 'commands': list(self.commands)}
+
+class ApGroupEntry:
+    """展开后的ap-group：按类型分组的profile和其他命令"""
+    __slots__ = ('name', 'profiles', 'commands')
+
+    def __init__(self, name, profiles, commands):
+        self.name = name
+        self.profiles = profiles
+        self.commands = commands
+
+    def to_dict(self, memo=None):
+        return {
+            'profiles': {
+                profile_type: {name: entry.to_dict(memo) for name, entry in entries.items()}
+                for profile_type, entries in self.profiles.items()
+            },
+            'commands': list(self.commands),
         }
-        
-        if arm_profile_name and arm_profile_name in arm_profiles:
-            profile_config['arm_profile'] = {
-                'name': arm_profile_name,
-                'commands': arm_profiles[arm_profile_name]
-            }
-        
-        return profile_name, profile_config, j
-    
-    # 解析配置
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        if line.startswith('rf dot11a-radio-profile'):
-            profile_name, profile_config, next_i = parse_radio_profile(lines, i)
-            if profile_name:
-                dot11a_radio_configs[profile_name] = profile_config
-            i = next_i
-            
-        elif line.startswith('rf dot11g-radio-profile'):
-            profile_name, profile_config, next_i = parse_radio_profile(lines, i)
-            if profile_name:
-                dot11g_radio_configs[profile_name] = profile_config
-            i = next_i
-            
-        # ... 其他配置解析保持不变 ...
-        i += 1
-
-    # 先解析ssid-profile和aaa-profile配置
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        if line.startswith('wlan ssid-profile'):
-            parts = line.split('"')
-            if len(parts) >= 2:
-                profile_name = parts[1]
-                commands = []
-                j = i + 1
-                while j < len(lines) and not lines[j].strip().startswith('!'):
-                    current_line = lines[j].strip()
-                    if current_line:
-                        commands.append(current_line)
-                    j += 1
-                ssid_profile_configs[profile_name] = commands
-                i = j
-        elif line.startswith('aaa profile'):
-            parts = line.split('"')
-            if len(parts) >= 2:
-                profile_name = parts[1]
-                commands = []
-                j = i + 1
-                while j < len(lines) and not lines[j].strip().startswith('!'):
-                    current_line = lines[j].strip()
-                    if current_line:
-                        commands.append(current_line)
-                    j += 1
-                aaa_profile_configs[profile_name] = commands
-                i = j
-        i += 1
-
-    # 解析virtual-ap配置
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        if line.startswith('wlan virtual-ap'):
-            parts = line.split('"')
-            if len(parts) >= 2:
-                profile_name = parts[1]
-                commands = []
-                ssid_name = None
-                aaa_name = None
-                j = i + 1
-                while j < len(lines) and not lines[j].strip().startswith('!'):
-                    current_line = lines[j].strip()
-                    if current_line:
-                        if current_line.startswith('ssid-profile'):
-                            parts = current_line.split('"')
-                            if len(parts) >= 2:
-                                ssid_name = parts[1]
-                        elif current_line.startswith('aaa-profile'):
-                            parts = current_line.split('"')
-                            if len(parts) >= 2:
-                                aaa_name = parts[1]
-                        else:
-                            commands.append(current_line)
-                    j += 1
-                virtual_ap_configs[profile_name] = {
-                    'commands': commands,
-                    'ssid_profile': {
-                        'name': ssid_name,
-                        'commands': ssid_profile_configs.get(ssid_name, [])
-                    } if ssid_name else None,
-                    'aaa_profile': {
-                        'name': aaa_name,
-                        'commands': aaa_profile_configs.get(aaa_name, [])
-                    } if aaa_name else None
+
+def config_to_dict(config):
+    """把flatten()的结果转换为可JSON序列化的字典，共享的profile只转换一次"""
+    memo = {}
+    return {name: group.to_dict(memo) for name, group in config.items()}
+
+def group_parts(group):
+    """返回ap-group的(按类型分组的profile, 其他命令)，兼容ApGroupEntry和持久化结果中的字典"""
+    if isinstance(group, ApGroupEntry):
+        return group.profiles, group.commands
+    return group['profiles'], group['commands']
+
+def profile_dict(entry):
+    return entry.to_dict() if isinstance(entry, ProfileEntry) else entry
+
+def profile_summary(entry):
+    """返回(命令数, 子profile名称)，子profile为virtual-ap的ssid/aaa profile或radio profile的arm profile"""
+    if isinstance(entry, ProfileEntry):
+        subs = (entry.ssid_profile, entry.aaa_profile, entry.arm_profile)
+        return len(entry.commands), [sub.name for sub in subs if sub is not None]
+    subs = (entry.get(key) for key in ('ssid_profile', 'aaa_profile', 'arm_profile'))
+    return len(entry['commands']), [sub['name'] for sub in subs if sub]
+
+class ConfigTree:
+    """result.html按需加载的ap-group树
+
+    summaries只包含ap-group名称、profile名称和命令数，按页返回；展开时再按名称
+    查询ap-group的其他命令和profile的详细内容。
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.summaries = []
+        self._profile_names = []
+        for name, group in config.items():
+            profiles, commands = group_parts(group)
+            items = []
+            names = []
+            # ap-system-profile显示在最后
+            for profile_type in sorted(profiles, key=lambda t: t == 'ap-system-profile'):
+                for profile_name, entry in profiles[profile_type].items():
+                    command_count, sub_names = profile_summary(entry)
+                    items.append({'type': profile_type, 'name': profile_name, 'commands': command_count})
+                    names.append(profile_name)
+                    names.extend(sub_names)
+            self.summaries.append({'name': name, 'commands': len(commands), 'profiles': items})
+            self._profile_names.append('\n'.join(names).lower())
+
+    def page(self, offset=0, limit=50, query=None, profile=None):
+        """按ap-group名称和profile名称（不区分大小写的子串）过滤后分页，返回(总数, 当前页)"""
+        query = query.lower() if query else None
+        profile = profile.lower() if profile else None
+        if not query and not profile:
+            return len(self.summaries), self.summaries[offset:offset + limit]
+        matched = [summary for summary, names in zip(self.summaries, self._profile_names)
+                   if (not query or query in summary['name'].lower()) and (not profile or profile in names)]
+        return len(matched), matched[offset:offset + limit]
+
+    def group(self, name):
+        """返回ap-group中不属于任何profile的命令，不存在时返回None"""
+        group = self.config.get(name)
+        if group is None:
+            return None
+        profiles, commands = group_parts(group)
+        return {'name': name, 'commands': list(commands)}
+
+    def profile(self, group_name, profile_type, name):
+        """返回ap-group中某个profile的命令和子profile，不存在时返回None"""
+        group = self.config.get(group_name)
+        if group is None:
+            return None
+        profiles, commands = group_parts(group)
+        entry = profiles.get(profile_type, {}).get(name)
+        if entry is None:
+            return None
+        return dict(profile_dict(entry), type=profile_type, name=name)
+
+def parse_config(config_text, index=None):
+    """解析Aruba配置文件，返回字典结构，index为已建立的块索引时直接复用"""
+    if index is None:
+        index = index_config(config_text)
+    return config_to_dict(ProfileGraph(index).flatten())
+
+class UploadCounter:
+    """处理次数计数器：增量先在内存中累积，由后台线程定期写回文件
+
+    写回时持有文件锁读取最新值再加上本进程的增量，通过临时文件和rename原子替换，
+    多个进程同时写回也不会丢失计数。读取使用缓存值，最多每个间隔重新读一次文件。
+    """
+
+    def __init__(self, path, lock_path, flush_interval=5):
+        self.path = path
+        self.lock_path = lock_path
+        self.flush_interval = flush_interval
+        self._pending = 0
+        self._value = None
+        self._read_at = 0.0
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._stop = threading.Event()
+
+    def _read_file(self):
+        try:
+            with open(self.path, 'r') as f:
+                return int(f.read().strip() or '0')
+        except (FileNotFoundError, ValueError) as e:
+            logger.warning(f'Error reading counter: {str(e)}')
+            return 0
+
+    def value(self):
+        """返回文件中的计数加上尚未写回的增量"""
+        with self._lock:
+            now = time.monotonic()
+            if self._value is None or now - self._read_at >= self.flush_interval:
+                self._value = self._read_file()
+                self._read_at = now
+            return self._value + self._pending
+
+    def increment(self, amount=1):
+        with self._lock:
+            self._pending += amount
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='counter-flush', daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """把内存中的增量写回文件，返回写回后的计数"""
+        with self._lock:
+            pending, self._pending = self._pending, 0
+        if not pending:
+            return None
+        try:
+            with open(self.lock_path, 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                counter = self._read_file() + pending
+                tmp_path = f'{self.path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'w') as f:
+                    f.write(str(counter))
+                os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f'Error flushing counter: {str(e)}')
+            with self._lock:
+                self._pending += pending
+            return None
+        with self._lock:
+            self._value = counter
+            self._read_at = time.monotonic()
+        logger.debug(f'Counter flushed: {counter} (+{pending})')
+        return counter
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+# 处理次数计数器，由init_app()创建
+upload_counter = None
+
+def get_counter():
+    """获取处理次数"""
+    return upload_counter.value()
+
+def increment_counter():
+    """增加处理次数，定期批量写回文件"""
+    upload_counter.increment()
+
+class StagedFile:
+    """流式上传暂存的UTF-8原文，压缩写入存储后删除"""
+    __slots__ = ('path',)
+
+    def __init__(self, path):
+        self.path = path
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+# 配置中的主机名行，如 hostname "Aruba7210"
+HOSTNAME_RE = re.compile(r'^hostname\s+"?([^"\r\n]+)"?', re.MULTILINE)
+
+class ConfigStore:
+    """按内容哈希存储上传的配置，gzip压缩，写入由后台线程完成
+
+    配置保存在 <directory>/<哈希前两位>/<哈希>.log.gz，元数据（上传时间、主机名、
+    版本、来源、上传次数）追加写入 index.jsonl，启动时载入内存，按哈希O(1)查找。
+    相同内容只存储一次，再次上传只更新元数据。后台写入队列已满时由上传的线程直接写入。
+    listeners 中的对象在新配置写入后收到 add(哈希, ConfigIndex)，淘汰时收到 remove(哈希)。
+    元数据中的记录不在原处修改，更新时替换为新的字典。
+    """
+
+    def __init__(self, directory, max_entries=10000, retention_days=90, queue_size=64):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.jsonl')
+        self.max_entries = max_entries
+        self.retention_days = retention_days
+        self._meta = {}
+        self._pending = {}
+        # 按最后上传时间淘汰用的最小堆 (last_seen, 哈希)，记录更新后旧条目留在堆中，取出时跳过
+        self._expiry = []
+        self._lock = threading.Lock()
+        # 追加和重写index.jsonl时持有，保证文件中每个哈希的最后一行是内存中的最新记录
+        self._index_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._loaded = False
+        self._index_lines = 0
+        self.listeners = []
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, digest[:2], f'{digest}.log.gz')
+
+    def _load(self):
+        """载入元数据索引，同一哈希的后出现的记录覆盖先出现的"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self._index_lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('deleted'):
+                        self._meta.pop(record['hash'], None)
+                    else:
+                        self._meta[record['hash']] = record
+        except FileNotFoundError:
+            pass
+        self._rebuild_expiry()
+
+    def _rebuild_expiry(self):
+        self._expiry = [(record['last_seen'], digest) for digest, record in self._meta.items()]
+        heapq.heapify(self._expiry)
+
+    @property
+    def staging_dir(self):
+        """流式上传暂存UTF-8原文的目录，与存储目录在同一文件系统"""
+        path = os.path.join(self.directory, 'staging')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def save(self, content, source='upload', filename=None, encoding=None, confidence=None):
+        """登记一次上传并在后台写入，返回内容哈希"""
+        return self._register(content_hash(content), len(content), content, content, source, filename,
+                              encoding, confidence)
+
+    def save_staged(self, ingested, source='upload', filename=None):
+        """登记流式读取的上传，暂存文件由后台线程压缩后删除，返回内容哈希"""
+        return self._register(ingested.digest, ingested.size, ingested.head, StagedFile(ingested.staged_path),
+                              source, filename, ingested.encoding, ingested.confidence)
+
+    def _register(self, digest, size, head, payload, source, filename, encoding, confidence):
+        now = time.time()
+        with self._lock:
+            self._load()
+            record = self._meta.get(digest)
+            if record is None:
+                hostname = HOSTNAME_RE.search(head, 0, 65536)
+                record = {
+                    'hash': digest,
+                    'size': size,
+                    'hostname': hostname.group(1).strip() if hostname else None,
+                    'version': detect_version(head),
+                    'source': source,
+                    'filename': filename,
+                    'encoding': encoding,
+                    'encoding_confidence': confidence,
+                    'first_seen': now,
+                    'uploads': 0,
                 }
-                i = j
-        elif line.startswith('ap system-profile'):
-            parts = line.split('"')
-            if len(parts) >= 2:
-                profile_name = parts[1]
-                commands = []
-                j = i + 1
-                while j < len(lines) and not lines[j].strip().startswith('!'):
-                    current_line = lines[j].strip()
-                    if current_line:
-                        commands.append(current_line)
-                    j += 1
-                ap_system_configs[profile_name] = commands
-                i = j
-        elif line.startswith('ap regulatory-domain-profile'):
-            parts = line.split('"')
-            if len(parts) >= 2:
-                profile_name = parts[1]
-                commands = []
-                j = i + 1
-                while j < len(lines) and not lines[j].strip().startswith('!'):
-                    current_line = lines[j].strip()
-                    if current_line:
-                        commands.append(current_line)
-                    j += 1
-                regulatory_domain_configs[profile_name] = commands
-                i = j
-        elif line.startswith('iot radio-profile') or line.startswith('ap regulatory-domain-profile'):
-            parts = line.split('"')
-            if len(parts) >= 2:
-                profile_name = parts[1]
-                commands = []
-                j = i + 1
-                while j < len(lines) and not lines[j].strip().startswith('!'):
-                    current_line = lines[j].strip()
-                    if current_line:
-                        commands.append(current_line)
-                    j += 1
-                # 合并iot radio-profile的配置
-                if profile_name in iot_radio_configs:
-                    iot_radio_configs[profile_name].extend(commands)
+                self._pending[digest] = payload
+            else:
+                record = dict(record)
+                if isinstance(payload, StagedFile):
+                    payload.remove()
+            record['last_seen'] = now
+            record['uploads'] += 1
+            self._meta[digest] = record
+            heapq.heappush(self._expiry, (now, digest))
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name='config-store', daemon=True)
+                self._writer.start()
+        try:
+            self._queue.put_nowait((self._write, (digest,)))
+        except queue.Full:
+            # 后台写入跟不上时直接写入，不阻塞在队列上
+            logger.warning('Store write queue is full, writing synchronously')
+            try:
+                self._write(digest)
+            except Exception as e:
+                logger.error(f'Error saving content to store: {str(e)}')
+        return digest
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                func, args = item
+                func(*args)
+            except Exception as e:
+                logger.error(f'Error saving content to store: {str(e)}')
+            finally:
+                self._queue.task_done()
+
+    def _write(self, digest):
+        """写入待保存的内容，并把该哈希当前的元数据追加到索引"""
+        with self._lock:
+            content = self._pending.get(digest)
+        stored_size = None
+        if content is not None:
+            path = self.path_for(digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # 队列已满时可能有多个线程同时写入同一内容，临时文件按线程区分
+                tmp_path = f'{path}.{threading.get_ident()}.tmp'
+                with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+                    if isinstance(content, StagedFile):
+                        with open(content.path, 'rb') as staged:
+                            shutil.copyfileobj(staged, f, 1024 * 1024)
+                    else:
+                        f.write(content.encode('utf-8'))
+                os.replace(tmp_path, path)
+                stored_size = os.path.getsize(path)
+                request_logger.info('Content saved to store: %s', digest)
+                if self.listeners:
+                    self._notify(digest, self._parse(content))
+            with self._lock:
+                self._pending.pop(digest, None)
+            if isinstance(content, StagedFile):
+                content.remove()
+        with self._index_lock:
+            with self._lock:
+                record = self._meta.get(digest)
+                if record is not None and stored_size is not None:
+                    record = self._meta[digest] = dict(record, stored_size=stored_size)
+            if record is not None:
+                self._append_index(record)
+        if not self.evict() and self._index_lines > 2 * len(self._meta) + 100:
+            # 重复上传的记录过多时压缩索引
+            self._rewrite_index()
+
+    def _append_index(self, record):
+        """追加一条元数据记录，调用方持有_index_lock"""
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._index_lines += 1
+
+    def _notify(self, digest, index):
+        for listener in self.listeners:
+            try:
+                listener.add(digest, index)
+            except Exception as e:
+                logger.error(f'Error indexing stored config {digest}: {str(e)}')
+
+    @staticmethod
+    def _parse(content):
+        """把待写入的内容（字符串或暂存文件）切分成块索引"""
+        if not isinstance(content, StagedFile):
+            return index_config(content)
+        with open(content.path, 'r', encoding='utf-8', newline='') as f:
+            return index_file(f)
+
+    def parsed(self, digest):
+        """流式读取存储的配置并切分成块索引，不存在时返回None"""
+        return index_stored_file(self.path_for(digest))
+
+    def digests(self):
+        """返回已写入存储的全部内容哈希"""
+        with self._lock:
+            self._load()
+            return [digest for digest in self._meta if digest not in self._pending]
+
+    def result_path(self, result_id):
+        return os.path.join(self.directory, result_id[:2], f'{result_id}.result')
+
+    def save_result(self, digest, result):
+        """在后台把分析结果持久化到存储的配置旁，已存在时跳过"""
+        self._queue.put((self._write_result, (digest, result)))
+
+    def _write_result(self, digest, result):
+        path = self.result_path(result['id'])
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(encode_result(digest, result))
+        os.replace(tmp_path, path)
+        with self._index_lock:
+            with self._lock:
+                record = self._meta.get(digest)
+                if record is None:
+                    return
+                record = self._meta[digest] = dict(
+                    record, results=sorted(set(record.get('results', ())) | {result['id']}))
+            self._append_index(record)
+
+    def load_result(self, result_id):
+        """通过mmap读取持久化的分析结果，返回(版本是否一致, 内容哈希, 结果字典)
+
+        版本不一致或是旧格式的文件时不读取结果，结果字典为None；文件不存在时返回None。
+        JSON直接从mmap的切片解码，不复制文件内容；视图在关闭mmap之前释放。
+        """
+        try:
+            with open(self.result_path(result_id), 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, parser_version, ruleset_version, digest = RESULT_HEADER.unpack_from(mm)
+                if magic in RESULT_OUTDATED_MAGICS:
+                    return False, digest.hex(), None
+                if magic != RESULT_MAGIC:
+                    return None
+                if parser_version != PARSER_VERSION or ruleset_version != RULESET_VERSION:
+                    return False, digest.hex(), None
+                with memoryview(mm) as view, view[RESULT_HEADER.size:] as body:
+                    data = json.loads(str(body, 'utf-8'))
+                return True, digest.hex(), data
+        except (FileNotFoundError, ValueError, struct.error):
+            return None
+
+    def get(self, digest):
+        """按哈希读取配置内容，不存在时返回None"""
+        with self._lock:
+            self._load()
+            pending = self._pending.get(digest)
+            if digest not in self._meta:
+                return None
+        if isinstance(pending, StagedFile):
+            try:
+                with open(pending.path, 'r', encoding='utf-8', newline='') as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass
+        elif pending is not None:
+            return pending
+        try:
+            with gzip.open(self.path_for(digest), 'rb') as f:
+                return f.read().decode('utf-8')
+        except FileNotFoundError:
+            return None
+
+    def metadata(self, digest):
+        with self._lock:
+            self._load()
+            return self._meta.get(digest)
+
+    def evict(self):
+        """删除超过保留天数或超出数量上限的配置（按最后上传时间淘汰），并压缩索引文件
+
+        从最小堆中按最后上传时间取出记录，只检查需要淘汰的部分，不对全部记录排序。
+        """
+        cutoff = time.time() - self.retention_days * 86400 if self.retention_days else None
+        expired = []
+        with self._lock:
+            self._load()
+            skipped = []
+            while self._expiry:
+                last_seen, digest = self._expiry[0]
+                record = self._meta.get(digest)
+                if record is None or record['last_seen'] != last_seen:
+                    # 已淘汰或再次上传过的旧条目
+                    heapq.heappop(self._expiry)
+                    continue
+                if (cutoff is None or last_seen >= cutoff) and len(self._meta) <= self.max_entries:
+                    break
+                heapq.heappop(self._expiry)
+                if digest in self._pending:
+                    # 还没有写入的配置暂不淘汰
+                    skipped.append((last_seen, digest))
+                    continue
+                del self._meta[digest]
+                expired.append(record)
+            for item in skipped:
+                heapq.heappush(self._expiry, item)
+            if len(self._expiry) > 2 * len(self._meta) + 100:
+                self._rebuild_expiry()
+        if not expired:
+            return 0
+        for record in expired:
+            for listener in self.listeners:
+                listener.remove(record['hash'])
+            paths = [self.path_for(record['hash'])]
+            paths += [self.result_path(result_id) for result_id in record.get('results', ())]
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        self._rewrite_index()
+        logger.info(f'Evicted {len(expired)} stored configs')
+        return len(expired)
+
+    def _rewrite_index(self):
+        """用当前的元数据重写索引文件，每个哈希一行"""
+        with self._index_lock:
+            with self._lock:
+                records = list(self._meta.values())
+            tmp_path = f'{self.index_path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.index_path)
+            self._index_lines = len(records)
+
+    def flush(self):
+        """等待后台写入完成"""
+        if self._writer is not None:
+            self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {
+                'entries': len(self._meta),
+                'pending': len(self._pending),
+                'max_entries': self.max_entries,
+                'retention_days': self.retention_days,
+            }
+
+def index_stored_file(path):
+    """流式读取存储中gzip压缩的配置并切分成块索引，文件不存在时返回None"""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+            return index_file(f)
+    except FileNotFoundError:
+        return None
+
+# 持久化分析结果的文件头：魔数、解析器版本、规则集版本、配置内容的SHA-256
+RESULT_MAGIC = b'ACR2'
+RESULT_HEADER = struct.Struct('>4sHH32s')
+# 旧格式（ACR1为pickle）的结果视为过期，不读取内容，用存储的配置重新分析
+RESULT_OUTDATED_MAGICS = (b'ACR1',)
+
+def encode_result(digest, result):
+    """把分析结果序列化为 文件头 + UTF-8 JSON，config转换为字典"""
+    data = {
+        'id': result['id'],
+        'config': config_to_dict(result['config']),
+        'analysis': result['analysis'],
+        'diff': result['diff'],
+    }
+    header = RESULT_HEADER.pack(RESULT_MAGIC, PARSER_VERSION, RULESET_VERSION, bytes.fromhex(digest))
+    return header + json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+# 跨配置检索的词项前缀：命令行、profile（类型:名称）、SSID、VLAN
+SEARCH_KINDS = ('line', 'profile', 'ssid', 'vlan')
+
+# 命令行检索中表示任意内容的通配符
+SEARCH_WILDCARD_RE = re.compile(r'\s*(?:…|\.\.\.|\*)\s*')
+
+def search_tokens(line):
+    """把命令行切分成去掉引号的单词，用于检索匹配"""
+    return [token.strip('"') for token in line.split()]
+
+def search_terms(index):
+    """返回 {块头: [词项]}，词项为规范化的命令行、块名称、SSID和vlan-id"""
+    blocks = {}
+
+    def add(header, term):
+        blocks.setdefault(header, {})[term] = None
+
+    for block in index.blocks:
+        add(block.header, 'line:' + ' '.join(block.header.split()))
+        if block.name is not None:
+            add(block.header, f'profile:{block.type}:{block.name}')
+        for line in block.commands:
+            add(block.header, 'line:' + ' '.join(line.split()))
+            if block.type == 'wlan ssid-profile' and line.startswith('essid '):
+                essid = quoted_value(line) or line[6:].strip()
+                add(block.header, f'ssid:{essid}')
+    vlans = index.vlans
+    for vlan_id, block in vlans.definitions.items():
+        add(block.header, f'vlan:{vlan_id}')
+    for vlan_id, block in vlans.interfaces.items():
+        add(block.header, f'vlan:{vlan_id}')
+    for vlan_id, referencing in vlans.references.items():
+        for block in referencing:
+            add(block.header, f'vlan:{vlan_id}')
+    return {header: list(terms) for header, terms in blocks.items()}
+
+class SearchIndex:
+    """存储中所有配置的倒排索引：词项 -> {配置编号: 包含它的块头}
+
+    作为ConfigStore的listener，在配置写入存储时增量建立，保存在磁盘上的SQLite数据库中，
+    检索时只读取用到的词项，不把整个索引载入内存。命令行检索先用单词 -> 命令行的索引
+    求交集得到候选，再按单词顺序校验，不需要重新读取和解析配置文件。
+    连接在多个线程间共享，所有操作持有_lock。
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS docs (id INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE);
+        CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE);
+        CREATE TABLE IF NOT EXISTS postings (
+            term_id INTEGER NOT NULL, doc_id INTEGER NOT NULL, headers TEXT NOT NULL,
+            PRIMARY KEY (term_id, doc_id)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+        CREATE TABLE IF NOT EXISTS words (word TEXT NOT NULL, term_id INTEGER NOT NULL,
+            PRIMARY KEY (word, term_id)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS words_term ON words (term_id);
+        CREATE TABLE IF NOT EXISTS names (name TEXT NOT NULL, term_id INTEGER NOT NULL,
+            PRIMARY KEY (name, term_id)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS names_term ON names (term_id);
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._closed = False
+        self._backfill = None
+
+    def _connect(self):
+        """首次使用时打开数据库，删除旧版本的search.jsonl（由backfill从存储重新建立）"""
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            legacy_path = os.path.join(os.path.dirname(self.path), 'search.jsonl')
+            if os.path.exists(legacy_path):
+                os.remove(legacy_path)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(self.SCHEMA)
+            self._db.execute('CREATE TEMP TABLE query_terms (term_id INTEGER PRIMARY KEY, value TEXT)')
+            self._db.execute('CREATE TEMP TABLE new_terms (term TEXT PRIMARY KEY, headers TEXT)')
+        return self._db
+
+    def close(self):
+        """关闭数据库，之后的add/remove不再写入"""
+        with self._lock:
+            self._closed = True
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __contains__(self, digest):
+        with self._lock:
+            db = self._connect()
+            return db.execute('SELECT 1 FROM docs WHERE hash = ?', (digest,)).fetchone() is not None
+
+    def _remove(self, db, digest):
+        row = db.execute('SELECT id FROM docs WHERE hash = ?', (digest,)).fetchone()
+        if row is None:
+            return False
+        doc_id = row[0]
+        db.execute('DELETE FROM query_terms')
+        db.execute('INSERT INTO query_terms (term_id) SELECT term_id FROM postings WHERE doc_id = ?', (doc_id,))
+        db.execute('DELETE FROM postings WHERE doc_id = ?', (doc_id,))
+        db.execute('DELETE FROM docs WHERE id = ?', (doc_id,))
+        # 没有配置再使用的词项从单词和名称索引中移除
+        db.execute('DELETE FROM query_terms WHERE EXISTS (SELECT 1 FROM postings WHERE term_id = query_terms.term_id)')
+        for table in ('words', 'names', 'terms'):
+            column = 'id' if table == 'terms' else 'term_id'
+            db.execute(f'DELETE FROM {table} WHERE {column} IN (SELECT term_id FROM query_terms)')
+        return True
+
+    def add(self, digest, index):
+        """登记一个写入存储的配置，由ConfigStore的后台线程调用"""
+        locations = {}
+        for header, terms in search_terms(index).items():
+            for term in terms:
+                locations.setdefault(term, []).append(header)
+        with self._lock:
+            if self._closed:
+                return
+            db = self._connect()
+            db.execute('BEGIN')
+            try:
+                self._remove(db, digest)
+                doc_id = db.execute('INSERT INTO docs (hash) VALUES (?)', (digest,)).lastrowid
+                db.execute('DELETE FROM new_terms')
+                db.executemany('INSERT INTO new_terms (term, headers) VALUES (?, ?)',
+                               ((term, '\n'.join(headers)) for term, headers in locations.items()))
+                created = [term for term, in db.execute(
+                    'SELECT term FROM new_terms WHERE term NOT IN (SELECT term FROM terms)')]
+                for term in created:
+                    term_id = db.execute('INSERT INTO terms (term) VALUES (?)', (term,)).lastrowid
+                    kind, value = term.split(':', 1)
+                    if kind == 'line':
+                        db.executemany('INSERT OR IGNORE INTO words (word, term_id) VALUES (?, ?)',
+                                       ((token, term_id) for token in set(search_tokens(value))))
+                    elif kind == 'profile':
+                        db.execute('INSERT INTO names (name, term_id) VALUES (?, ?)',
+                                   (value.rsplit(':', 1)[-1], term_id))
+                db.execute('INSERT INTO postings (term_id, doc_id, headers) '
+                           'SELECT terms.id, ?, new_terms.headers FROM new_terms JOIN terms USING (term)', (doc_id,))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def remove(self, digest):
+        with self._lock:
+            if self._closed:
+                return
+            db = self._connect()
+            db.execute('BEGIN')
+            try:
+                self._remove(db, digest)
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def backfill(self, store):
+        """在后台为存储中还没有索引的配置建立索引（如升级前存储的配置），返回待索引的数量"""
+        with self._lock:
+            indexed = {digest for digest, in self._connect().execute('SELECT hash FROM docs')}
+            missing = [digest for digest in store.digests() if digest not in indexed]
+            if not missing or (self._backfill is not None and self._backfill.is_alive()):
+                return len(missing)
+
+            def run():
+                for digest in missing:
+                    index = store.parsed(digest)
+                    if index is not None and store.metadata(digest) is not None:
+                        self.add(digest, index)
+                logger.info(f'Indexed {len(missing)} stored configs for search')
+
+            self._backfill = threading.Thread(target=run, name='search-backfill', daemon=True)
+            self._backfill.start()
+            return len(missing)
+
+    def _line_terms(self, db, query):
+        """返回匹配检索语句的命令行词项，通配符匹配任意内容，其余单词按顺序连续出现"""
+        parts = [search_tokens(part) for part in SEARCH_WILDCARD_RE.split(query)]
+        parts = [part for part in parts if part]
+        words = {token for part in parts for token in part}
+        if not words:
+            return []
+        conditions = ' AND '.join(['id IN (SELECT term_id FROM words WHERE word = ?)'] * len(words))
+        candidates = db.execute(f'SELECT term FROM terms WHERE {conditions}', list(words))
+        return sorted(term for term, in candidates if tokens_match(search_tokens(term[5:]), parts))
+
+    def search(self, query, kind='line', profile_type=None, limit=100):
+        """按词项检索，返回 {'total': 配置数, 'matches': [(哈希, [(词项, 块头)])]}，按匹配数降序"""
+        with self._lock:
+            db = self._connect()
+            if kind == 'line':
+                terms = self._line_terms(db, query)
+            elif kind == 'profile':
+                if profile_type:
+                    terms = [f'profile:{profile_type}:{query}']
                 else:
-                    iot_radio_configs[profile_name] = commands
-                i = j
-        elif line.startswith('rf dot11-6GHz-radio-profile'):
-            parts = line.split('"')
-            if len(parts) >= 2:
-                profile_name = parts[1]
-                commands = []
-                j = i + 1
-                while j < len(lines) and not lines[j].strip().startswith('!'):
-                    current_line = lines[j].strip()
-                    if current_line:
-                        commands.append(current_line)
-                    j += 1
-                dot11_6ghz_configs[profile_name] = commands
-                i = j
-        i += 1
-
-    # 解析ap-group配置
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        if line.startswith('ap-group'):
-            parts = line.split('"')
-            if len(parts) >= 2:
-                group_name = parts[1]
-                current_ap_group = group_name
-                if current_ap_group not in config_dict:
-                    config_dict[current_ap_group] = {
-                        'profiles': {
-                            # 初始化时就添加默认的system-profile
-                            'ap-system-profile': {
-                                'default': {
-                                    'commands': ap_system_configs.get('default', [])
-                                }
-                            }
-                        },
-                        'commands': []
-                    }
-                
-                j = i + 1
-                while j < len(lines) and not lines[j].strip().startswith('!'):
-                    current_line = lines[j].strip()
-                    if current_line:
-                        is_profile = False
-                        # 检查是否是profile引用
-                        if current_line.startswith('ap-system-profile'):
-                            parts = current_line.split('"')
-                            if len(parts) >= 2:
-                                profile_name = parts[1]
-                                # 替换默认的system-profile
-                                config_dict[current_ap_group]['profiles']['ap-system-profile'] = {
-                                    profile_name: {
-                                        'commands': ap_system_configs.get(profile_name, [])
-                                    }
-                                }
-                            is_profile = True
-                        elif current_line.startswith('virtual-ap'):
-                            parts = current_line.split('"')
-                            if len(parts) >= 2:
-                                profile_name = parts[1]
-                                if 'virtual-ap' not in config_dict[current_ap_group]['profiles']:
-                                    config_dict[current_ap_group]['profiles']['virtual-ap'] = {}
-                                
-                                vap_config = virtual_ap_configs.get(profile_name, {
-                                    'commands': [],
-                                    'ssid_profile': None,
-                                    'aaa_profile': None
-                                })
-                                
-                                vap_entry = {
-                                    'commands': vap_config['commands'],
-                                    'ssid_profile': vap_config['ssid_profile'],
-                                    'aaa_profile': vap_config['aaa_profile']
-                                }
-                                
-                                config_dict[current_ap_group]['profiles']['virtual-ap'][profile_name] = vap_entry
-                            is_profile = True
-                        elif current_line.startswith('dot11a-radio-profile'):
-                            parts = current_line.split('"')
-                            if len(parts) >= 2:
-                                profile_name = parts[1]
-                                if 'dot11a-radio-profile' not in config_dict[current_ap_group]['profiles']:
-                                    config_dict[current_ap_group]['profiles']['dot11a-radio-profile'] = {}
-                                
-                                # 从dot11a_radio_configs获取完整配置
-                                radio_config = dot11a_radio_configs.get(profile_name, {})
-                                config_dict[current_ap_group]['profiles']['dot11a-radio-profile'][profile_name] = {
-                                    'commands': radio_config.get('commands', []),
-                                    'arm_profile': radio_config.get('arm_profile')
-                                }
-                            is_profile = True
-                        elif current_line.startswith('dot11g-radio-profile'):
-                            parts = current_line.split('"')
-                            if len(parts) >= 2:
-                                profile_name = parts[1]
-                                if 'dot11g-radio-profile' not in config_dict[current_ap_group]['profiles']:
-                                    config_dict[current_ap_group]['profiles']['dot11g-radio-profile'] = {}
-                                
-                                # 从dot11g_radio_configs获取完整配置
-                                radio_config = dot11g_radio_configs.get(profile_name, {})
-                                config_dict[current_ap_group]['profiles']['dot11g-radio-profile'][profile_name] = {
-                                    'commands': radio_config.get('commands', []),
-                                    'arm_profile': radio_config.get('arm_profile')
-                                }
-                            is_profile = True
-                        elif current_line.startswith('regulatory-domain-profile'):
-                            parts = current_line.split('"')
-                            if len(parts) >= 2:
-                                profile_name = parts[1]
-                                if 'regulatory-domain-profile' not in config_dict[current_ap_group]['profiles']:
-                                    config_dict[current_ap_group]['profiles']['regulatory-domain-profile'] = {}
-                                config_dict[current_ap_group]['profiles']['regulatory-domain-profile'][profile_name] = {
-                                    'commands': regulatory_domain_configs.get(profile_name, [])
-                                }
-                            is_profile = True
-                        elif current_line.startswith('iot radio-profile'):
-                            parts = current_line.split('"')
-                            if len(parts) >= 2:
-                                profile_name = parts[1]
-                                if 'iot radio-profile' not in config_dict[current_ap_group]['profiles']:
-                                    config_dict[current_ap_group]['profiles']['iot radio-profile'] = {}
-                                config_dict[current_ap_group]['profiles']['iot radio-profile'][profile_name] = {
-                                    'commands': iot_radio_configs.get(profile_name, [])
-                                }
-                            is_profile = True
-                        elif current_line.startswith('dot11-6GHz-radio-profile'):
-                            parts = current_line.split('"')
-                            if len(parts) >= 2:
-                                profile_name = parts[1]
-                                if 'dot11-6GHz-radio-profile' not in config_dict[current_ap_group]['profiles']:
-                                    config_dict[current_ap_group]['profiles']['dot11-6GHz-radio-profile'] = {}
-                                config_dict[current_ap_group]['profiles']['dot11-6GHz-radio-profile'][profile_name] = {
-                                    'commands': dot11_6ghz_configs.get(profile_name, [])
-                                }
-                            is_profile = True
-                        
-                        if not is_profile:
-                            config_dict[current_ap_group]['commands'].append(current_line)
-                    j += 1
-                i = j
-        i += 1
-    
-    return config_dict
+                    terms = sorted(term for term, in db.execute(
+                        'SELECT term FROM terms JOIN names ON names.term_id = terms.id WHERE name = ?', (query,)))
+            else:
+                terms = [f'{kind}:{query}']
+            db.execute('DELETE FROM query_terms')
+            db.executemany('INSERT INTO query_terms (term_id, value) SELECT id, ? FROM terms WHERE term = ?',
+                           ((term.split(':', 1)[1], term) for term in terms))
+            total = db.execute('SELECT COUNT(DISTINCT doc_id) FROM postings '
+                               'WHERE term_id IN (SELECT term_id FROM query_terms)').fetchone()[0]
+            # 先按匹配的词项数排序，只为返回的配置读取块头
+            top = db.execute('SELECT doc_id, docs.hash FROM postings JOIN docs ON docs.id = doc_id '
+                             'WHERE term_id IN (SELECT term_id FROM query_terms) '
+                             'GROUP BY doc_id ORDER BY COUNT(*) DESC, doc_id LIMIT ?', (limit,)).fetchall()
+            matches = []
+            for doc_id, digest in top:
+                found = db.execute('SELECT value, headers FROM query_terms '
+                                   'JOIN postings USING (term_id) WHERE doc_id = ? ORDER BY value',
+                                   (doc_id,)).fetchall()
+                matches.append((digest, [(value, tuple(headers.split('\n'))) for value, headers in found]))
+            return {'total': total, 'terms': len(terms), 'matches': matches}
+
+    def stats(self):
+        with self._lock:
+            db = self._connect()
+            return {
+                'configs': db.execute('SELECT COUNT(*) FROM docs').fetchone()[0],
+                'terms': db.execute('SELECT COUNT(*) FROM terms').fetchone()[0],
+                'words': db.execute('SELECT COUNT(DISTINCT word) FROM words').fetchone()[0],
+            }
+
+def tokens_match(tokens, parts):
+    """parts中的每组单词依次在tokens中连续出现"""
+    position = 0
+    for part in parts:
+        length = len(part)
+        while position + length <= len(tokens) and tokens[position:position + length] != part:
+            position += 1
+        if position + length > len(tokens):
+            return False
+        position += length
+    return True
+
+# 配置存储和检索索引，由init_app()创建
+config_store = None
+search_index = None
+
+def save_content(content, source='upload', filename=None, encoding=None, confidence=None):
+    """保存内容到配置存储，写入在后台完成，返回内容哈希"""
+    try:
+        return config_store.save(content, source, filename, encoding, confidence)
+    except Exception as e:
+        logger.error(f'Error saving content to file: {str(e)}')
+        return None
+
+# 分析规则使用的正则表达式，导入时预编译
+ARP_RATE_RE = re.compile(r'attack-rate\s+arp\s+\d+\s+drop')
+DEBUG_LOGGING_RE = re.compile(r'^logging\s.*debugging(?:\s|$)')
+
+def normalize_lines(config):
+    """去除每行首尾空白并移除空行，返回行列表"""
+    return [line.strip() for line in config.splitlines() if line.strip()]
+
+# 没有可用基线时使用的默认validuser ACL配置
+DEFAULT_VALIDUSER_ACL = tuple(normalize_lines("""
+    network 127.0.0.0 255.0.0.0 any any deny
+    network 169.254.0.0 255.255.0.0 any any deny
+    network 224.0.0.0 240.0.0.0 any any deny
+    host 255.255.255.255 any any deny
+    network 240.0.0.0 240.0.0.0 any any deny
+    any any any permit
+    ipv6 host fe80:: any any deny
+    ipv6 network fc00::/7 any any permit
+    ipv6 network fe80::/64 any any permit
+    ipv6 alias ipv6-reserved-range any any deny
+    ipv6 any any any permit"""))
+
+# 没有可用基线时使用的默认validusereth ACL配置
+DEFAULT_VALIDUSERETH_ACL = tuple(normalize_lines("""
+    permit any"""))
+
+def block_lines(block):
+    """返回块头和块内所有命令"""
+    yield block.header
+    yield from block.commands
+
+class AnalysisRule:
+    """声明式分析规则
+
+    block_type/block_name 指定规则适用的配置块，block_type为None时适用于所有块，
+    为元组时适用于其中任一类型的块。
+    condition(block) 返回True表示该块命中；when为'present'时有块命中即给出提示，
+    为'absent'时没有任何块命中才给出提示。
+    修改规则的逻辑后需要递增version，存储配置的统计分析只会重新执行版本变化的规则。
+    """
+
+    # 为False时规则不逐块处理，只在report中使用索引
+    visits_blocks = True
+
+    def __init__(self, name, message, condition=None, block_type=None, block_name=None,
+                 when='present', result_type='warning', version=1):
+        self.name = name
+        self.message = message
+        self.condition = condition
+        self.block_type = block_type
+        self.block_name = block_name
+        self.when = when
+        self.result_type = result_type
+        self.version = version
+
+    @property
+    def block_types(self):
+        """规则适用的块类型元组，适用于所有块时为None"""
+        if self.block_type is None or isinstance(self.block_type, tuple):
+            return self.block_type
+        return (self.block_type,)
+
+    def applies_to(self, block):
+        return self.block_name is None or block.name == self.block_name
+
+    def depends_on(self, block_types, blocks=()):
+        """block_types中的块变化后是否需要重新执行该规则，blocks为变化前后的块"""
+        if self.block_type is None:
+            return bool(block_types)
+        return any(block_type in block_types for block_type in self.block_types)
+
+    def start(self, context):
+        """每次分析开始时返回规则的初始状态"""
+        return False
+
+    def visit(self, state, block):
+        """处理一个适用的块，返回新的状态"""
+        return bool(self.condition(block))
+
+    def finished(self, state):
+        """状态已确定时返回True，之后的块不再交给该规则"""
+        return state is True
+
+    def report(self, state, context):
+        """根据最终状态生成提示列表"""
+        hit = state if self.when == 'present' else not state
+        if not hit:
+            return []
+        return [{'type': self.result_type, 'message': self.message}]
+
+# 已注册的分析规则，按注册顺序输出提示
+ANALYSIS_RULES = []
+
+# 规则集版本，修改或新增规则后需要递增，使缓存的分析结果失效
+RULESET_VERSION = 3
+
+def register_rule(rule):
+    """注册分析规则"""
+    ANALYSIS_RULES.append(rule)
+    return rule
+
+class BaselineBlockRule(AnalysisRule):
+    """与匹配的基线中同类型同名的块比较命令，不一致时给出提示
+
+    基线中没有该块或没有基线时，与default_commands比较。
+    """
+
+    def __init__(self, name, message, block_type, block_name, default_commands, version=1):
+        super().__init__(name, message, block_type=block_type, block_name=block_name, version=version)
+        self.default_commands = default_commands
+
+    def start(self, context):
+        # 状态为期望的命令列表，发现不一致后变为True
+        baseline = context.get('baseline')
+        if baseline is not None:
+            block = baseline.index.get(self.block_type, self.block_name)
+            if block is not None:
+                return block.commands
+        return self.default_commands
+
+    def visit(self, state, block):
+        return True if block.commands != state else state
+
+    def report(self, state, context):
+        return super().report(state is True, context)
+
+register_rule(BaselineBlockRule(
+    'validuser-acl',
+    'Default validuser acl may be changed, Please check.',
+    'ip access-list session', 'validuser', DEFAULT_VALIDUSER_ACL,
+))
+
+register_rule(BaselineBlockRule(
+    'validusereth-acl',
+    'Default validusereth acl may be changed, Please check.',
+    'ip access-list eth', 'validuserethacl', DEFAULT_VALIDUSERETH_ACL,
+))
+
+register_rule(AnalysisRule(
+    'firewall-arp',
+    'Suggest to control arp with command under firewall "attack-rate arp 50 drop"',
+    condition=lambda block: not any(ARP_RATE_RE.search(line) for line in block.commands),
+    block_type='firewall',
+))
+
+register_rule(AnalysisRule(
+    'firewall-tri-session',
+    'Suggest to use allow-tri-session under firewall for portal authentication',
+    condition=lambda block: not any('allow-tri-session' in line for line in block.commands),
+    block_type='firewall',
+))
+
+register_rule(AnalysisRule(
+    'debug-logging',
+    'Debug level logging exists, please check.',
+    condition=lambda block: DEBUG_LOGGING_RE.search(block.header),
+    block_type='logging',
+))
+
+class VlanBcmcRule(AnalysisRule):
+    """检查每个vlan对应的interface vlan是否配置了bcmc-optimization"""
+
+    # 只使用VLAN索引，不需要逐块处理
+    visits_blocks = False
+
+    def depends_on(self, block_types, blocks=()):
+        if 'vlan' in block_types or 'interface vlan' in block_types:
+            return True
+        # 其他块（如virtual-ap）中的 vlan <id> 行也计入VLAN索引
+        return any(vlan_id_of(line) is not None for block in blocks for line in block_lines(block))
+
+    def report(self, state, context):
+        vlans = context['index'].vlans
+        missing_bcmc = [str(vlan_id) for vlan_id in vlans.ids()
+                        if not vlans.interface_has(vlan_id, 'bcmc-optimization')]
+        if not missing_bcmc:
+            return []
+        vlan_list = ', '.join(missing_bcmc)
+        return [{
+            'type': self.result_type,
+            'message': f'VLAN {vlan_list} need to configure bcmc-optimization',
+            'vlans': [int(vlan_id) for vlan_id in missing_bcmc],
+        }]
+
+register_rule(VlanBcmcRule('vlan-bcmc', None))
+
+register_rule(AnalysisRule(
+    'spanning-tree',
+    'Spanning tree may be working',
+    condition=lambda block: any('no spanning-tree' in line for line in block_lines(block)),
+    # 只在接口和全局的no spanning-tree中查找，其他块变化时不需要重新执行
+    block_type=('interface gigabitethernet', 'interface port-channel', 'no spanning-tree'),
+    when='absent',
+    version=2,
+))
+
+def run_analysis(content, index=None, rules=None, baseline=None, by_rule=None):
+    """一次遍历所有配置块并执行适用的规则，返回(提示列表, 每条规则耗时秒数)
+
+    baseline为匹配的默认配置基线，与基线比较的规则会使用它。
+    by_rule为字典时按规则名称填入各规则的提示列表。
+    """
+    if index is None:
+        index = index_config(content)
+    if rules is None:
+        rules = ANALYSIS_RULES
+    context = {'content': content, 'index': index, 'baseline': baseline}
+
+    timings = {}
+    states = {}
+    rules_by_type = {}
+    generic_rules = []
+    for rule in rules:
+        started = time.perf_counter()
+        states[rule.name] = rule.start(context)
+        timings[rule.name] = time.perf_counter() - started
+        if not rule.visits_blocks:
+            continue
+        if rule.block_type is None:
+            generic_rules.append(rule)
+        else:
+            for block_type in rule.block_types:
+                rules_by_type.setdefault(block_type, []).append(rule)
+
+    # 每种块类型适用的规则列表，未登记的类型只执行通用规则
+    dispatch = {block_type: type_rules + generic_rules for block_type, type_rules in rules_by_type.items()}
+    if generic_rules:
+        blocks = index.blocks
+    else:
+        # 没有通用规则时只遍历规则适用类型的块
+        blocks = [block for block_type in dispatch for block in index.of_type(block_type)]
+    for block in blocks:
+        for rule in dispatch.get(block.type, generic_rules):
+            state = states[rule.name]
+            if rule.finished(state) or not rule.applies_to(block):
+                continue
+            started = time.perf_counter()
+            states[rule.name] = rule.visit(state, block)
+            timings[rule.name] += time.perf_counter() - started
+
+    analysis_results = []
+    for rule in rules:
+        started = time.perf_counter()
+        rule_results = rule.report(states[rule.name], context)
+        analysis_results.extend(rule_results)
+        if by_rule is not None:
+            by_rule[rule.name] = rule_results
+        timings[rule.name] += time.perf_counter() - started
+
+    for name, seconds in timings.items():
+        RULE_SECONDS.observe(seconds, rule=name)
+    return analysis_results, timings
+
+def analyze_config(content, index=None, baseline=None, by_rule=None):
+    """分析配置并生成AI提示"""
+    analysis_results, timings = run_analysis(content, index, baseline=baseline, by_rule=by_rule)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Rule timings: %s', ', '.join(f'{name}={seconds * 1000:.2f}ms' for name, seconds in timings.items()))
+    return analysis_results
+
+class ResultCache:
+    """按内容哈希缓存解析和分析结果的LRU缓存，超过容量或过期的条目会被淘汰"""
+
+    def __init__(self, max_size=32, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """返回缓存的结果，不存在或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if not self.ttl or time.monotonic() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """保存结果，超过容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """返回缓存命中统计"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+# 分析结果缓存，以及result.html按需加载使用的ap-group树（按结果id缓存），由init_app()创建
+result_cache = None
+tree_cache = None
+
+class AdmissionController:
+    """限制同时进行的解析分析数量，超出时在有界队列中等待，队列已满或等待超时则拒绝
+
+    已经接受的后台任务以blocking方式获取，不受队列长度和超时限制，一直等到有空闲名额。
+    """
+
+    def __init__(self, max_concurrent=2, max_waiting=8, timeout=10):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.completed = 0
+        self._cond = threading.Condition()
+
+    def retry_after(self):
+        """按平均处理时间估算排队中的请求都完成所需的秒数"""
+        average = self.busy_seconds / self.completed if self.completed else 1.0
+        return max(1, int(average * (self.waiting + 1) / self.max_concurrent + 0.999))
+
+    def acquire(self, blocking=False):
+        """获取一个处理名额，返回获取时刻；无法获取时抛出OverloadedError"""
+        start = time.perf_counter()
+        with self._cond:
+            if self.in_flight >= self.max_concurrent:
+                if not blocking and self.waiting >= self.max_waiting:
+                    self.rejected += 1
+                    raise OverloadedError('Server is busy, please retry later', self.retry_after())
+                self.waiting += 1
+                try:
+                    admitted = self._cond.wait_for(lambda: self.in_flight < self.max_concurrent,
+                                                   None if blocking else self.timeout)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self.timed_out += 1
+                    raise OverloadedError('Server is busy, please retry later', self.retry_after())
+            self.in_flight += 1
+            self.admitted += 1
+            now = time.perf_counter()
+            self.wait_seconds += now - start
+            self.max_wait_seconds = max(self.max_wait_seconds, now - start)
+            return now
+
+    def release(self, started):
+        with self._cond:
+            self.in_flight -= 1
+            self.completed += 1
+            self.busy_seconds += time.perf_counter() - started
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, blocking=False):
+        started = self.acquire(blocking)
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    def stats(self):
+        """返回并发数、队列深度和等待时间统计"""
+        with self._cond:
+            return {
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_waiting': self.max_waiting,
+                'timeout': self.timeout,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_wait_seconds': round(self.wait_seconds / self.admitted, 6) if self.admitted else 0.0,
+                'max_wait_seconds': round(self.max_wait_seconds, 6),
+                'avg_busy_seconds': round(self.busy_seconds / self.completed, 6) if self.completed else 0.0,
+            }
+
+# 解析分析的并发限制，由init_app()创建
+admission = None
+
+def content_hash(content):
+    """计算配置内容的SHA-256哈希"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def block_fingerprint(block):
+    """块内容的短哈希，用于判断两个块是否相同，计算后缓存在块上"""
+    if block.fingerprint is None:
+        text = '\n'.join((block.header,) + block.commands)
+        block.fingerprint = hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+    return block.fingerprint
+
+def keyed_blocks(blocks):
+    """按(类型, 名称)为块建立键，没有名称的块用块头区分，重复出现的块在键后追加序号"""
+    keyed = {}
+    seen = {}
+    for block in blocks:
+        key = (block.type, block.name if block.name is not None else block.header)
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        keyed[key if count == 0 else key + (count + 1,)] = block
+    return keyed
+
+def missing_lines(lines, other):
+    """按出现次数返回lines中有而other中没有的行，保持原顺序"""
+    remaining = Counter(other)
+    result = []
+    for line in lines:
+        if remaining[line] > 0:
+            remaining[line] -= 1
+        else:
+            result.append(line)
+    return result
+
+def diff_configs(index, baseline):
+    """按块比较上传配置与基线
+
+    块按(类型, 名称)匹配，与块的顺序无关。只返回新增、删除和修改的块，
+    未变化的块只保留指纹。
+    """
+    blocks = []
+    unchanged = []
+    matched = set()
+    for key, block in keyed_blocks(index.blocks).items():
+        fingerprint = block_fingerprint(block)
+        baseline_block = baseline.blocks_by_key.get(key)
+        if baseline_block is None:
+            blocks.append({
+                'status': 'added',
+                'header': block.header,
+                'uploaded': block.commands,
+                'baseline': None,
+            })
+            continue
+        matched.add(key)
+        if baseline.fingerprints[key] == fingerprint:
+            unchanged.append(fingerprint)
+            continue
+        blocks.append({
+            'status': 'changed',
+            'header': block.header,
+            'uploaded': block.commands,
+            'baseline': baseline_block.commands,
+            'added_lines': missing_lines(block.commands, baseline_block.commands),
+            'removed_lines': missing_lines(baseline_block.commands, block.commands),
+        })
+
+    for key, baseline_block in baseline.blocks_by_key.items():
+        if key not in matched:
+            blocks.append({
+                'status': 'removed',
+                'header': baseline_block.header,
+                'uploaded': None,
+                'baseline': baseline_block.commands,
+            })
+
+    summary = Counter(block['status'] for block in blocks)
+    return {
+        'baseline_version': baseline.version,
+        'summary': {
+            'added': summary['added'],
+            'removed': summary['removed'],
+            'changed': summary['changed'],
+            'unchanged': len(unchanged),
+        },
+        'blocks': blocks,
+        'unchanged': unchanged,
+    }
+
+def result_id_for(content, baseline=None, digest=None):
+    """由内容哈希、规则集版本和基线内容哈希计算分析结果的id，digest为已算好的内容哈希"""
+    baseline_version = baseline.fingerprint if baseline is not None else ''
+    if digest is None:
+        digest = content_hash(content)
+    return content_hash(f'{digest}:{RULESET_VERSION}:{baseline_version}')
+
+def analyze_content(content, baseline=None, progress=None, index=None, digest=None,
+                    blocking=False, accepted=None):
+    """解析并分析配置，返回包含id、config、graph、analysis和diff的结果字典
+
+    结果id由内容哈希、规则集版本和基线内容哈希计算，相同的上传直接返回缓存，
+    返回的结构在多个请求间共享，调用方不能修改。
+    progress(stage) 在进入admission、parse、analyze、diff各阶段时调用，admission阶段记录等待名额的时间。
+    解析分析受admission限制并发，繁忙时抛出OverloadedError；blocking为True时一直等待名额。
+    accepted() 在确定会返回结果时调用一次：缓存命中时立即调用，否则在获得名额后调用，
+    用于只在请求被接受后才保存和计数。
+    流式读取的配置content为None，传入内容哈希digest，index为获得名额后建立块索引的函数。
+    """
+    if digest is None:
+        digest = content_hash(content)
+    if accepted is None:
+        accepted = lambda: None
+    result_id = result_id_for(content, baseline, digest)
+    cached = result_cache.get(result_id)
+    if cached is not None:
+        logger.debug('Result cache hit: %s', result_id)
+        accepted()
+        return cached
+
+    if progress is None:
+        progress = lambda stage: None
+    progress('admission')
+    with admission.slot(blocking):
+        accepted()
+        # 等待期间相同内容可能已被其他请求分析完成
+        cached = result_cache.get(result_id)
+        if cached is not None:
+            return cached
+        progress('parse')
+        if callable(index):
+            config_index = index()
+        else:
+            config_index = index if index is not None else index_config(content)
+        profile_graph = ProfileGraph(config_index)
+        config = profile_graph.flatten()
+        progress('analyze')
+        rule_results = {}
+        analysis_results = analyze_config(content or '', config_index, baseline, rule_results)
+        progress('diff')
+        result = {
+            'id': result_id,
+            'digest': digest,
+            'baseline_fingerprint': baseline.fingerprint if baseline is not None else None,
+            'config': config,
+            'graph': profile_graph,
+            'analysis': analysis_results,
+            'rule_results': rule_results,
+            'diff': diff_configs(config_index, baseline) if baseline is not None else None,
+        }
+        result_cache.put(result_id, result)
+    return result
+
+def changed_blocks(previous_blocks, blocks):
+    """按(类型, 名称)比较两组块，返回(新增, 删除, 修改, 修改前)的块列表"""
+    previous_blocks = keyed_blocks(previous_blocks)
+    blocks = keyed_blocks(blocks)
+    added = []
+    changed = []
+    replaced = []
+    for key, block in blocks.items():
+        previous_block = previous_blocks.get(key)
+        if previous_block is None:
+            added.append(block)
+        elif previous_block.header != block.header or previous_block.commands != block.commands:
+            changed.append(block)
+            replaced.append(previous_block)
+    removed = [block for key, block in previous_blocks.items() if key not in blocks]
+    return added, removed, changed, replaced
+
+def patch_index(previous_index, previous_content, content):
+    """在上一次的块索引上只重新切分变化的行，返回(块索引, 被替换的旧块, 重新切分的块)
+
+    比较新旧配置的行得到首尾相同的部分，从第一处变化所在块的块头开始重新切分，
+    直到越过变化的行并遇到!为止，其余的块沿用上一次的块对象，只平移起始行号。
+    重新切分得到的块与被替换的块内容相同时也沿用旧对象。上一次的索引与
+    previous_content的行数对不上时返回None，由调用方完整建立索引。
+    """
+    previous_lines = previous_content.splitlines()
+    if previous_index.starts is None or previous_index.line_count != len(previous_lines):
+        return None
+    lines = content.splitlines()
+    limit = min(len(previous_lines), len(lines))
+    prefix = 0
+    while prefix < limit and previous_lines[prefix] == lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and previous_lines[-1 - suffix] == lines[-1 - suffix]:
+        suffix += 1
+    changed_end = len(lines) - suffix
+    shift = len(lines) - len(previous_lines)
+
+    # 第一处变化所在的块；前面的块没有命令时，下一行顶格行之前它仍是当前块，需要一起重新切分
+    starts = previous_index.starts
+    blocks = previous_index.blocks
+    first = max(0, bisect.bisect_right(starts, prefix + 1) - 1)
+    while first > 0 and not blocks[first - 1].commands:
+        first -= 1
+    restart = starts[first] - 1 if first < len(starts) and starts[first] <= prefix + 1 else prefix
+
+    # 越过变化的行后遇到!时新旧配置都回到块外，之后的行切分结果相同
+    end = changed_end
+    while end < len(lines) and not lines[end].strip().startswith('!'):
+        end += 1
+    end = min(end + 1, len(lines))
+    resume = bisect.bisect_right(starts, end - shift) if end < len(lines) else len(blocks)
+
+    builder = IndexBuilder(restart)
+    builder.feed_lines(lines[restart:end])
+    fresh = builder.finish()
+    replaced = blocks[first:resume]
+    previous_keyed = keyed_blocks(replaced)
+    new_blocks = []
+    for key, block in keyed_blocks(fresh.blocks).items():
+        previous_block = previous_keyed.get(key)
+        if previous_block is not None and previous_block.header == block.header \
+                and previous_block.commands == block.commands:
+            block = previous_block
+        new_blocks.append(block)
+
+    index = ConfigIndex(blocks[:first] + new_blocks + blocks[resume:],
+                        starts[:first] + fresh.starts + [start + shift for start in starts[resume:]])
+    index.line_count = len(lines)
+    return index, replaced, new_blocks
+
+def has_named_blocks(index, block_type):
+    return any(block.name is not None for block in index.of_type(block_type))
+
+def reanalyze_content(previous, content, baseline=None, accepted=None, previous_content=None):
+    """在上一次的分析结果上增量分析修改后的配置，返回(结果, 变化)
+
+    只重新切分变化的行所在的块，只重新展开读取过变化节点的ap-group，只重新执行依赖变化块类型的规则。
+    previous_content为上一次的配置内容，未传入时从存储读取，都没有时完整建立块索引。
+    基线不同，或某种块类型整体出现/消失（影响引用关键字的解析）时退回完整分析。
+    accepted() 在获得处理名额后调用一次，繁忙被拒绝时不会调用。
+    """
+    digest = content_hash(content)
+    result_id = result_id_for(content, baseline, digest)
+    if previous_content is None:
+        previous_content = config_store.get(previous['digest'])
+    rules = []
+    with admission.slot():
+        if accepted is not None:
+            accepted()
+        previous_index = previous['graph'].index
+        patched = patch_index(previous_index, previous_content, content) if previous_content is not None else None
+        if patched is not None:
+            index, previous_blocks, blocks = patched
+        else:
+            index = index_config(content)
+            previous_blocks, blocks = previous_index.blocks, index.blocks
+        added, removed, changed, replaced = changed_blocks(previous_blocks, blocks)
+        touched = added + removed + changed
+        changed_types = {block.type for block in touched}
+        changed_keys = {(block.type, block.name) for block in touched if block.name is not None}
+        incremental = (
+            previous['baseline_fingerprint'] == (baseline.fingerprint if baseline is not None else None)
+            and all(has_named_blocks(previous_index, block_type) == has_named_blocks(index, block_type)
+                    for block_type in changed_types)
+        )
+
+        result = result_cache.get(result_id)
+        if result is None:
+            profile_graph = ProfileGraph(index)
+            if incremental:
+                config = profile_graph.flatten((previous['graph'], previous['config']), changed_keys)
+                rules = [rule for rule in ANALYSIS_RULES if rule.depends_on(changed_types, touched + replaced)]
+                rule_results = dict(previous['rule_results'])
+            else:
+                config = profile_graph.flatten()
+                rules = ANALYSIS_RULES
+                rule_results = {}
+            run_analysis(content, index, rules, baseline, rule_results)
+            result = {
+                'id': result_id,
+                'digest': digest,
+                'baseline_fingerprint': previous['baseline_fingerprint'] if incremental else (
+                    baseline.fingerprint if baseline is not None else None),
+                'config': config,
+                'graph': profile_graph,
+                'analysis': [item for rule in ANALYSIS_RULES for item in rule_results.get(rule.name, ())],
+                'rule_results': rule_results,
+                'diff': diff_configs(index, baseline) if baseline is not None else None,
+            }
+            result_cache.put(result_id, result)
+
+    previous_config = previous['config']
+    delta = {
+        'incremental': incremental,
+        'blocks': {
+            'added': [block.header for block in added],
+            'removed': [block.header for block in removed],
+            'changed': [block.header for block in changed],
+        },
+        'warnings': {
+            'added': [item for item in result['analysis'] if item not in previous['analysis']],
+            'resolved': [item for item in previous['analysis'] if item not in result['analysis']],
+        },
+        # 沿用的ap-group与上一次是同一个对象
+        'groups': {
+            'reparsed': [name for name, entry in result['config'].items() if previous_config.get(name) is not entry],
+            'removed': [name for name in previous_config if name not in result['config']],
+        },
+        'rules_rerun': [rule.name for rule in rules],
+    }
+    return result, delta
+
+# 配置开头的版本行，如 "version 8.12"
+VERSION_RE = re.compile(r'^\ufeff?version\s+(\S+)', re.MULTILINE)
+
+def detect_version(content):
+    """从配置开头的version行读取ArubaOS版本，找不到时返回None"""
+    match = VERSION_RE.search(content, 0, 4096)
+    if match:
+        return match.group(1)
+    return None
+
+def version_tuple(version):
+    """把 "8.12.0.1" 这样的版本号转换为数字元组"""
+    return tuple(int(part) for part in re.findall(r'\d+', version or ''))
+
+class Baseline:
+    """一份默认配置基线，加载时即切分成块并建立索引"""
+
+    def __init__(self, path, content, mtime):
+        self.path = path
+        self.content = content
+        self.mtime = mtime
+        self.index = index_config(content)
+        self.version = detect_version(content)
+        self.fingerprint = content_hash(content)
+        # 预先计算每个块的键和指纹，供差异比较使用
+        self.blocks_by_key = keyed_blocks(self.index.blocks)
+        self.fingerprints = {key: block_fingerprint(block) for key, block in self.blocks_by_key.items()}
+
+    def __repr__(self):
+        return f'Baseline({os.path.basename(self.path)!r}, version={self.version!r})'
+
+class BaselineRegistry:
+    """默认配置基线注册表，按ArubaOS版本索引
+
+    启动时加载目录下所有 *default.log，之后最多每check_interval秒检查一次文件修改时间，
+    只重新加载有变化的文件。
+    """
+
+    def __init__(self, directory, pattern='default.log', check_interval=5):
+        self.directory = directory
+        self.pattern = pattern
+        self.check_interval = check_interval
+        self._baselines = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """重新扫描目录，加载新增或修改过的基线文件"""
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            baselines = {}
+            try:
+                entries = [entry for entry in os.scandir(self.directory)
+                           if entry.is_file() and entry.name.endswith(self.pattern)]
+            except OSError as e:
+                logger.error(f'Error scanning baseline directory: {str(e)}')
+                return
+            for entry in entries:
+                mtime = entry.stat().st_mtime
+                baseline = self._baselines.get(entry.path)
+                if baseline is None or baseline.mtime != mtime:
+                    try:
+                        with open(entry.path, 'r', encoding='utf-8-sig') as f:
+                            baseline = Baseline(entry.path, f.read(), mtime)
+                    except (OSError, UnicodeDecodeError) as e:
+                        logger.error(f'Error loading baseline {entry.name}: {str(e)}')
+                        continue
+                    logger.info(f'Baseline loaded: {entry.name} (version {baseline.version})')
+                baselines[entry.path] = baseline
+            self._baselines = baselines
+
+    def fingerprints(self):
+        """返回所有已加载基线的内容哈希"""
+        return sorted(b.fingerprint for b in self._baselines.values())
+
+    def versions(self):
+        """返回所有已加载基线的版本"""
+        return sorted((b.version for b in self._baselines.values()), key=version_tuple)
 
-def get_counter():
-    """获取处理次数"""
-    counter_file = os.path.join('templates', 'counters')
-    try:
-        with open(counter_file, 'r') as f:
-            counter = int(f.read().strip() or '0')
-            logger.info(f'Counter read: {counter}')
-            return counter
-    except (FileNotFoundError, ValueError) as e:
-        logger.warning(f'Error reading counter: {str(e)}')
-        return 0
+    def match(self, version):
+        """返回与version最接近的基线，没有基线时返回None
 
-def increment_counter():
-    """增加处理次数并保存"""
-    counter_file = os.path.join('templates', 'counters')
+        先比较主版本号，再依次比较次版本号等；version为空时返回最新的基线。
+        """
+        self.refresh()
+        baselines = list(self._baselines.values())
+        if not baselines:
+            return None
+        target = version_tuple(version)
+        if not target:
+            return max(baselines, key=lambda b: version_tuple(b.version))
+
+        def distance(baseline):
+            current = version_tuple(baseline.version)
+            length = max(len(current), len(target))
+            current = current + (0,) * (length - len(current))
+            padded = target + (0,) * (length - len(target))
+            return tuple(abs(a - b) for a, b in zip(current, padded)), tuple(-part for part in current)
+
+        return min(baselines, key=distance)
+
+# 默认配置基线注册表，由init_app()创建
+baselines = None
+
+# 候选编码及按样本判断时的置信度，gb2312是gbk的子集，不再单独尝试
+UPLOAD_ENCODINGS = [('utf-8', 0.99), ('gbk', 0.8), ('gb18030', 0.7), ('big5', 0.6), ('latin1', 0.1)]
+
+# 字节顺序标记，解码时一并去除
+ENCODING_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# 判断编码时采样的字节数
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+def detect_encoding(data):
+    """根据BOM和开头的样本判断编码，返回(编码, 置信度)"""
+    for bom, encoding in ENCODING_BOMS:
+        if data.startswith(bom):
+            return encoding, 1.0
+    sample = data[:ENCODING_SAMPLE_SIZE]
+    if sample.isascii():
+        return 'utf-8', 1.0 if len(sample) == len(data) else 0.99
+    for encoding, confidence in UPLOAD_ENCODINGS:
+        # 增量解码器允许样本末尾截断的多字节字符
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=len(sample) == len(data))
+        except UnicodeDecodeError:
+            continue
+        return encoding, confidence
+    return 'latin1', 0.1
+
+def decode_upload(data):
+    """判断编码后整体解码一次，返回(内容, 编码, 置信度)，无法解码时内容为None
+
+    样本之后才出现非法字节时，依次尝试其余候选编码。
+    """
+    encoding, confidence = detect_encoding(data)
     try:
-        counter = get_counter() + 1
-        with open(counter_file, 'w') as f:
-            f.write(str(counter))
-        logger.info(f'Counter incremented to: {counter}')
-        return counter
-    except Exception as e:
-        logger.error(f'Error incrementing counter: {str(e)}')
-        return 0
-
-def save_content(content):
-    """保存内容到data目录，使用时间戳作为文件名"""
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"{timestamp}.log"
-    filepath = os.path.join(data_dir, filename)
-    
+        content = data.decode(encoding)
+    except UnicodeDecodeError:
+        content = None
+        for candidate, candidate_confidence in UPLOAD_ENCODINGS:
+            if candidate == encoding:
+                continue
+            try:
+                content = data.decode(candidate)
+            except UnicodeDecodeError:
+                continue
+            encoding, confidence = candidate, min(confidence, candidate_confidence) / 2
+            break
+        if content is None:
+            return None, None, 0.0
+    request_logger.info('Successfully decoded file using %s encoding (confidence %s)', encoding, confidence)
+    return content, encoding, confidence
+
+def decode_content(data):
+    """解码上传内容，无法解码时返回None"""
+    return decode_upload(data)[0]
+
+# 流式读取上传文件时每次读取的字节数
+INGEST_CHUNK_SIZE = 256 * 1024
+# 保留开头多少个字符用于识别版本和主机名
+INGEST_HEAD_SIZE = 64 * 1024
+
+class IngestedConfig:
+    """流式读取的上传配置：内容哈希和开头部分的文本，UTF-8原文暂存在staged_path
+
+    块索引在结果缓存未命中、获得处理名额后才由build_index()从暂存文件建立。
+    """
+    __slots__ = ('digest', 'size', 'head', 'encoding', 'confidence', 'staged_path')
+
+    def __init__(self, digest, size, head, staged_path):
+        self.digest = digest
+        self.size = size
+        self.head = head
+        self.staged_path = staged_path
+        self.encoding = None
+        self.confidence = 0.0
+
+    def build_index(self):
+        with open(self.staged_path, 'r', encoding='utf-8', newline='') as f:
+            return index_file(f)
+
+def _ingest_with(stream, encoding, staging_dir):
+    """用指定编码增量解码整个流，遇到非法字节时抛出UnicodeDecodeError"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    hasher = hashlib.sha256()
+    head = ''
+    size = 0
+    fd, staged_path = tempfile.mkstemp(suffix='.staged', dir=staging_dir)
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(content)
-        logger.info(f'Content saved to file: {filename}')
-        return filename
-    except Exception as e:
-        logger.error(f'Error saving content to file: {str(e)}')
-        return None
+        with os.fdopen(fd, 'wb') as staged:
+            while True:
+                data = stream.read(INGEST_CHUNK_SIZE)
+                final = not data
+                text = decoder.decode(data, final)
+                if text:
+                    encoded = text.encode('utf-8')
+                    hasher.update(encoded)
+                    staged.write(encoded)
+                    size += len(text)
+                    if len(head) < INGEST_HEAD_SIZE:
+                        head += text[:INGEST_HEAD_SIZE - len(head)]
+                if final:
+                    break
+    except BaseException:
+        os.remove(staged_path)
+        raise
+    return IngestedConfig(hasher.hexdigest(), size, head, staged_path)
 
-def analyze_config(content):
-    """分析配置并生成AI提示"""
-    analysis_results = []
-    
-    # 规范化字符串比较：移除多余空白字符，统一换行
-    def normalize_config(config):
-        # 分割行，去除每行首尾空白，移除空行
-        lines = [line.strip() for line in config.splitlines() if line.strip()]
-        # 重新组合成字符串
-        return '\n'.join(lines)
-    
-    # 定义默认的validuser ACL配置
-    default_validuser_acl = """ip access-list session validuser
-    network 127.0.0.0 255.0.0.0 any any deny
-    network 169.254.0.0 255.255.0.0 any any deny
-    network 224.0.0.0 240.0.0.0 any any deny
-    host 255.255.255.255 any any deny
-    network 240.0.0.0 240.0.0.0 any any deny
-    any any any permit
-    ipv6 host fe80:: any any deny
-    ipv6 network fc00::/7 any any permit
-    ipv6 network fe80::/64 any any permit
-    ipv6 alias ipv6-reserved-range any any deny
-    ipv6 any any any permit"""
-    
-    # 定义默认的validusereth ACL配置
-    default_validusereth_acl = """ip access-list eth validuserethacl
-    permit any"""
-    
-    # 检查validuser ACL配置
-    validuser_start = content.find('ip access-list session validuser')
-    if validuser_start >= 0:
-        validuser_end = content.find('!', validuser_start)
-        if validuser_end >= 0:
-            actual_acl = content[validuser_start:validuser_end].strip()
-            if normalize_config(actual_acl) != normalize_config(default_validuser_acl):
-                analysis_results.append({
-                    'type': 'warning',
-                    'message': 'Default validuser acl may be changed, Please check.'
-                })
-    
-    # 检查validusereth ACL配置
-    validusereth_start = content.find('ip access-list eth validuserethacl')
-    if validusereth_start >= 0:
-        validusereth_end = content.find('!', validusereth_start)
-        if validusereth_end >= 0:
-            actual_eth_acl = content[validusereth_start:validusereth_end].strip()
-            if normalize_config(actual_eth_acl) != normalize_config(default_validusereth_acl):
-                analysis_results.append({
-                    'type': 'warning',
-                    'message': 'Default validusereth acl may be changed, Please check.'
-                })
-    
-    # 检查arp配置
-    def check_arp_config(text):
-        # 在firewall段落中查找arp配置
-        firewall_start = text.find('firewall')
-        if firewall_start >= 0:
-            firewall_end = text.find('!', firewall_start)
-            if firewall_end >= 0:
-                firewall_section = text[firewall_start:firewall_end]
-                # 使用正则表达式检查是否存在arp配置
-                import re
-                arp_pattern = r'attack-rate\s+arp\s+\d+\s+drop'
-                if not re.search(arp_pattern, firewall_section):
-                    return True
-        return False
-    
-    # 检查arp配置
-    if check_arp_config(content):
-        analysis_results.append({
-            'type': 'warning',
-            'message': 'Suggest to control arp with command under firewall "attack-rate arp 50 drop"'
-        })
-    
-    # 检查allow-tri-session配置
-    def check_tri_session_config(text):
-        # 在firewall段落中查找配置
-        firewall_start = text.find('firewall')
-        if firewall_start >= 0:
-            firewall_end = text.find('!', firewall_start)
-            if firewall_end >= 0:
-                firewall_section = text[firewall_start:firewall_end]
-                # 检查是否存在allow-tri-session配置
-                if 'allow-tri-session' not in firewall_section:
-                    return True
-        return False
-    
-    # 检查allow-tri-session配置
-    if check_tri_session_config(content):
-        analysis_results.append({
-            'type': 'warning',
-            'message': 'Suggest to use allow-tri-session under firewall for portal authentication'
-        })
-    
-    # 检查debug日志配置
-    def check_debug_logging(text):
-        # 使用正则表达式检查是否存在debug日志配置
-        import re
-        debug_pattern = r'logging\s+.*\s*debugging\s+'
-        if re.search(debug_pattern, text):
-            return True
-        return False
-    
-    # 检查debug日志配置
-    if check_debug_logging(content):
-        analysis_results.append({
-            'type': 'warning',
-            'message': 'Debug level logging exists, please check.'
-        })
-    
-    # 检查VLAN配置
-    def check_vlan_config(text):
-        import re
-        # 提取所有vlan配置中的vlan-id
-        # 使用更严格的模式匹配：行首可有空格，然后是"vlan"，然后是空格，然后是1-4096的数字，然后是行尾或空格
-        vlan_pattern = r'^\s*vlan\s+(\d+)(?:\s|$)'
-        vlan_ids = []
-        
-        # 逐行检查，确保严格匹配
-        for line in text.splitlines():
-            match = re.match(vlan_pattern, line)
-            if match:
-                vlan_id = int(match.group(1))
-                # 验证vlan-id范围
-                if 1 <= vlan_id <= 4096:
-                    vlan_ids.append(str(vlan_id))
-        
-        # 检查每个vlan-id的interface配置
-        missing_bcmc = []
-        for vlan_id in vlan_ids:
-            # 查找interface vlan配置
-            interface_pattern = f'interface vlan {vlan_id}'
-            interface_start = text.find(interface_pattern)
-            
-            if interface_start < 0:
-                missing_bcmc.append(vlan_id)
-                continue
-                
-            # 查找该interface的配置块结束位置
-            interface_end = text.find('!', interface_start)
-            if interface_end < 0:
-                interface_end = len(text)
-            
-            # 检查配置块中是否有bcmc-optimization
-            interface_config = text[interface_start:interface_end]
-            if 'bcmc-optimization' not in interface_config:
-                missing_bcmc.append(vlan_id)
-        
-        return sorted(missing_bcmc)  # 返回排序后的列表
-    
-    # 检查VLAN配置并生成提示
-    missing_bcmc_vlans = check_vlan_config(content)
-    if missing_bcmc_vlans:
-        vlan_list = ', '.join(missing_bcmc_vlans)
-        analysis_results.append({
-            'type': 'warning',
-            'message': f'VLAN {vlan_list} need to configure bcmc-optimization'
-        })
-    
-    # 检查spanning-tree配置
-    def check_spanning_tree(text):
-        # 检查是否存在no spanning-tree配置
-        return 'no spanning-tree' not in text
-    
-    # 检查spanning-tree配置
-    if check_spanning_tree(content):
-        analysis_results.append({
-            'type': 'warning',
-            'message': 'Spanning tree may be working'
-        })
-    
-    return analysis_results
+def ingest_stream(stream, staging_dir):
+    """分块读取上传文件，增量解码并计算内容哈希、暂存UTF-8原文，不建立块索引
+
+    编码按开头的样本判断，之后出现非法字节时回到开头换下一个候选编码。
+    无法解码时返回None。
+    """
+    sample = stream.read(ENCODING_SAMPLE_SIZE)
+    encoding, confidence = detect_encoding(sample)
+    candidates = [(encoding, confidence)]
+    candidates += [(candidate, min(confidence, candidate_confidence) / 2)
+                   for candidate, candidate_confidence in UPLOAD_ENCODINGS if candidate != encoding]
+    for encoding, confidence in candidates:
+        stream.seek(0)
+        try:
+            ingested = _ingest_with(stream, encoding, staging_dir)
+        except UnicodeDecodeError:
+            continue
+        ingested.encoding = encoding
+        ingested.confidence = confidence
+        request_logger.info('Successfully decoded file using %s encoding (confidence %s)', encoding, confidence)
+        return ingested
+    return None
+
+@app.before_request
+def start_request_timer():
+    ensure_initialized()
+    g.timer = StageTimer()
+
+@app.after_request
+def record_request_metrics(response):
+    """记录请求耗时和各阶段耗时，超过SLOW_REQUEST_SECONDS时输出各阶段明细"""
+    timer = g.get('timer')
+    if timer is None:
+        return response
+    total = timer.close()
+    REQUEST_SECONDS.observe(total, endpoint=request.endpoint or 'unknown', status=f'{response.status_code // 100}xx')
+    timer.observe()
+    if total >= app.config['SLOW_REQUEST_SECONDS']:
+        logger.warning(f'Slow request {request.method} {request.path} {total:.3f}s '
+                       f'({timer.labels.get("size_class", "unknown")}): {timer.breakdown()}')
+    return response
 
 @app.route('/')
 def index():
     counter = get_counter()
-    return render_template('index.html', counter=counter)
+    return render_template('index.html', counter=counter, max_upload_size=app.config['MAX_CONTENT_LENGTH'])
+
+class ApiError(Exception):
+    """API请求错误，返回JSON格式的错误信息和对应的状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+class OverloadedError(ApiError):
+    """服务繁忙，返回503并通过Retry-After提示客户端稍后重试"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message, 503)
+        self.retry_after = retry_after
+
+@app.errorhandler(ApiError)
+def handle_api_error(error):
+    response = jsonify({'error': error.message})
+    response.status_code = error.status
+    if isinstance(error, OverloadedError):
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def require_admin_token(view):
+    """存储中的配置可能包含密码等敏感信息，相关接口只对持有ADMIN_TOKEN的请求开放，未配置令牌时关闭"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = app.config['ADMIN_TOKEN']
+        if not token:
+            raise ApiError('Not found', 404)
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {token}'.encode('utf-8')):
+            raise ApiError('Unauthorized', 401)
+        return view(*args, **kwargs)
+    return wrapper
+
+def process_content(content, timer=None, source='upload', filename=None, encoding=None, confidence=None,
+                    blocking=False):
+    """匹配基线、保存内容、增加处理次数并分析，返回分析结果，出错时抛出ApiError
+
+    content为文本，或ingest_stream流式读取得到的IngestedConfig。
+    timer为StageTimer时记录baseline、admission、save、count、parse、analyze、diff各阶段耗时。
+    保存和计数在请求被admission接受后才进行，繁忙被拒绝的请求不会留下记录；
+    blocking为True时（已接受的后台任务）一直等待处理名额。
+    """
+    if timer is None:
+        timer = StageTimer()
+    progress = timer.enter
+
+    if isinstance(content, IngestedConfig):
+        ingested, content = content, None
+        head, index, digest = ingested.head, ingested.build_index, ingested.digest
+    else:
+        ingested = None
+        head, index, digest = content, None, None
+
+    # 按配置中的版本匹配默认配置基线
+    progress('baseline')
+    baseline = baselines.match(detect_version(head))
+    if baseline is None:
+        if ingested is not None:
+            os.remove(ingested.staged_path)
+        raise ApiError('Error reading default configuration: no baseline available', 500)
+
+    saved = {}
+
+    def accepted():
+        saved['accepted'] = True
+        # 保存内容到配置存储，暂存文件在建立块索引之后才交给存储
+        if ingested is None:
+            progress('save')
+            saved['hash'] = save_content(content, source, filename, encoding, confidence)
+            if not saved['hash']:
+                logger.error('Failed to save content to file')
+        # 增加处理次数
+        progress('count')
+        increment_counter()
+
+    try:
+        try:
+            # 解析并分析配置，相同内容直接使用缓存结果
+            result = analyze_content(content, baseline, progress, index, digest, blocking, accepted)
+        finally:
+            if ingested is not None:
+                if saved.get('accepted'):
+                    progress('save')
+                    saved['hash'] = config_store.save_staged(ingested, source, filename)
+                else:
+                    os.remove(ingested.staged_path)
+    except ApiError:
+        raise
+    except Exception as e:
+        raise ApiError(f'Error analyzing configuration: {str(e)}', 500)
+
+    # 在后台持久化分析结果，供 /result/<id> 直接打开
+    if saved.get('hash'):
+        config_store.save_result(saved['hash'], result)
+
+    size = ingested.size if content is None else len(content)
+    timer.labels['size_class'] = size_class(size)
+    CONFIG_BYTES.observe(size)
+    CONFIG_LINES.observe(result['graph'].index.line_count)
+    CONFIG_AP_GROUPS.observe(len(result['config']))
+    return result
+
+class AnalysisJob(StageTimer):
+    """异步分析任务，记录当前阶段、各阶段耗时和结果"""
+
+    def __init__(self, job_id):
+        super().__init__()
+        self.id = job_id
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.finished_at = None
+        self.error = None
+        self.result = None
+
+    @property
+    def stage(self):
+        return self.stages[-1]['name'] if self.stages else 'queued'
+
+    def enter(self, stage):
+        super().enter(stage)
+        self.status = 'running'
+
+    def finish(self, result=None, error=None):
+        self.enter('done' if error is None else 'failed')
+        self.stages[-1]['seconds'] = 0.0
+        self.observe()
+        self.status = 'done' if error is None else 'failed'
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'stages': self.stages,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+        if self.error is not None:
+            data['error'] = self.error
+        if self.result is not None:
+            data['result_id'] = self.result['id']
+            data['result_url'] = url_for('job_result', job_id=self.id)
+            data['permalink'] = url_for('result_page', result_id=self.result['id'])
+        return data
+
+class JobQueue:
+    """有界的后台分析任务队列，完成的任务保留retention秒后清理"""
+
+    def __init__(self, max_workers=2, max_pending=16, retention=600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retention = retention
+        self._jobs = {}
+        self._active = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, func, *args):
+        """提交任务，返回AnalysisJob；排队的任务已满时返回None"""
+        with self._lock:
+            self._purge()
+            if self._active >= self.max_workers + self.max_pending:
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='analysis-job')
+            job = AnalysisJob(os.urandom(16).hex())
+            self._jobs[job.id] = job
+            self._active += 1
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def _run(self, job, func, args):
+        try:
+            job.finish(result=func(job, *args))
+        except ApiError as e:
+            logger.error(f'Job {job.id} failed: {e.message}')
+            job.finish(error=e.message)
+        except Exception as e:
+            logger.error(f'Job {job.id} failed: {str(e)}')
+            job.finish(error=f'Error analyzing configuration: {str(e)}')
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge()
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        """返回任务队列深度"""
+        with self._lock:
+            return {
+                'active': self._active,
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'retained': len(self._jobs),
+            }
+
+    def _purge(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.retention]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+# 异步分析任务队列，由init_app()创建
+job_queue = None
+
+def run_upload_job(job, content=None, upload_path=None, filename=None):
+    """后台执行上传分析：content为粘贴的文本，upload_path为已落盘的上传文件"""
+    source = 'paste'
+    if upload_path is not None:
+        # decode阶段解码并暂存，结束后删除落盘的上传文件
+        job.enter('decode')
+        try:
+            with open(upload_path, 'rb') as f:
+                content = ingest_stream(f, config_store.staging_dir)
+        finally:
+            os.remove(upload_path)
+        if content is None:
+            raise ApiError('Unable to decode file content. Please check file encoding.')
+        request_logger.info('File uploaded: %s', filename)
+        source = 'file'
+    return process_content(content, job, source, filename, blocking=True)
+
+def submit_upload_job(content=None, upload_path=None, filename=None):
+    """提交异步分析任务，返回202和任务状态地址，队列已满时返回503"""
+    job = job_queue.submit(run_upload_job, content, upload_path, filename)
+    if job is None:
+        logger.warning('Job queue is full')
+        if upload_path is not None:
+            os.remove(upload_path)
+        raise OverloadedError('Too many pending analysis jobs, please retry later', 5)
+    status_url = url_for('job_status', job_id=job.id)
+    response = jsonify({'job_id': job.id, 'status': job.status, 'status_url': status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
     content = None
+    filename = None
+    # async=1 时只提交后台任务，立即返回任务id
+    use_async = request.values.get('async', '').lower() in ('1', 'true', 'yes')
     
     # Handle file upload
     if 'config_file' in request.files:
         file = request.files['config_file']
         if file.filename != '':
+            filename = file.filename
+            g.timer.enter('spool' if use_async else 'decode')
             try:
-                # 先读取文件内容
-                file_content = file.read()
-                
-                # 尝试不同的编码方式
-                encodings = ['utf-8', 'gbk', 'gb2312', 'gb18030', 'big5', 'latin1']
-                for encoding in encodings:
+                if use_async:
+                    # 上传文件先落盘，由后台任务流式读取
+                    fd, upload_path = tempfile.mkstemp(suffix='.upload', dir=config_store.staging_dir)
                     try:
-                        content = file_content.decode(encoding)
-                        logger.info(f'Successfully decoded file using {encoding} encoding')
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                
-                if content is None:
-                    logger.error(f'Failed to decode file {file.filename} with all attempted encodings')
-                    return jsonify({'error': 'Unable to decode file content. Please check file encoding.'})
-                
-                logger.info(f'File uploaded: {file.filename}')
+                        with os.fdopen(fd, 'wb') as f:
+                            shutil.copyfileobj(file.stream, f, INGEST_CHUNK_SIZE)
+                    except Exception:
+                        # 上传中断等读取失败时删除不完整的暂存文件
+                        os.unlink(upload_path)
+                        raise
+                else:
+                    # 分块读取、解码并暂存，不把整个文件读入内存；结果缓存未命中时才建立块索引
+                    content = ingest_stream(file.stream, config_store.staging_dir)
+
+                    if content is None:
+                        logger.error(f'Failed to decode file {file.filename} with all attempted encodings')
+                        return jsonify({'error': 'Unable to decode file content. Please check file encoding.'})
+                    if not content.size:
+                        os.remove(content.staged_path)
+                        content = None
+                    else:
+                        request_logger.info('File uploaded: %s', file.filename)
                 
             except Exception as e:
                 logger.error(f'Error processing file {file.filename}: {str(e)}')
                 return jsonify({'error': 'Error processing file, please check the file format'})
+            if use_async:
+                return submit_upload_job(upload_path=upload_path, filename=filename)
     
     # Handle pasted text
     elif 'config_text' in request.form:
@@ -679,40 +2891,1181 @@ def upload_file():
         if not content.strip():
             logger.warning('Empty configuration content submitted')
             return jsonify({'error': 'Configuration content cannot be empty'})
-        logger.info('Configuration content pasted')
+        request_logger.info('Configuration content pasted')
     
     if not content:
         logger.warning('No content provided')
         return jsonify({'error': 'Please upload a file or paste configuration content'})
+
+    if use_async:
+        return submit_upload_job(content)
+
+    try:
+        result = process_content(content, g.timer, source='file' if filename else 'paste', filename=filename)
+    except OverloadedError:
+        logger.warning('Analysis queue is full, upload rejected')
+        raise
+    except ApiError as e:
+        logger.error(e.message)
+        return jsonify({'error': e.message})
     
-    # 保存��容到文件
-    saved_filename = save_content(content)
-    if not saved_filename:
-        logger.error('Failed to save content to file')
-    
-    # 增加处理次数
-    increment_counter()
-    
-    # 读取默认配置文件
+    # 渲染结果
+    g.timer.enter('render')
+    return render_template('result.html',
+                         result_id=result['id'],
+                         analysis_results=result['analysis'])
+
+def read_request_body():
+    """读取请求体，Content-Encoding为gzip时解压，解压后超过限制时报错"""
+    data = request.get_data(cache=False)
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        limit = app.config['MAX_DECOMPRESSED_LENGTH']
+        try:
+            decompressor = zlib.decompressobj(wbits=31)
+            data = decompressor.decompress(data, limit + 1)
+        except zlib.error as e:
+            raise ApiError(f'Invalid gzip body: {str(e)}')
+        if len(data) > limit or decompressor.unconsumed_tail:
+            raise ApiError('Decompressed body is too large', 413)
+    return data
+
+def json_response(data, status=200):
+    """返回紧凑格式的JSON响应"""
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return Response(body, status=status, mimetype='application/json')
+
+# unified diff的hunk头，如 @@ -12,3 +12,4 @@
+HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+def apply_patch(text, patch):
+    """把unified diff格式的补丁应用到文本，上下文或删除的行不一致时抛出ApiError"""
+    lines = text.splitlines(keepends=True)
+    newline = '\r\n' if lines and lines[0].endswith('\r\n') else '\n'
+    result = []
+    position = 0
+    old_remaining = new_remaining = 0
+    for line in patch.splitlines():
+        if old_remaining <= 0 and new_remaining <= 0:
+            # hunk之外的文件头、说明文字等
+            match = HUNK_RE.match(line)
+            if match is None:
+                continue
+            old_start = int(match.group(1))
+            old_remaining = int(match.group(2) or 1)
+            new_remaining = int(match.group(4) or 1)
+            start = old_start if old_remaining == 0 else old_start - 1
+            if start < position or start > len(lines):
+                raise ApiError(f'Patch hunk out of range: {line}', 409)
+            result.extend(lines[position:start])
+            position = start
+            continue
+        if line.startswith('\\'):
+            # "\ No newline at end of file"
+            continue
+        marker, value = (line[0], line[1:]) if line else (' ', '')
+        if marker == '+':
+            result.append(value + newline)
+            new_remaining -= 1
+        elif marker in ' -':
+            if position >= len(lines) or lines[position].rstrip('\r\n') != value:
+                raise ApiError(f'Patch does not apply at line {position + 1}', 409)
+            if marker == ' ':
+                result.append(lines[position])
+                new_remaining -= 1
+            old_remaining -= 1
+            position += 1
+        else:
+            raise ApiError(f'Invalid patch line: {line}', 400)
+    result.extend(lines[position:])
+    return ''.join(result)
+
+# /api/v1/analyze 可以通过fields选择的字段
+API_FIELDS = ('analysis', 'config', 'diff')
+
+@app.route('/api/v1/analyze', methods=['POST'])
+def api_analyze():
+    """分析请求体中的配置文本（可gzip压缩），返回JSON结果
+
+    查询参数：
+    fields  逗号分隔的字段，可选 analysis、config、diff，默认 analysis,config
+    type    只返回该类型的提示，如 warning
+    group   只返回指定ap-group的解析结果
+    响应带有基于内容哈希的ETag，请求头If-None-Match一致时返回304。
+    """
+    fields = [field for field in request.args.get('fields', 'analysis,config').split(',') if field]
+    unknown = [field for field in fields if field not in API_FIELDS]
+    if unknown:
+        raise ApiError(f'Unknown fields: {", ".join(unknown)}')
+    result_type = request.args.get('type')
+    group = request.args.get('group')
+
+    content = decode_content(read_request_body())
+    if content is None:
+        raise ApiError('Unable to decode content. Please check file encoding.')
+    if not content.strip():
+        raise ApiError('Configuration content cannot be empty')
+
+    baseline = baselines.match(detect_version(content))
+    result_id = result_id_for(content, baseline)
+    etag = content_hash(f'{result_id}:{",".join(fields)}:{result_type}:{group}')
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    # 请求被admission接受后才计数
+    result = analyze_content(content, baseline, accepted=increment_counter)
+
+    data = {'id': result['id']}
+    if 'analysis' in fields:
+        data['analysis'] = [item for item in result['analysis']
+                            if result_type is None or item['type'] == result_type]
+    if 'config' in fields:
+        if group is None:
+            data['config'] = config_to_dict(result['config'])
+        elif group in result['config']:
+            data['config'] = {group: result['config'][group].to_dict()}
+        else:
+            raise ApiError(f'AP group not found: {group}', 404)
+    if 'diff' in fields:
+        data['diff'] = result['diff']
+
+    response = json_response(data)
+    response.set_etag(etag)
+    return response
+
+def reload_result(result_id):
+    """通过持久化的结果找到存储的配置并重新分析，返回(结果, 配置内容)，找不到时返回(None, None)"""
+    if not re.fullmatch(r'[0-9a-f]{64}', result_id):
+        return None, None
+    loaded = config_store.load_result(result_id)
+    if loaded is None:
+        return None, None
+    content = config_store.get(loaded[1])
+    if content is None:
+        return None, None
+    return analyze_content(content, baselines.match(detect_version(content))), content
+
+@app.route('/api/v1/analyze/<previous_id>', methods=['POST'])
+def api_reanalyze(previous_id):
+    """在previous_id的结果上增量分析修改后的配置，返回新的提示和变化
+
+    请求体为修改后的完整配置；Content-Type为text/x-diff或text/x-patch时，
+    请求体是针对上一次配置的unified diff（上一次的配置需在存储中，即来自/upload或本接口）。
+    上一次的结果不在缓存中时，通过持久化的结果找到存储的配置重新分析。
+    响应的config只包含重新展开的ap-group。
+    """
+    previous_content = None
+    previous = result_cache.get(previous_id)
+    if previous is None:
+        previous, previous_content = reload_result(previous_id)
+    if previous is None:
+        raise ApiError('Previous result expired, please analyze the full configuration again', 404)
+
+    body = decode_content(read_request_body())
+    if body is None:
+        raise ApiError('Unable to decode content. Please check file encoding.')
+    if request.mimetype in ('text/x-diff', 'text/x-patch'):
+        if previous_content is None:
+            previous_content = config_store.get(previous['digest'])
+        if previous_content is None:
+            raise ApiError('Previous configuration is not stored, please send the full configuration', 409)
+        content = apply_patch(previous_content, body)
+    else:
+        content = body
+    if not content.strip():
+        raise ApiError('Configuration content cannot be empty')
+
+    def accepted():
+        # 保存修改后的配置，后续可以继续发送补丁
+        save_content(content, source='revision')
+        increment_counter()
+
+    baseline = baselines.match(detect_version(content))
+    result, delta = reanalyze_content(previous, content, baseline, accepted, previous_content)
+
+    return json_response({
+        'id': result['id'],
+        'previous_id': previous_id,
+        'analysis': result['analysis'],
+        'delta': delta,
+        'config': {name: result['config'][name].to_dict() for name in delta['groups']['reparsed']},
+    })
+
+def analyze_batch_file(name, data, fields, previous_id=None):
+    """在进程池中分析一个配置文件，返回可JSON序列化的结果
+
+    结果id与previous_id相同（内容、规则集和基线都没有变化）时不再分析，返回skipped。
+    不经过结果缓存，只计算fields中请求的字段，分析完成后不在子进程中保留任何结果。
+    """
     try:
-        with open(os.path.join('templates', '812default.log'), 'r', encoding='utf-8') as f:
-            default_content = f.read()
-            
-        # 分析配置
-        analysis_results = analyze_config(content)
-            
+        content, encoding, confidence = decode_upload(data)
+        if content is None:
+            return {'file': name, 'error': 'Unable to decode content. Please check file encoding.'}
+        if not content.strip():
+            return {'file': name, 'error': 'Configuration content cannot be empty'}
+        version = detect_version(content)
+        baseline = baselines.match(version)
+        result_id = result_id_for(content, baseline)
+        if previous_id is not None and result_id == previous_id:
+            return {'file': name, 'id': previous_id, 'skipped': True}
+        index = index_config(content)
+        profile_graph = ProfileGraph(index)
+        item = {
+            'file': name,
+            'id': result_id,
+            'version': version,
+            'encoding': encoding,
+            'encoding_confidence': confidence,
+            'baseline_version': baseline.version if baseline is not None else None,
+            'ap_groups': len(profile_graph.nodes('ap-group')),
+        }
+        if 'analysis' in fields:
+            item['analysis'] = analyze_config(content, index, baseline)
+        if 'config' in fields:
+            item['config'] = config_to_dict(profile_graph.flatten())
+        if 'diff' in fields:
+            item['diff'] = diff_configs(index, baseline) if baseline is not None else None
+        return item
     except Exception as e:
-        error_msg = f'Error reading default configuration: {str(e)}'
-        logger.error(error_msg)
-        return jsonify({'error': error_msg})
-    
-    # 解析配置并渲染结果
-    config_structure = parse_config(content)
-    return render_template('result.html', 
-                         config=config_structure,
-                         uploaded_content=content,
-                         default_content=default_content,
-                         analysis_results=analysis_results)
+        return {'file': name, 'error': f'Error analyzing configuration: {str(e)}'}
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+def batch_worker_count():
+    """批量分析的进程数，未配置时使用当前进程可用的CPU核数"""
+    if app.config['BATCH_WORKERS']:
+        return app.config['BATCH_WORKERS']
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def init_batch_worker(check_interval):
+    """进程池子进程的初始化：只载入默认配置基线，不配置日志，也不创建存储、缓存等对象"""
+    global baselines
+    baselines = BaselineRegistry(templates_dir, check_interval=check_interval)
+
+def create_process_pool(workers):
+    """创建分析用的进程池
+
+    子进程以spawn方式启动：fork会把后台线程（日志、存储写入、计数器等）当时持有的锁
+    以持有状态带进子进程，可能导致死锁。spawn的子进程只导入本模块（导入没有副作用），
+    再由init_batch_worker载入基线。
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=init_batch_worker, initargs=(app.config['BASELINE_CHECK_INTERVAL'],))
+
+def get_batch_executor():
+    """返回批量分析共用的进程池，首次使用时创建"""
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            workers = batch_worker_count()
+            _batch_executor = create_process_pool(workers)
+            logger.info(f'Batch process pool started with {workers} workers')
+        return _batch_executor
+
+class ApGroupDriftCheck:
+    """找出profile引用集合与本配置中多数ap-group不同的ap-group
+
+    多数集合是出现次数最多、且至少被两个ap-group使用的引用集合，
+    返回 [{'group', 'missing', 'extra'}]，missing/extra为相对多数集合缺少和多出的引用行。
+    """
+    name = 'ap-group-drift'
+    version = 1
+
+    def evaluate(self, index):
+        graph = ProfileGraph(index)
+        profile_sets = {}
+        for node in graph.nodes('ap-group'):
+            profile_sets[node.name] = frozenset(' '.join(line.split()) for line in node.commands
+                                                if quoted_value(line) is not None)
+        if len(profile_sets) < 2:
+            return []
+        majority, count = Counter(profile_sets.values()).most_common(1)[0]
+        if count < 2:
+            return []
+        return [{'group': group, 'missing': sorted(majority - profiles), 'extra': sorted(profiles - majority)}
+                for group, profiles in profile_sets.items() if profiles != majority]
+
+# 统计分析中除分析规则外的检查
+FLEET_CHECKS = [ApGroupDriftCheck()]
+
+def fleet_check_versions():
+    """返回当前全部规则和检查的 {名称: 版本}"""
+    versions = {rule.name: rule.version for rule in ANALYSIS_RULES}
+    versions.update((check.name, check.version) for check in FLEET_CHECKS)
+    return versions
+
+def fleet_check_results(index, baseline, names):
+    """只执行names中的规则和检查，返回 {名称: 结果}"""
+    rules = [rule for rule in ANALYSIS_RULES if rule.name in names]
+    by_rule = {}
+    if rules:
+        run_analysis(None, index, rules, baseline, by_rule)
+    for check in FLEET_CHECKS:
+        if check.name in names:
+            by_rule[check.name] = check.evaluate(index)
+    return by_rule
+
+def evaluate_stored_config(path, digest, version, names):
+    """在进程池中读取一个存储的配置并执行指定的规则，返回(哈希, 基线指纹, 结果)，配置不存在时结果为None"""
+    index = index_stored_file(path)
+    if index is None:
+        return digest, None, None
+    baseline = baselines.match(version)
+    return digest, baseline.fingerprint if baseline is not None else None, fleet_check_results(index, baseline, names)
+
+def percent(part, total):
+    return round(100 * part / total, 1) if total else 0.0
+
+class FleetAnalytics:
+    """存储中所有配置的逐规则分析结果，以及由此预先计算的汇总视图
+
+    作为ConfigStore的listener，新配置写入后在后台线程中执行全部规则；启动后和每隔
+    FLEET_RESCAN_INTERVAL秒与存储核对一次，只重新执行版本变化或新增的规则（基线变化时
+    全部重新执行），多个配置在单独的小进程池（workers个进程）中处理，同时提交的任务不超过
+    进程数的两倍，不占用批量分析的进程池。每个配置的结果追加写入analytics.jsonl，
+    每批处理完成后重新计算汇总视图，请求只读取计算好的视图。
+    """
+
+    def __init__(self, path, store, rescan_interval=600, view_limit=100, workers=1):
+        self.path = path
+        self.store = store
+        self.rescan_interval = rescan_interval
+        self.view_limit = view_limit
+        self.workers = workers
+        self._records = {}
+        self._lines = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._executor = None
+        self._stopping = threading.Event()
+        self._scanning = False
+        self._last_scan = None
+        self.views = None
+
+    def start(self):
+        """首次调用时载入已有结果并启动后台线程"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='fleet-analytics', daemon=True)
+                self._thread.start()
+
+    def add(self, digest, index):
+        """ConfigStore写入新配置后调用，分析在后台线程中进行"""
+        self.start()
+        self._queue.put(('add', digest, index))
+
+    def remove(self, digest):
+        self._queue.put(('remove', digest, None))
+
+    def stop(self):
+        """停止后台线程：正在进行的核对不再提交新任务，等待已提交的任务完成后关闭进程池"""
+        self._stopping.set()
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self._lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('deleted'):
+                        self._records.pop(record['hash'], None)
+                    else:
+                        self._records[record['hash']] = record
+        except FileNotFoundError:
+            pass
+
+    def _run(self):
+        self._load()
+        self._scan()
+        while not self._stopping.is_set():
+            try:
+                item = self._queue.get(timeout=self.rescan_interval)
+            except queue.Empty:
+                self._scan()
+                continue
+            try:
+                # None为stop()放入的结束标记
+                while item is not None:
+                    action, digest, index = item
+                    if action == 'add':
+                        self._add(digest, index)
+                    else:
+                        self._delete(digest)
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            except Exception as e:
+                logger.error(f'Error updating fleet analytics: {str(e)}')
+            if item is None:
+                break
+            self._compute_views()
+
+    def _add(self, digest, index):
+        metadata = self.store.metadata(digest)
+        if metadata is None:
+            return
+        baseline = baselines.match(metadata.get('version'))
+        versions = fleet_check_versions()
+        results = fleet_check_results(index, baseline, versions)
+        self._save(digest, baseline.fingerprint if baseline is not None else None, versions, results)
+
+    def _delete(self, digest):
+        with self._lock:
+            if self._records.pop(digest, None) is None:
+                return
+        self._append({'hash': digest, 'deleted': True})
+
+    def _save(self, digest, baseline_fingerprint, versions, results):
+        """合并新执行的规则结果，丢弃已删除的规则"""
+        current = fleet_check_versions()
+        with self._lock:
+            previous = self._records.get(digest)
+            if previous is not None and previous['baseline'] == baseline_fingerprint:
+                merged_versions = dict(previous['versions'])
+                merged_results = dict(previous['results'])
+            else:
+                merged_versions = {}
+                merged_results = {}
+            merged_versions.update(versions)
+            merged_results.update(results)
+            record = {
+                'hash': digest,
+                'baseline': baseline_fingerprint,
+                'versions': {name: version for name, version in merged_versions.items() if name in current},
+                'results': {name: items for name, items in merged_results.items() if name in current},
+            }
+            self._records[digest] = record
+        self._append(record)
+
+    def _append(self, record):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._lines += 1
+        if self._lines > 2 * len(self._records) + 100:
+            tmp_path = f'{self.path}.tmp'
+            with self._lock:
+                records = list(self._records.values())
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for item in records:
+                    f.write(json.dumps(item, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.path)
+            self._lines = len(records)
+
+    def _scan(self):
+        """与存储核对，只重新执行版本变化的规则"""
+        self._scanning = True
+        try:
+            current = fleet_check_versions()
+            stored = set(self.store.digests())
+            work = []
+            with self._lock:
+                removed = [digest for digest in self._records if digest not in stored]
+            for digest in removed:
+                self._delete(digest)
+            for digest in stored:
+                metadata = self.store.metadata(digest)
+                if metadata is None:
+                    continue
+                baseline = baselines.match(metadata.get('version'))
+                fingerprint = baseline.fingerprint if baseline is not None else None
+                with self._lock:
+                    record = self._records.get(digest)
+                if record is None or record['baseline'] != fingerprint:
+                    names = list(current)
+                else:
+                    names = [name for name, version in current.items() if record['versions'].get(name) != version]
+                    if not names and record['versions'].keys() - current.keys():
+                        # 只删除了规则，去掉旧结果即可
+                        self._save(digest, fingerprint, {}, {})
+                if names:
+                    work.append((digest, metadata.get('version'), names))
+            if work:
+                started = time.perf_counter()
+                names_of = {digest: names for digest, version, names in work}
+                pending = iter(work)
+                in_flight = set()
+                evaluated = 0
+                while True:
+                    # 已完成的任务空出位置后再提交，进程池队列中最多2*workers个任务
+                    while len(in_flight) < 2 * self.workers and not self._stopping.is_set():
+                        item = next(pending, None)
+                        if item is None:
+                            break
+                        digest, version, names = item
+                        if self._executor is None:
+                            self._executor = create_process_pool(self.workers)
+                        try:
+                            in_flight.add(self._executor.submit(evaluate_stored_config,
+                                                                self.store.path_for(digest), digest, version, names))
+                        except BrokenProcessPool:
+                            # 子进程异常退出后重新创建进程池
+                            self._executor = None
+                            logger.error('Fleet analytics process pool broken, recreating it')
+                        except RuntimeError:
+                            # 解释器退出时进程池不再接受新任务
+                            self._stopping.set()
+                    if not in_flight:
+                        break
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            digest, fingerprint, results = future.result()
+                        except Exception as e:
+                            logger.error(f'Error evaluating stored config: {str(e)}')
+                            if isinstance(e, BrokenProcessPool):
+                                self._executor = None
+                            continue
+                        evaluated += 1
+                        if results is not None and self.store.metadata(digest) is not None:
+                            self._save(digest, fingerprint,
+                                       {name: current[name] for name in names_of[digest]}, results)
+                logger.info(f'Fleet analytics re-evaluated {evaluated} stored configs '
+                            f'in {time.perf_counter() - started:.2f}s')
+            self._last_scan = time.time()
+        except Exception as e:
+            logger.error(f'Error scanning stored configs for fleet analytics: {str(e)}')
+        finally:
+            self._scanning = False
+        self._compute_views()
+
+    def _compute_views(self):
+        """根据逐规则结果计算汇总视图"""
+        with self._lock:
+            records = list(self._records.values())
+        total = len(records)
+        limit = self.view_limit
+
+        def controller(record):
+            metadata = self.store.metadata(record['hash']) or {}
+            return {'hash': record['hash'], 'hostname': metadata.get('hostname'), 'version': metadata.get('version')}
+
+        rules = []
+        for name in fleet_check_versions():
+            hits = sum(1 for record in records if record['results'].get(name))
+            rules.append({'rule': name, 'configs': hits, 'percent': percent(hits, total)})
+
+        missing_tri_session = [record for record in records if record['results'].get('firewall-tri-session')]
+        vlan_counts = Counter(vlan_id for record in records
+                              for item in record['results'].get('vlan-bcmc', ())
+                              for vlan_id in item.get('vlans', ()))
+        drifting = sorted((record for record in records if record['results'].get('ap-group-drift')),
+                          key=lambda record: -len(record['results']['ap-group-drift']))
+
+        self.views = {
+            'updated': time.time(),
+            'configs': total,
+            'rules': rules,
+            'tri_session': {
+                'missing': len(missing_tri_session),
+                'total': total,
+                'percent': percent(len(missing_tri_session), total),
+                'controllers': [controller(record) for record in missing_tri_session[:limit]],
+            },
+            'vlan_bcmc': [{'vlan': vlan_id, 'configs': count, 'percent': percent(count, total)}
+                          for vlan_id, count in vlan_counts.most_common(limit)],
+            'ap_group_drift': {
+                'controllers': len(drifting),
+                'groups': sum(len(record['results']['ap-group-drift']) for record in drifting),
+                'items': [dict(controller(record), groups=record['results']['ap-group-drift'])
+                          for record in drifting[:limit]],
+            },
+        }
+
+    def status(self):
+        return {
+            'configs': len(self._records),
+            'pending': self._queue.qsize(),
+            'scanning': self._scanning,
+            'last_scan': self._last_scan,
+            'versions': fleet_check_versions(),
+        }
+
+# 存储配置的统计分析，由init_app()创建
+fleet_analytics = None
+
+_init_lock = threading.RLock()
+_initialized = False
+
+def init_app(**config):
+    """按app.config创建日志、计数器、配置存储、缓存和并发限制等全局对象，返回app
+
+    config中的值先写入app.config。导入模块时不创建这些对象（批量分析的子进程只导入模块），
+    修改配置后可以再次调用以重新创建。
+    """
+    global log_queue_handler, upload_counter, config_store, search_index, fleet_analytics
+    global result_cache, tree_cache, admission, baselines, job_queue, _initialized
+    app.config.update(config)
+    with _init_lock:
+        if log_queue_handler is None:
+            log_queue_handler = setup_logging()
+            atexit.register(close_app)
+        request_log_filter.rate = app.config['LOG_INFO_SAMPLE_RATE']
+        close_app()
+
+        directory = app.config['DATA_DIR'] or data_dir
+        os.makedirs(directory, exist_ok=True)
+        upload_counter = UploadCounter(app.config['COUNTER_FILE'] or os.path.join(templates_dir, 'counters'),
+                                       os.path.join(directory, '.counters.lock'),
+                                       app.config['COUNTER_FLUSH_INTERVAL'])
+        config_store = ConfigStore(os.path.join(directory, 'store'),
+                                   app.config['STORE_MAX_ENTRIES'],
+                                   app.config['STORE_RETENTION_DAYS'],
+                                   app.config['STORE_QUEUE_SIZE'])
+        search_index = SearchIndex(os.path.join(config_store.directory, 'search.db'))
+        fleet_analytics = FleetAnalytics(os.path.join(config_store.directory, 'analytics.jsonl'), config_store,
+                                         app.config['FLEET_RESCAN_INTERVAL'], app.config['FLEET_VIEW_LIMIT'],
+                                         app.config['FLEET_SCAN_WORKERS'])
+        config_store.listeners += [search_index, fleet_analytics]
+
+        result_cache = ResultCache(app.config['RESULT_CACHE_SIZE'], app.config['RESULT_CACHE_TTL'])
+        tree_cache = ResultCache(app.config['RESULT_CACHE_SIZE'], app.config['RESULT_CACHE_TTL'])
+        admission = AdmissionController(app.config['ANALYSIS_CONCURRENCY'],
+                                        app.config['ANALYSIS_QUEUE_SIZE'],
+                                        app.config['ANALYSIS_QUEUE_TIMEOUT'])
+        baselines = BaselineRegistry(templates_dir, check_interval=app.config['BASELINE_CHECK_INTERVAL'])
+        job_queue = JobQueue(app.config['JOB_WORKERS'], app.config['JOB_QUEUE_SIZE'], app.config['JOB_RETENTION'])
+        _initialized = True
+    return app
+
+def ensure_initialized():
+    """还没有调用过init_app()时（如由WSGI服务器直接导入app）按默认配置初始化"""
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                init_app()
+
+def close_app():
+    """等待存储的后台写入完成、停止统计分析、关闭检索索引并写回处理次数，退出时和重新初始化前调用"""
+    if config_store is not None:
+        config_store.flush()
+    if fleet_analytics is not None:
+        fleet_analytics.stop()
+    if search_index is not None:
+        search_index.close()
+    if upload_counter is not None:
+        upload_counter.close()
+
+def read_archive(data):
+    """从zip或tar（可gzip/bz2/xz压缩）压缩包中读取文件，返回[(文件名, 内容)]"""
+    max_files = app.config['BATCH_MAX_FILES']
+    max_file_size = app.config['MAX_DECOMPRESSED_LENGTH']
+    max_total_size = app.config['BATCH_MAX_TOTAL_SIZE']
+    files = []
+    total_size = 0
+
+    def add(name, size, read):
+        nonlocal total_size
+        if len(files) >= max_files:
+            raise ApiError(f'Too many files in archive, the limit is {max_files}', 413)
+        if size > max_file_size:
+            raise ApiError(f'File {name} is too large', 413)
+        # 解压前按声明的大小累计，超过总大小限制时不再解压后续文件
+        total_size += size
+        if total_size > max_total_size:
+            raise ApiError('Total size of configuration files is too large', 413)
+        files.append((name, read()))
+
+    if zipfile.is_zipfile(io.BytesIO(data)):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    add(info.filename, info.file_size, lambda: archive.read(info))
+        return files
+    try:
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:*') as archive:
+            for member in archive:
+                if member.isfile():
+                    add(member.name, member.size, lambda: archive.extractfile(member).read())
+    except tarfile.TarError:
+        raise ApiError('Request body must be a zip or tar archive', 415)
+    return files
+
+@app.route('/api/v1/batch', methods=['POST'])
+def api_batch():
+    """批量分析多个配置，文件在进程池中并行分析，每完成一个就以NDJSON输出一行结果
+
+    请求体为zip/tar压缩包，或multipart表单上传的多个文件。
+    查询参数fields同 /api/v1/analyze，默认只返回analysis；最后一行为汇总信息。
+    """
+    # 批量请求使用单独的大小限制
+    request.max_content_length = app.config['BATCH_MAX_ARCHIVE_SIZE']
+    fields = [field for field in request.args.get('fields', 'analysis').split(',') if field]
+    unknown = [field for field in fields if field not in API_FIELDS]
+    if unknown:
+        raise ApiError(f'Unknown fields: {", ".join(unknown)}')
+
+    if request.files:
+        uploads = list(request.files.items(multi=True))
+        if len(uploads) > app.config['BATCH_MAX_FILES']:
+            raise ApiError(f'Too many files, the limit is {app.config["BATCH_MAX_FILES"]}', 413)
+        files = []
+        remaining = app.config['BATCH_MAX_TOTAL_SIZE']
+        for field, file in uploads:
+            # 最多读取剩余额度多一个字节，超过总大小限制时不再读取后续文件
+            data = file.read(remaining + 1)
+            remaining -= len(data)
+            if remaining < 0:
+                raise ApiError('Total size of configuration files is too large', 413)
+            files.append((file.filename or field, data))
+    else:
+        data = request.get_data(cache=False)
+        if not data:
+            raise ApiError('Please upload an archive or configuration files')
+        files = read_archive(data)
+    logger.info(f'Batch analysis started: {len(files)} files')
+
+    executor = get_batch_executor()
+
+    def generate():
+        started = time.perf_counter()
+        futures = {executor.submit(analyze_batch_file, name, data, fields): name for name, data in files}
+        errors = 0
+        try:
+            for future in as_completed(futures):
+                try:
+                    item = future.result()
+                except Exception as e:
+                    item = {'file': futures[future], 'error': f'Error analyzing configuration: {str(e)}'}
+                if 'error' in item:
+                    errors += 1
+                yield json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n'
+        finally:
+            # 客户端断开时取消还未开始的任务
+            for future in futures:
+                future.cancel()
+        summary = {'files': len(files), 'errors': errors, 'seconds': round(time.perf_counter() - started, 3)}
+        logger.info(f'Batch analysis finished: {summary}')
+        yield json.dumps({'summary': summary}, separators=(',', ':')) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """返回异步分析任务的状态和各阶段耗时"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """渲染已完成的异步分析任务的结果页面"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    if job.result is None:
+        return jsonify(job.to_dict()), 409 if job.error is None else 500
+    return render_template('result.html',
+                         result_id=job.result['id'],
+                         analysis_results=job.result['analysis'])
+
+def load_persisted_result(result_id):
+    """读取持久化的分析结果，解析器或规则集版本变化时用存储的配置重新分析并覆盖"""
+    if not re.fullmatch(r'[0-9a-f]{64}', result_id):
+        return None
+    loaded = config_store.load_result(result_id)
+    if loaded is None:
+        return None
+    current, digest, data = loaded
+    if current:
+        return data
+    content = config_store.get(digest)
+    if content is None:
+        return None
+    logger.info(f'Persisted result {result_id} is outdated, reanalyzing')
+    baseline = baselines.match(detect_version(content))
+    result = dict(analyze_content(content, baseline), id=result_id)
+    path = config_store.result_path(result_id)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(encode_result(digest, result))
+    os.replace(tmp_path, path)
+    return {
+        'id': result_id,
+        'config': result['config'],
+        'analysis': result['analysis'],
+        'diff': result['diff'],
+    }
+
+@app.route('/result/<result_id>')
+def result_page(result_id):
+    """打开持久化的分析结果，不需要重新上传和解析"""
+    g.timer.enter('load')
+    result = result_cache.get(result_id) or load_persisted_result(result_id)
+    if result is None:
+        return jsonify({'error': 'Result not found'}), 404
+    g.timer.enter('render')
+    return render_template('result.html',
+                         result_id=result_id,
+                         analysis_results=result['analysis'])
+
+@app.route('/diff/<result_id>')
+def config_diff(result_id):
+    """返回上传配置与基线之间有变化的块"""
+    result = result_cache.get(result_id) or load_persisted_result(result_id)
+    if result is None or result['diff'] is None:
+        return jsonify({'error': 'Result expired, please upload the configuration again'}), 404
+    response = jsonify(result['diff'])
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+# ap-group树每页的默认和最大数量
+TREE_PAGE_SIZE = 50
+TREE_MAX_PAGE_SIZE = 500
+
+def get_config_tree(result_id):
+    """返回结果的ap-group树，结果不存在时返回None"""
+    tree = tree_cache.get(result_id)
+    if tree is None:
+        result = result_cache.get(result_id) or load_persisted_result(result_id)
+        if result is None:
+            return None
+        tree = ConfigTree(result['config'])
+        tree_cache.put(result_id, tree)
+    return tree
+
+def cacheable(data):
+    """结果id确定了内容，响应可以被浏览器缓存"""
+    response = json_response(data)
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+@app.route('/tree/<result_id>/groups')
+def tree_groups(result_id):
+    """分页返回ap-group摘要，q按ap-group名称过滤，profile按profile名称过滤"""
+    tree = get_config_tree(result_id)
+    if tree is None:
+        return jsonify({'error': 'Result expired, please upload the configuration again'}), 404
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', TREE_PAGE_SIZE)), 1), TREE_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Invalid offset or limit'}), 400
+    total, groups = tree.page(offset, limit, request.args.get('q'), request.args.get('profile'))
+    return cacheable({'total': total, 'offset': offset, 'limit': limit, 'groups': groups})
+
+@app.route('/tree/<result_id>/group')
+def tree_group(result_id):
+    """返回一个ap-group中不属于任何profile的命令"""
+    tree = get_config_tree(result_id)
+    if tree is None:
+        return jsonify({'error': 'Result expired, please upload the configuration again'}), 404
+    group = tree.group(request.args.get('name', ''))
+    if group is None:
+        return jsonify({'error': 'AP group not found'}), 404
+    return cacheable(group)
+
+@app.route('/tree/<result_id>/profile')
+def tree_profile(result_id):
+    """返回ap-group中一个profile的命令和子profile，参数group、type、name"""
+    tree = get_config_tree(result_id)
+    if tree is None:
+        return jsonify({'error': 'Result expired, please upload the configuration again'}), 404
+    profile = tree.profile(request.args.get('group', ''), request.args.get('type', ''), request.args.get('name', ''))
+    if profile is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return cacheable(profile)
+
+@app.route('/profiles/<result_id>')
+def profile_users(result_id):
+    """查询引用某个profile的节点和ap-group，参数type为块类型（如 aaa profile），name为名称"""
+    result = result_cache.get(result_id)
+    if result is None:
+        return jsonify({'error': 'Result expired, please upload the configuration again'}), 404
+    profile_type = request.args.get('type', '')
+    name = request.args.get('name', '')
+    profile_graph = result['graph']
+    if profile_graph.node(profile_type, name) is None:
+        return jsonify({'error': f'Profile not found: {profile_type} "{name}"'}), 404
+    return jsonify({
+        'type': profile_type,
+        'name': name,
+        'referenced_by': [{'type': node.type, 'name': node.name} for node in profile_graph.users(profile_type, name)],
+        'groups': profile_graph.groups_using(profile_type, name),
+    })
+
+@app.route('/cache/stats')
+def cache_stats():
+    """返回结果缓存的命中统计"""
+    return jsonify(result_cache.stats())
+
+@app.route('/store/<digest>')
+@require_admin_token
+def stored_config(digest):
+    """按内容哈希下载存储的配置"""
+    content = config_store.get(digest) if re.fullmatch(r'[0-9a-f]{64}', digest) else None
+    if content is None:
+        return jsonify({'error': 'Stored configuration not found'}), 404
+    return Response(content, mimetype='text/plain; charset=utf-8')
+
+@app.route('/store/<digest>/metadata')
+@require_admin_token
+def stored_config_metadata(digest):
+    """返回存储的配置的元数据"""
+    metadata = config_store.metadata(digest)
+    if metadata is None:
+        return jsonify({'error': 'Stored configuration not found'}), 404
+    return jsonify(metadata)
+
+@app.route('/search')
+@require_admin_token
+def search_configs():
+    """跨存储的全部配置检索
+
+    kind=line（默认）按命令行检索，单词按顺序匹配，… 或 * 匹配任意内容，如 logging … debugging；
+    kind=ssid / vlan 按SSID或vlan-id精确检索；kind=profile 按名称检索，可用type限定块类型。
+    结果只包含配置的哈希、主机名和命中的有名称的块（类型和名称），不返回命令行和块头原文，
+    避免泄露如 mgmt-user 行中的密码哈希。
+    """
+    query = ' '.join(request.args.get('q', '').split())
+    kind = request.args.get('kind', 'line')
+    if not query:
+        return jsonify({'error': 'Missing query'}), 400
+    if kind not in SEARCH_KINDS:
+        return jsonify({'error': f'Unknown search kind: {kind}'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    indexing = search_index.backfill(config_store)
+    found = search_index.search(query, kind, request.args.get('type'), limit)
+    results = []
+    for digest, matches in found['matches']:
+        metadata = config_store.metadata(digest) or {}
+        blocks = {}
+        for term, headers in matches:
+            for header in headers:
+                block_type, name = split_block_header(header)
+                if name is not None:
+                    blocks[(block_type, name)] = None
+        results.append({
+            'hash': digest,
+            'hostname': metadata.get('hostname'),
+            'matches': len(matches),
+            'blocks': [{'type': block_type, 'name': name} for block_type, name in blocks],
+        })
+    return json_response({
+        'query': query,
+        'kind': kind,
+        'total': found['total'],
+        'terms': found['terms'],
+        'indexing': indexing,
+        'results': results,
+    })
+
+# 预先计算的统计分析视图
+FLEET_VIEWS = ('rules', 'tri_session', 'vlan_bcmc', 'ap_group_drift')
+
+@app.route('/fleet/analytics')
+@app.route('/fleet/analytics/<view>')
+@require_admin_token
+def fleet_analytics_view(view=None):
+    """返回存储中所有配置的汇总视图：各规则命中比例、缺少allow-tri-session的控制器、
+    最常缺少bcmc-optimization的VLAN、与多数profile集合不一致的ap-group"""
+    if view is not None and view not in FLEET_VIEWS:
+        return jsonify({'error': f'Unknown view: {view}'}), 404
+    fleet_analytics.start()
+    views = fleet_analytics.views
+    data = {'status': fleet_analytics.status()}
+    if views is not None:
+        data['updated'] = views['updated']
+        data['configs'] = views['configs']
+        for name in FLEET_VIEWS if view is None else (view,):
+            data[name] = views[name]
+    return json_response(data)
+
+def gauge_lines(name, documentation, value, metric_type='gauge'):
+    return [f'# HELP {name} {documentation}', f'# TYPE {name} {metric_type}', f'{name} {value}']
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus格式的指标：请求和各阶段耗时直方图、配置规模分布、缓存和队列状态"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    cache = result_cache.stats()
+    analysis = admission.stats()
+    jobs = job_queue.stats()
+    lines += gauge_lines('aruba_result_cache_hits_total', 'Result cache hits', cache['hits'], 'counter')
+    lines += gauge_lines('aruba_result_cache_misses_total', 'Result cache misses', cache['misses'], 'counter')
+    lines += gauge_lines('aruba_result_cache_entries', 'Cached analysis results', cache['size'])
+    lines += gauge_lines('aruba_analysis_in_flight', 'Analyses currently running', analysis['in_flight'])
+    lines += gauge_lines('aruba_analysis_waiting', 'Analyses waiting for a slot', analysis['waiting'])
+    lines += gauge_lines('aruba_analysis_rejected_total', 'Analyses rejected because the queue was full',
+                         analysis['rejected'], 'counter')
+    lines += gauge_lines('aruba_analysis_timed_out_total', 'Analyses rejected after waiting too long',
+                         analysis['timed_out'], 'counter')
+    lines += gauge_lines('aruba_jobs_active', 'Queued or running background jobs', jobs['active'])
+    lines += gauge_lines('aruba_uploads_total', 'Processed uploads', get_counter(), 'counter')
+    lines += gauge_lines('aruba_search_indexed_configs', 'Stored configs in the search index',
+                         search_index.stats()['configs'])
+    lines += gauge_lines('aruba_log_records_dropped_total', 'Log records dropped because the log queue was full',
+                         log_queue_handler.dropped, 'counter')
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/admission/stats')
+def admission_stats():
+    """返回解析分析并发限制和异步任务队列的统计"""
+    return jsonify({'analysis': admission.stats(), 'jobs': job_queue.stats()})
+
+def audit_config_file(path, fields, previous_id=None):
+    """命令行批量分析时在进程池中读取并分析一个文件，.gz文件（如配置存储中的文件）先解压"""
+    try:
+        with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as f:
+            data = f.read()
+    except (OSError, EOFError, zlib.error) as e:
+        return {'file': path, 'error': f'Error reading file: {str(e)}'}
+    return analyze_batch_file(path, data, fields, previous_id)
+
+def collect_config_files(paths, patterns):
+    """展开命令行中的目录和通配符，返回排序后的文件列表"""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in patterns:
+                files.update(glob.glob(os.path.join(path, '**', pattern), recursive=True))
+        else:
+            files.update(glob.glob(path) or ([path] if os.path.exists(path) else []))
+    return sorted(file for file in files if os.path.isfile(file))
+
+def load_audit_state(path):
+    """读取上次运行保存的文件状态，不存在或损坏时返回空状态"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_audit_state(path, state):
+    """先写临时文件再替换，避免中途退出留下损坏的状态文件"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+class AuditWriter:
+    """按JSON Lines或CSV格式输出批量分析结果，CSV每条提示一行"""
+
+    CSV_COLUMNS = ('file', 'id', 'version', 'baseline_version', 'ap_groups', 'type', 'message', 'error')
+
+    def __init__(self, stream, output_format):
+        self.stream = stream
+        self.output_format = output_format
+        if output_format == 'csv':
+            self.writer = csv.DictWriter(stream, fieldnames=self.CSV_COLUMNS, extrasaction='ignore')
+            self.writer.writeheader()
+
+    def write(self, item):
+        if self.output_format == 'jsonl':
+            self.stream.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n')
+            return
+        for analysis in item.get('analysis') or [{}]:
+            self.writer.writerow(dict(item, **analysis))
+
+def run_audit(args):
+    """命令行批量分析：并行分析目录或通配符匹配的配置文件，跳过上次运行后没有变化的文件"""
+    files = collect_config_files(args.paths, args.pattern)
+    fields = ['analysis'] + (['config'] if args.config else [])
+
+    # 规则集和基线都没变时，大小和修改时间没变的文件直接跳过，不需要读取
+    state = {} if args.force else load_audit_state(args.state)
+    previous_files = state.get('files', {})
+    signature = {
+        'ruleset': RULESET_VERSION,
+        'baselines': baselines.fingerprints(),
+    }
+    same_signature = all(state.get(key) == value for key, value in signature.items())
+
+    stats = {'files': len(files), 'analyzed': 0, 'skipped': 0, 'errors': 0}
+    current_files = {}
+    pending = []
+    for path in files:
+        stat = os.stat(path)
+        previous = previous_files.get(path, {})
+        if same_signature and previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime:
+            current_files[path] = previous
+            stats['skipped'] += 1
+        else:
+            pending.append((path, stat, previous.get('id')))
+
+    started = time.perf_counter()
+    output = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        writer = AuditWriter(output, args.format)
+        with create_process_pool(args.workers or batch_worker_count()) as executor:
+            futures = {executor.submit(audit_config_file, path, fields, previous_id): (path, stat)
+                       for path, stat, previous_id in pending}
+            for future in as_completed(futures):
+                path, stat = futures[future]
+                try:
+                    item = future.result()
+                except Exception as e:
+                    # 单个文件分析失败（包括子进程异常退出）只记录该文件，不影响其他文件
+                    item = {'file': path, 'error': f'Error analyzing file: {str(e)}'}
+                if 'error' in item:
+                    stats['errors'] += 1
+                    writer.write(item)
+                    continue
+                if item.get('skipped'):
+                    stats['skipped'] += 1
+                else:
+                    stats['analyzed'] += 1
+                    writer.write(item)
+                # 输出之后才记录，中断时没有输出的文件下次重新分析
+                current_files[path] = {'id': item['id'], 'size': stat.st_size, 'mtime': stat.st_mtime}
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        # 中途出错或被中断时也保存已完成的文件，下次只需分析剩下的文件
+        save_audit_state(args.state, dict(signature, files=current_files))
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    print(json.dumps(stats), file=sys.stderr)
+    return 1 if stats['errors'] else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Aruba Configuration Analysis Tool')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('serve', help='start the web server (default)')
+    audit = subparsers.add_parser('audit', help='analyze saved configuration files without the web server')
+    audit.add_argument('paths', nargs='+', help='configuration files, directories or glob patterns, e.g. "data/*.log"')
+    audit.add_argument('--pattern', nargs='+', default=['*.log', '*.log.gz'],
+                       help='file patterns used when a directory is given (default: *.log *.log.gz, '
+                            'which includes the configuration store under data/store)')
+    audit.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl', help='output format (default: jsonl)')
+    audit.add_argument('-o', '--output', help='output file (default: stdout)')
+    audit.add_argument('-j', '--workers', type=int, help='number of worker processes (default: available CPUs)')
+    audit.add_argument('--state', default=os.path.join(data_dir, '.audit_state.json'),
+                       help='file recording content hashes of the last run')
+    audit.add_argument('--force', action='store_true', help='analyze all files even if unchanged since the last run')
+    audit.add_argument('--config', action='store_true', help='include the parsed ap-group structure in the output')
+    audit.add_argument('-v', '--verbose', action='store_true', help='show INFO logging')
+    args = parser.parse_args(argv)
+    init_app()
+
+    if args.command == 'audit':
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+        return run_audit(args)
+    app.run(debug=True)
+    return 0
 
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Aruba Configuration Analysis Tool - 性能测试
+生成测试配置，测量解析、分析和/upload的耗时与内存，并与保存的基线比较
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import app
+
+# 生成配置时各类profile的命令模板，812default.log中对应的default块为空时使用
+GENERATOR_FALLBACK_COMMANDS = {
+    'wlan ssid-profile': ('opmode wpa2-aes', 'max-clients 64', 'wmm'),
+    'aaa profile': ('authentication-dot1x "default"', 'dot1x-default-role "authenticated"'),
+    'rf dot11a-radio-profile': ('channel-width 40MHz', 'eirp-min 12'),
+    'rf dot11g-radio-profile': ('channel-width 20MHz', 'eirp-min 9'),
+    'rf arm-profile': ('assignment single-band', 'max-tx-power 18'),
+    'ap system-profile': ('lms-preemption', 'heartbeat-dscp 0'),
+}
+
+def generate_config(ap_groups=100, vaps=20, vlans=50, interfaces=8, size=None, seed=0):
+    """生成用于性能测试的配置
+
+    以812default.log为骨架，profile命令取自其中同类型的default块；生成vaps个virtual-ap
+    （各自的ssid/aaa profile）、radio/arm profile、vlans个vlan和interface vlan、
+    interfaces个物理接口，以及引用它们的ap_groups个ap-group。size为目标字节数，
+    不足时追加session ACL直到达到该大小。
+    """
+    rng = random.Random(seed)
+    with open(os.path.join(app.templates_dir, '812default.log'), 'r', encoding='utf-8-sig') as f:
+        base = f.read().replace('\r\n', '\n')
+    index = app.index_config(base)
+
+    def commands_of(block_type, header=None):
+        block = index.get(block_type, 'default') if header is None else next(
+            (b for b in index.blocks if b.header == header), None)
+        commands = block.commands if block is not None else ()
+        return commands or GENERATOR_FALLBACK_COMMANDS.get(block_type, ())
+
+    def block(header, commands):
+        return '\n'.join([header] + [f'    {line}' for line in commands] + ['!'])
+
+    parts = [base.rstrip('\n')]
+    radios = max(1, vaps // 4)
+    for i in range(radios):
+        parts.append(block(f'rf arm-profile "bench-arm{i}"', commands_of('rf arm-profile')))
+        parts.append(block(f'rf dot11a-radio-profile "bench-a{i}"',
+                           (f'arm-profile "bench-arm{i}"',) + tuple(commands_of('rf dot11a-radio-profile'))))
+        parts.append(block(f'rf dot11g-radio-profile "bench-g{i}"',
+                           (f'arm-profile "bench-arm{i}"',) + tuple(commands_of('rf dot11g-radio-profile'))))
+        parts.append(block(f'ap system-profile "bench-sys{i}"',
+                           (f'lms-ip 10.255.{i // 256}.{i % 256}',) + tuple(commands_of('ap system-profile'))))
+    for i in range(vaps):
+        ssid_commands = [line for line in commands_of('wlan ssid-profile') if not line.startswith('essid')]
+        parts.append(block(f'wlan ssid-profile "bench-ssid{i}"', [f'essid "BENCH-{i}"'] + ssid_commands))
+        parts.append(block(f'aaa profile "bench-aaa{i}"', commands_of('aaa profile')))
+        parts.append(block(f'wlan virtual-ap "bench-vap{i}"', (
+            f'ssid-profile "bench-ssid{i}"',
+            f'aaa-profile "bench-aaa{i}"',
+            f'vlan {rng.randint(2, max(2, vlans))}',
+        )))
+    for vlan_id in range(2, vlans + 2):
+        parts.append(f'vlan {vlan_id}\n!')
+        commands = [f'ip address 10.{vlan_id // 256}.{vlan_id % 256}.1 255.255.255.0']
+        if rng.random() < 0.7:
+            commands.append('bcmc-optimization')
+        parts.append(block(f'interface vlan {vlan_id}', commands))
+    port_commands = commands_of('interface gigabitethernet', 'interface gigabitethernet 0/0/0')
+    for port in range(1, interfaces + 1):
+        parts.append(block(f'interface gigabitethernet 0/0/{port}', port_commands))
+    for i in range(ap_groups):
+        commands = [f'virtual-ap "bench-vap{vap}"' for vap in rng.sample(range(vaps), min(vaps, rng.randint(1, 4)))]
+        radio = rng.randrange(radios)
+        commands += [f'dot11a-radio-profile "bench-a{radio}"', f'dot11g-radio-profile "bench-g{radio}"']
+        if rng.random() < 0.5:
+            commands.append(f'ap-system-profile "bench-sys{rng.randrange(radios)}"')
+        parts.append(block(f'ap-group "bench-group{i}"', commands))
+    text = '\n'.join(parts) + '\n'
+    if size:
+        padding = []
+        length = len(text)
+        acl = 0
+        while length < size:
+            rules = [f'any host 10.{acl // 256 % 256}.{acl % 256}.{rule} svc-https permit' for rule in range(1, 21)]
+            padding.append(block(f'ip access-list session bench-acl{acl}', rules))
+            length += len(padding[-1]) + 1
+            acl += 1
+        text += '\n'.join(padding) + '\n'
+    return text
+
+# 性能测试的配置规模
+BENCH_PRESETS = {
+    'small': {'ap_groups': 50, 'vaps': 10, 'vlans': 20},
+    'medium': {'ap_groups': 500, 'vaps': 50, 'vlans': 200, 'interfaces': 24},
+    'large': {'ap_groups': 2000, 'vaps': 200, 'vlans': 1000, 'interfaces': 48, 'size': 10 * 1024 * 1024},
+    'huge': {'ap_groups': 5000, 'vaps': 500, 'vlans': 2000, 'interfaces': 48, 'size': 30 * 1024 * 1024},
+}
+
+def percentile(values, p):
+    """按最近秩法返回百分位数，values需已排序"""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+def measure(func, repeat):
+    """预热一次后执行repeat次，返回耗时统计（毫秒）和一次执行的内存峰值（字节）"""
+    func()
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    seconds.sort()
+    return {
+        'p50_ms': round(percentile(seconds, 50) * 1000, 3),
+        'p90_ms': round(percentile(seconds, 90) * 1000, 3),
+        'p99_ms': round(percentile(seconds, 99) * 1000, 3),
+        'mean_ms': round(sum(seconds) / len(seconds) * 1000, 3),
+        'peak_bytes': peak,
+    }
+
+def benchmark_case(name, params, repeat, client):
+    """对一个生成的配置测量各阶段和/upload接口"""
+    content = generate_config(**params)
+    size = len(content.encode('utf-8'))
+    baseline = app.baselines.match(app.detect_version(content))
+    index = app.index_config(content)
+
+    def upload():
+        # 清空结果缓存，每次请求都完整解析和分析
+        app.result_cache.clear()
+        response = client.post('/upload', data={'config_text': content})
+        if response.status_code != 200:
+            raise RuntimeError(f'/upload returned {response.status_code}')
+
+    stages = [
+        ('index', lambda: app.index_config(content)),
+        ('parse', lambda: app.parse_config(content, index)),
+        ('analyze', lambda: app.analyze_config(content, index, baseline)),
+        ('diff', lambda: app.diff_configs(index, baseline)),
+        ('upload', upload),
+    ]
+    results = {}
+    for stage, func in stages:
+        stats = measure(func, repeat)
+        stats['mb_per_s'] = round(size / 1048576 / (stats['p50_ms'] / 1000), 2) if stats['p50_ms'] else None
+        results[stage] = stats
+        app.logger.info(f'Benchmark {name}/{stage}: p50 {stats["p50_ms"]}ms, peak {stats["peak_bytes"] // 1024}KB')
+    return {'size': size, 'lines': index.line_count, 'ap_groups': params.get('ap_groups'), 'stages': results}
+
+def compare_benchmark(current, baseline, threshold, min_delta_ms=2.0, min_delta_bytes=1024 * 1024):
+    """返回相对基线变慢或内存增加超过threshold（且超过最小差值）的阶段"""
+    regressions = []
+    for case, data in current['cases'].items():
+        previous = baseline.get('cases', {}).get(case)
+        if previous is None or previous.get('size') != data['size']:
+            continue
+        for stage, stats in data['stages'].items():
+            before = previous['stages'].get(stage)
+            if before is None:
+                continue
+            for key, min_delta in (('p50_ms', min_delta_ms), ('peak_bytes', min_delta_bytes)):
+                if stats[key] > before[key] * (1 + threshold) and stats[key] - before[key] > min_delta:
+                    regressions.append({'case': case, 'stage': stage, 'metric': key,
+                                        'baseline': before[key], 'current': stats[key],
+                                        'change': round(stats[key] / before[key] - 1, 3) if before[key] else None})
+    return regressions
+
+def run_benchmark(args):
+    """命令行性能测试：生成配置，测量各阶段和/upload的耗时分位数、吞吐量和内存峰值，与保存的基线比较"""
+    scratch = tempfile.mkdtemp(prefix='aruba-bench-')
+    # /upload使用临时目录中的存储和计数器，不影响data目录
+    counter_file = os.path.join(scratch, 'counters')
+    with open(counter_file, 'w') as f:
+        f.write('0')
+    app.init_app(DATA_DIR=scratch, COUNTER_FILE=counter_file)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    try:
+        client = app.app.test_client()
+        cases = {}
+        for name in args.preset:
+            params = dict(BENCH_PRESETS[name], seed=args.seed)
+            cases[name] = benchmark_case(name, params, args.repeat, client)
+    finally:
+        app.close_app()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    current = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'parser': app.PARSER_VERSION,
+        'ruleset': app.RULESET_VERSION,
+        'repeat': args.repeat,
+        'cases': cases,
+    }
+    print(json.dumps(current, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+        print(f'Baseline saved to {args.baseline}', file=sys.stderr)
+        return 0
+    try:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f'No baseline at {args.baseline}, run with --save-baseline first', file=sys.stderr)
+        return 0
+    regressions = compare_benchmark(current, baseline, args.threshold, args.min_delta_ms)
+    for item in regressions:
+        print(f'Regression: {item["case"]}/{item["stage"]} {item["metric"]} '
+              f'{item["baseline"]} -> {item["current"]} ({item["change"]:+.0%})', file=sys.stderr)
+    return 1 if regressions else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Aruba Configuration Analysis Tool benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench = subparsers.add_parser('run', help='benchmark parsing, analysis and /upload on generated configurations')
+    bench.add_argument('--preset', nargs='+', choices=list(BENCH_PRESETS), default=['small', 'medium'],
+                       help='configuration sizes to benchmark (default: small medium)')
+    bench.add_argument('--repeat', type=int, default=10, help='measured runs per stage (default: 10)')
+    bench.add_argument('--seed', type=int, default=0, help='random seed for the generated configurations')
+    bench.add_argument('--baseline', default=os.path.join(app.data_dir, 'benchmark_baseline.json'),
+                       help='file with the baseline numbers')
+    bench.add_argument('--save-baseline', action='store_true', help='save this run as the new baseline')
+    bench.add_argument('--threshold', type=float, default=0.2,
+                       help='fail when a stage is slower or uses more memory than the baseline by this ratio (default: 0.2)')
+    bench.add_argument('--min-delta-ms', type=float, default=2.0,
+                       help='ignore slowdowns smaller than this many milliseconds (default: 2)')
+    bench.add_argument('-o', '--output', help='also write the results to this file')
+    bench.add_argument('-v', '--verbose', action='store_true', help='show INFO logging')
+    generate = subparsers.add_parser('generate', help='write a synthetic configuration for testing')
+    generate.add_argument('--ap-groups', type=int, default=100)
+    generate.add_argument('--vaps', type=int, default=20)
+    generate.add_argument('--vlans', type=int, default=50)
+    generate.add_argument('--interfaces', type=int, default=8)
+    generate.add_argument('--size-mb', type=float, help='pad the configuration to this size')
+    generate.add_argument('--seed', type=int, default=0)
+    generate.add_argument('-o', '--output', help='output file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        return run_benchmark(args)
+    content = generate_config(args.ap_groups, args.vaps, args.vlans, args.interfaces,
+                              int(args.size_mb * 1024 * 1024) if args.size_mb else None, args.seed)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(content)
+    else:
+        sys.stdout.write(content)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
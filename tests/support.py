@@ -0,0 +1,20 @@
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+def init_app_in_tempdir(**config):
+    """用临时的data目录和计数文件初始化应用，返回该目录，测试结束后用cleanup_app()删除"""
+    directory = tempfile.mkdtemp(prefix='aruba-test-')
+    app.init_app(DATA_DIR=directory, COUNTER_FILE=os.path.join(directory, 'counters'), **config)
+    return directory
+
+
+def cleanup_app(directory):
+    app.close_app()
+    shutil.rmtree(directory, ignore_errors=True)
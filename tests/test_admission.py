@@ -0,0 +1,53 @@
+import os
+import unittest
+
+from support import app, cleanup_app, init_app_in_tempdir
+
+
+def setUpModule():
+    global data_dir
+    data_dir = init_app_in_tempdir()
+
+
+def tearDownModule():
+    cleanup_app(data_dir)
+
+
+def load_default():
+    with open(os.path.join(app.templates_dir, '812default.log'), 'r', encoding='utf-8-sig') as f:
+        return f.read().replace('\r\n', '\n')
+
+
+class RejectedRequestTest(unittest.TestCase):
+    """繁忙被拒绝的请求不计数，也不保存配置"""
+
+    def setUp(self):
+        app.result_cache.clear()
+        self.client = app.app.test_client()
+        self.content = load_default()
+        baseline = app.baselines.match(app.detect_version(self.content))
+        self.previous = app.analyze_content(self.content, baseline)
+        # 占用唯一的名额，且不允许排队
+        self.addCleanup(setattr, app, 'admission', app.admission)
+        app.admission = app.AdmissionController(max_concurrent=1, max_waiting=0)
+        started = app.admission.acquire()
+        self.addCleanup(app.admission.release, started)
+
+    def test_analyze_is_not_counted(self):
+        count = app.upload_counter.value()
+        response = self.client.post('/api/v1/analyze?fields=analysis', data=self.content + 'vlan 10\n!\n')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(app.upload_counter.value(), count)
+
+    def test_reanalyze_is_not_counted_or_saved(self):
+        count = app.upload_counter.value()
+        content = self.content + 'vlan 20\n!\n'
+        response = self.client.post(f'/api/v1/analyze/{self.previous["id"]}', data=content)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(app.upload_counter.value(), count)
+        app.config_store.flush()
+        self.assertIsNone(app.config_store.get(app.content_hash(content)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from support import app, cleanup_app, init_app_in_tempdir
+
+
+def setUpModule():
+    global data_dir
+    data_dir = init_app_in_tempdir()
+
+
+def tearDownModule():
+    cleanup_app(data_dir)
+
+
+def load_default_bytes():
+    with open(os.path.join(app.templates_dir, '812default.log'), 'rb') as f:
+        return f.read()
+
+
+class AnalyzeBatchFileTest(unittest.TestCase):
+
+    def setUp(self):
+        app.result_cache.clear()
+
+    def test_matches_full_analysis_without_caching(self):
+        data = load_default_bytes()
+        item = app.analyze_batch_file('812default.log', data, ['analysis', 'config', 'diff'])
+        self.assertEqual(app.result_cache.stats()['size'], 0)
+
+        content = app.decode_content(data)
+        result = app.analyze_content(content, app.baselines.match(app.detect_version(content)))
+        self.assertEqual(item['id'], result['id'])
+        self.assertEqual(item['analysis'], result['analysis'])
+        self.assertEqual(item['config'], app.config_to_dict(result['config']))
+        self.assertEqual(item['diff'], result['diff'])
+        self.assertEqual(item['ap_groups'], len(result['config']))
+
+    def test_returns_only_requested_fields(self):
+        item = app.analyze_batch_file('812default.log', load_default_bytes(), ['analysis'])
+        self.assertIn('analysis', item)
+        self.assertNotIn('config', item)
+        self.assertNotIn('diff', item)
+
+
+class ProcessPoolTest(unittest.TestCase):
+
+    def test_spawned_workers_analyze_files(self):
+        with app.create_process_pool(2) as executor:
+            self.assertEqual(executor._mp_context.get_start_method(), 'spawn')
+            item = executor.submit(app.analyze_batch_file, '812default.log', load_default_bytes(), ['analysis']).result()
+        self.assertNotIn('error', item)
+        self.assertEqual(item['baseline_version'], '8.12')
+
+
+class RunAuditTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='aruba-audit-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name in ('a.log', 'b.log'):
+            with open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(load_default_bytes())
+        self.state = os.path.join(self.directory, 'state.json')
+
+    def run_audit(self):
+        args = argparse.Namespace(paths=[self.directory], pattern=['*.log'], config=False, force=False,
+                                  state=self.state, output=os.path.join(self.directory, 'out.jsonl'),
+                                  format='jsonl', workers=1)
+        return app.run_audit(args)
+
+    def test_saves_finished_files_when_interrupted(self):
+        calls = []
+
+        def write(writer, item):
+            calls.append(item['file'])
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+        with mock.patch.object(app.AuditWriter, 'write', write):
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_audit()
+        with open(self.state, encoding='utf-8') as f:
+            self.assertEqual(list(json.load(f)['files']), calls[:1])
+
+    def test_records_failed_file_and_continues(self):
+        original = app.create_process_pool
+
+        def create_process_pool(workers):
+            executor = original(workers)
+            submit = executor.submit
+
+            def failing_submit(fn, path, *args):
+                if path.endswith('a.log'):
+                    return submit(os._exit, 1)
+                return submit(fn, path, *args)
+            executor.submit = failing_submit
+            return executor
+        with mock.patch.object(app, 'create_process_pool', create_process_pool):
+            self.assertEqual(self.run_audit(), 1)
+        with open(os.path.join(self.directory, 'out.jsonl'), encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertIn(os.path.join(self.directory, 'a.log'), [row['file'] for row in rows if 'error' in row])
+
+
+if __name__ == '__main__':
+    unittest.main()
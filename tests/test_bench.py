@@ -0,0 +1,70 @@
+import unittest
+
+from support import app
+
+import bench
+
+
+class PercentileTest(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        values = list(range(1, 11))
+        self.assertEqual(bench.percentile(values, 50), 5)
+        self.assertEqual(bench.percentile(values, 90), 9)
+        self.assertEqual(bench.percentile(values, 99), 10)
+        self.assertEqual(bench.percentile(values, 100), 10)
+        self.assertEqual(bench.percentile(values, 0), 1)
+
+    def test_small_samples(self):
+        self.assertEqual(bench.percentile([7], 50), 7)
+        self.assertEqual(bench.percentile([1, 2], 50), 1)
+        self.assertEqual(bench.percentile([1, 2, 3, 4], 75), 3)
+
+
+class GenerateConfigTest(unittest.TestCase):
+
+    def test_generates_requested_blocks(self):
+        content = bench.generate_config(ap_groups=5, vaps=4, vlans=3, interfaces=2, seed=1)
+        index = app.index_config(content)
+        groups = [block.name for block in index.of_type('ap-group') if block.name.startswith('bench-')]
+        self.assertEqual(len(groups), 5)
+        self.assertEqual(len([block for block in index.of_type('wlan virtual-ap')
+                              if block.name.startswith('bench-')]), 4)
+        self.assertIn('bench-group0', app.ProfileGraph(index).flatten())
+        self.assertEqual(app.detect_version(content), app.detect_version(bench.generate_config(ap_groups=1)))
+
+    def test_same_seed_same_config(self):
+        self.assertEqual(bench.generate_config(ap_groups=3, seed=2), bench.generate_config(ap_groups=3, seed=2))
+        self.assertNotEqual(bench.generate_config(ap_groups=3, seed=2), bench.generate_config(ap_groups=3, seed=3))
+
+    def test_pads_to_size(self):
+        content = bench.generate_config(ap_groups=1, vaps=1, vlans=1, interfaces=1, size=200 * 1024)
+        self.assertGreaterEqual(len(content), 200 * 1024)
+        self.assertLess(len(content), 210 * 1024)
+
+
+def run(size, p50_ms, peak_bytes):
+    return {'cases': {'small': {'size': size, 'stages': {'parse': {'p50_ms': p50_ms, 'peak_bytes': peak_bytes}}}}}
+
+
+class CompareBenchmarkTest(unittest.TestCase):
+
+    def test_reports_slowdown_and_memory_growth(self):
+        regressions = bench.compare_benchmark(run(100, 30.0, 4 << 20), run(100, 10.0, 1 << 20), 0.2)
+        self.assertEqual([(item['stage'], item['metric']) for item in regressions],
+                         [('parse', 'p50_ms'), ('parse', 'peak_bytes')])
+        self.assertEqual(regressions[0]['change'], 2.0)
+
+    def test_ignores_small_changes(self):
+        # 超过比例但差值小于最小差值
+        self.assertEqual(bench.compare_benchmark(run(100, 1.5, 1000), run(100, 1.0, 500), 0.2), [])
+        # 差值足够但没有超过比例
+        self.assertEqual(bench.compare_benchmark(run(100, 110.0, 1 << 20), run(100, 100.0, 1 << 20), 0.2), [])
+
+    def test_skips_cases_of_different_size(self):
+        self.assertEqual(bench.compare_benchmark(run(200, 30.0, 1 << 20), run(100, 10.0, 1 << 20), 0.2), [])
+        self.assertEqual(bench.compare_benchmark(run(100, 30.0, 1 << 20), {}, 0.2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
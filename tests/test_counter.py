@@ -0,0 +1,47 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import app
+
+
+def increment_in_process(path, lock_path, start, count):
+    """子进程中用自己的计数器对同一个文件计数，每次增加后立即写回"""
+    counter = app.UploadCounter(path, lock_path, flush_interval=60)
+    start.wait(30)
+    for _ in range(count):
+        counter.increment()
+        counter.flush()
+    counter.close()
+
+
+class ConcurrentFlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='aruba-counter-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'counters')
+        self.lock_path = os.path.join(self.directory, '.counters.lock')
+        with open(self.path, 'w') as f:
+            f.write('5')
+
+    def test_processes_do_not_lose_counts(self):
+        context = multiprocessing.get_context('spawn')
+        start = context.Event()
+        processes = [context.Process(target=increment_in_process, args=(self.path, self.lock_path, start, 50))
+                     for _ in range(4)]
+        for process in processes:
+            process.start()
+        start.set()
+        for process in processes:
+            process.join(60)
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(app.UploadCounter(self.path, self.lock_path).value(), 5 + 4 * 50)
+        # 临时文件都已通过rename替换
+        self.assertEqual(sorted(os.listdir(self.directory)), ['.counters.lock', 'counters'])
+
+
+if __name__ == '__main__':
+    unittest.main()
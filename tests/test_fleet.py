@@ -0,0 +1,47 @@
+import os
+import unittest
+from unittest import mock
+
+from support import app, cleanup_app, init_app_in_tempdir
+
+
+def setUpModule():
+    global data_dir
+    data_dir = init_app_in_tempdir()
+
+
+def tearDownModule():
+    cleanup_app(data_dir)
+
+
+def load_default():
+    with open(os.path.join(app.templates_dir, '812default.log'), 'r', encoding='utf-8-sig') as f:
+        return f.read().replace('\r\n', '\n')
+
+
+class FleetScanTest(unittest.TestCase):
+
+    def setUp(self):
+        base = load_default()
+        self.digests = {app.config_store.save(base + f'vlan {vlan_id}\n!\n', source='test') for vlan_id in (10, 20, 30)}
+        app.config_store.flush()
+        self.fleet = app.FleetAnalytics(os.path.join(data_dir, 'scan.jsonl'), app.config_store, workers=1)
+        self.addCleanup(self.fleet.stop)
+
+    def test_scan_uses_own_small_pool(self):
+        with mock.patch.object(app, 'get_batch_executor', side_effect=AssertionError('shared pool used')):
+            self.fleet._scan()
+        self.assertTrue(self.digests <= set(self.fleet._records))
+        self.assertEqual(self.fleet._executor._max_workers, 1)
+        self.assertEqual(self.fleet.views['configs'], len(self.fleet._records))
+
+    def test_stop_ends_background_thread(self):
+        self.fleet.start()
+        thread = self.fleet._thread
+        self.fleet.stop()
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(self.fleet._executor)
+
+
+if __name__ == '__main__':
+    unittest.main()
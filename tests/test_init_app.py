@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from support import app, cleanup_app, init_app_in_tempdir
+
+
+class InitAppTest(unittest.TestCase):
+
+    def setUp(self):
+        saved = dict(app.app.config)
+        self.addCleanup(app.app.config.update, saved)
+
+    def test_import_does_not_create_singletons(self):
+        # 导入模块不创建全局对象，批量分析的子进程可以安全导入
+        code = 'import app; print(app.config_store, app.result_cache, app.log_queue_handler)'
+        output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(app.__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.split(), ['None', 'None', 'None'])
+
+    def test_config_changes_take_effect_on_init(self):
+        directory = init_app_in_tempdir(RESULT_CACHE_SIZE=3, ANALYSIS_CONCURRENCY=1)
+        self.addCleanup(cleanup_app, directory)
+        self.assertEqual(app.result_cache.max_size, 3)
+        self.assertEqual(app.admission.max_concurrent, 1)
+        self.assertEqual(app.config_store.directory, os.path.join(directory, 'store'))
+
+    def test_upload_uses_configured_counter(self):
+        directory = init_app_in_tempdir()
+        self.addCleanup(cleanup_app, directory)
+        response = app.app.test_client().post('/upload', data={'config_text': 'version 8.12\nhostname "t"\n'})
+        self.assertEqual(response.status_code, 200)
+        app.upload_counter.flush()
+        with open(os.path.join(directory, 'counters')) as f:
+            self.assertEqual(f.read(), '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
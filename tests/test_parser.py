@@ -0,0 +1,63 @@
+import json
+import os
+import unittest
+
+from support import app
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# fixtures中的json由改为块索引之前的parse_config（提交051b0fd）生成
+FIXTURES = {
+    '812default': os.path.join(app.templates_dir, '812default.log'),
+    'profiles': os.path.join(FIXTURES_DIR, 'profiles.log'),
+    'generated': os.path.join(FIXTURES_DIR, 'generated.log'),
+}
+
+# 旧parse_config展开的profile类型，其他类型的引用在旧结果中是ap-group的普通命令
+LEGACY_PROFILE_TYPES = {'ap-system-profile', 'virtual-ap', *app.AP_GROUP_PROFILE_TYPES}
+
+
+def load_fixture(name):
+    with open(FIXTURES[name], 'r', encoding='utf-8-sig') as f:
+        content = f.read().replace('\r\n', '\n')
+    with open(os.path.join(FIXTURES_DIR, name + '.json'), 'r', encoding='utf-8') as f:
+        return content, json.load(f)
+
+
+class LegacyOutputTest(unittest.TestCase):
+    """parse_config的结果与旧实现一致"""
+
+    def assert_matches_legacy(self, name):
+        content, expected = load_fixture(name)
+        actual = json.loads(json.dumps(app.parse_config(content)))
+        self.assertEqual(list(actual), list(expected))
+        for group_name, expected_group in expected.items():
+            with self.subTest(group=group_name):
+                group = actual[group_name]
+                profiles = {profile_type: entries for profile_type, entries in group['profiles'].items()
+                            if profile_type in LEGACY_PROFILE_TYPES}
+                self.assertEqual(profiles, expected_group['profiles'])
+                # 新增展开的引用（如enet1-port-profile）在旧结果中保留为命令行
+                resolved = {f'{profile_type} "{profile_name}"'
+                            for profile_type, entries in group['profiles'].items()
+                            if profile_type not in LEGACY_PROFILE_TYPES for profile_name in entries}
+                self.assertLessEqual(resolved, set(expected_group['commands']))
+                self.assertEqual(group['commands'],
+                                 [line for line in expected_group['commands'] if line not in resolved])
+
+    def test_default_template(self):
+        self.assert_matches_legacy('812default')
+
+    def test_profile_families(self):
+        self.assert_matches_legacy('profiles')
+
+    def test_generated_config(self):
+        self.assert_matches_legacy('generated')
+
+    def test_reuses_given_index(self):
+        content, expected = load_fixture('profiles')
+        self.assertEqual(app.parse_config(content, app.index_config(content)), app.parse_config(content))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import unittest
+
+from support import app, cleanup_app, init_app_in_tempdir
+
+
+def setUpModule():
+    global data_dir
+    data_dir = init_app_in_tempdir()
+
+
+def tearDownModule():
+    cleanup_app(data_dir)
+
+
+def load_default():
+    with open(os.path.join(app.templates_dir, '812default.log'), 'r', encoding='utf-8-sig') as f:
+        return f.read().replace('\r\n', '\n')
+
+
+class ReanalyzeTest(unittest.TestCase):
+
+    def setUp(self):
+        app.result_cache.clear()
+        self.base = load_default()
+        self.baseline = app.baselines.match(app.detect_version(self.base))
+
+    def full_analysis(self, content):
+        app.result_cache.clear()
+        return app.analyze_content(content, self.baseline)['analysis']
+
+    def test_vlan_line_in_virtual_ap_reruns_bcmc_rule(self):
+        template = self.base + (
+            'vlan 10\n!\n'
+            'interface vlan 10\n    bcmc-optimization\n!\n'
+            'wlan virtual-ap "vap1"\n    vlan {vlan}\n!\n'
+        )
+        previous = app.analyze_content(template.format(vlan=10), self.baseline)
+        content = template.format(vlan=20)
+        result, delta = app.reanalyze_content(previous, content, self.baseline)
+
+        self.assertTrue(delta['incremental'])
+        self.assertIn('vlan-bcmc', delta['rules_rerun'])
+        self.assertEqual(result['analysis'], self.full_analysis(content))
+        self.assertTrue(any(20 in item.get('vlans', ()) for item in result['analysis']))
+
+    def test_only_changed_lines_are_reindexed(self):
+        previous = app.analyze_content(self.base, self.baseline)
+        content = self.base.replace('interface gigabitethernet 0/0/1 \n    shutdown \n',
+                                    'interface gigabitethernet 0/0/1 \n', 1)
+        self.assertNotEqual(content, self.base)
+        result, delta = app.reanalyze_content(previous, content, self.baseline, previous_content=self.base)
+
+        self.assertEqual(delta['blocks'], {'added': [], 'removed': [],
+                                           'changed': ['interface gigabitethernet 0/0/1']})
+        self.assertEqual(delta['rules_rerun'], ['spanning-tree'])
+        self.assertEqual(result['analysis'], self.full_analysis(content))
+        index = result['graph'].index
+        full = app.index_config(content)
+        self.assertEqual([(block.header, block.commands) for block in index.blocks],
+                         [(block.header, block.commands) for block in full.blocks])
+        self.assertEqual(index.starts, full.starts)
+        # 没有变化的块与上一次是同一个对象
+        previous_blocks = {id(block) for block in previous['graph'].index.blocks}
+        self.assertEqual([block.header for block in index.blocks if id(block) not in previous_blocks],
+                         ['interface gigabitethernet 0/0/1'])
+
+    def test_spanning_tree_rule_skips_other_blocks(self):
+        previous = app.analyze_content(self.base, self.baseline)
+        content = self.base + 'ap-group "extra"\n    virtual-ap "default"\n!\n'
+        result, delta = app.reanalyze_content(previous, content, self.baseline, previous_content=self.base)
+        self.assertNotIn('spanning-tree', delta['rules_rerun'])
+        self.assertEqual(result['analysis'], self.full_analysis(content))
+
+
+class PatchIndexTest(unittest.TestCase):
+
+    def assert_patched(self, previous_content, content):
+        index, replaced, blocks = app.patch_index(app.index_config(previous_content), previous_content, content)
+        full = app.index_config(content)
+        self.assertEqual([(block.header, block.commands) for block in index.blocks],
+                         [(block.header, block.commands) for block in full.blocks])
+        self.assertEqual(index.starts, full.starts)
+        self.assertEqual(index.line_count, full.line_count)
+        return replaced, blocks
+
+    def test_header_only_block_absorbs_indented_line(self):
+        # 没有命令的块之后，缩进行属于该块；改成缩进后需要从前一个块重新切分
+        self.assert_patched('a\nb\n    x\n!\nc\n!\n', 'a\n    b\n    x\n!\nc\n!\n')
+
+    def test_removing_block_terminator(self):
+        replaced, blocks = self.assert_patched('a\n    x\n!\nb\n    y\n!\nc\n!\n', 'a\n    x\nb\n    y\n!\nc\n!\n')
+        self.assertEqual([block.header for block in replaced], ['a', 'b'])
+        self.assertEqual([block.header for block in blocks], ['a'])
+
+    def test_insert_before_first_block(self):
+        self.assert_patched('\na\n    x\n!\n', 'b\n!\n\na\n    x\n!\n')
+
+
+class ReanalyzeApiTest(unittest.TestCase):
+
+    def test_falls_back_to_persisted_result(self):
+        client = app.app.test_client()
+        base = load_default()
+        response = client.post('/upload', data={'config_text': base})
+        self.assertEqual(response.status_code, 200)
+        app.config_store.flush()
+        baseline = app.baselines.match(app.detect_version(base))
+        previous_id = app.result_id_for(base, baseline)
+        app.result_cache.clear()
+
+        response = client.post(f'/api/v1/analyze/{previous_id}', data=base + 'vlan 30\n!\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['delta']['blocks']['added'], ['vlan 30'])
+        self.assertEqual(client.post('/api/v1/analyze/' + '0' * 64, data=base).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import app, cleanup_app, init_app_in_tempdir
+
+
+def setUpModule():
+    global data_dir
+    data_dir = init_app_in_tempdir(ADMIN_TOKEN='secret')
+
+
+def tearDownModule():
+    cleanup_app(data_dir)
+
+
+def load_default():
+    with open(os.path.join(app.templates_dir, '812default.log'), 'r', encoding='utf-8-sig') as f:
+        return f.read().replace('\r\n', '\n')
+
+
+CONFIG_EXTRA = (
+    'mgmt-user admin root 3f2a9c0d1e\n!\n'
+    'wlan ssid-profile "corp"\n    essid "CORP-WIFI"\n!\n'
+)
+
+AUTH = {'Authorization': 'Bearer secret'}
+
+
+class AccessControlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.app.test_client()
+        self.digest = app.content_hash('hostname "x"\n!\n')
+
+    def test_requires_token(self):
+        for path in ('/search?q=vlan', '/fleet/analytics', f'/store/{self.digest}', f'/store/{self.digest}/metadata'):
+            self.assertEqual(self.client.get(path).status_code, 401, path)
+            self.assertEqual(self.client.get(path, headers={'Authorization': 'Bearer wrong'}).status_code, 401, path)
+
+    def test_disabled_without_token(self):
+        self.addCleanup(app.app.config.update, ADMIN_TOKEN='secret')
+        app.app.config['ADMIN_TOKEN'] = None
+        self.assertEqual(self.client.get('/search?q=vlan', headers=AUTH).status_code, 404)
+        self.assertEqual(self.client.get('/fleet/analytics', headers=AUTH).status_code, 404)
+
+
+class SearchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = app.app.test_client()
+        cls.digest = app.config_store.save(load_default() + CONFIG_EXTRA, source='test')
+        app.config_store.flush()
+
+    def search(self, query, kind='line'):
+        response = self.client.get('/search', query_string={'q': query, 'kind': kind}, headers=AUTH)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_line_search_does_not_return_config_text(self):
+        response = self.search('mgmt-user admin')
+        data = response.get_json()
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['results'][0]['hash'], self.digest)
+        # mgmt-user块没有名称，不返回块头
+        self.assertEqual(data['results'][0]['blocks'], [])
+        self.assertNotIn(b'3f2a9c0d1e', response.data)
+        self.assertNotIn(b'root', response.data)
+
+    def test_returns_names_of_named_blocks(self):
+        data = self.search('CORP-WIFI', 'ssid').get_json()
+        self.assertEqual(data['results'][0]['blocks'], [{'type': 'wlan ssid-profile', 'name': 'corp'}])
+        self.assertEqual(set(data['results'][0]), {'hash', 'hostname', 'matches', 'blocks'})
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='aruba-search-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'search.db')
+        self.index = app.SearchIndex(self.path)
+        self.addCleanup(self.index.close)
+        self.index.add('a', app.index_config('logging 10.0.0.1 severity debugging\n!\n'
+                                             'aaa profile "corp"\n    vlan 10\n!\n'))
+        self.index.add('b', app.index_config('logging 10.0.0.2\n    level debugging\n!\n'
+                                             'wlan ssid-profile "corp"\n    essid "CORP"\n!\n'))
+
+    def test_line_search_with_wildcard(self):
+        found = self.index.search('logging … debugging')
+        self.assertEqual(found['total'], 1)
+        self.assertEqual(found['matches'], [('a', [('logging 10.0.0.1 severity debugging',
+                                                    ('logging 10.0.0.1 severity debugging',))])])
+
+    def test_profile_and_exact_search(self):
+        self.assertEqual(self.index.search('corp', 'profile')['total'], 2)
+        self.assertEqual(self.index.search('corp', 'profile', 'aaa profile')['matches'][0][0], 'a')
+        self.assertEqual(self.index.search('10', 'vlan')['matches'][0], ('a', [('10', ('aaa profile "corp"',))]))
+        self.assertEqual(self.index.search('CORP', 'ssid')['matches'][0][0], 'b')
+
+    def test_remove_drops_unused_terms(self):
+        terms = self.index.stats()['terms']
+        self.index.remove('b')
+        self.assertNotIn('b', self.index)
+        self.assertLess(self.index.stats()['terms'], terms)
+        self.assertEqual(self.index.search('CORP', 'ssid')['total'], 0)
+        self.assertEqual(self.index.search('corp', 'profile')['total'], 1)
+
+    def test_persists_and_replaces_legacy_file(self):
+        self.index.close()
+        legacy_path = os.path.join(self.directory, 'search.jsonl')
+        with open(legacy_path, 'w') as f:
+            f.write('{}\n')
+        reopened = app.SearchIndex(self.path)
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.stats()['configs'], 2)
+        self.assertFalse(os.path.exists(legacy_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
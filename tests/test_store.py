@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from support import app, cleanup_app, init_app_in_tempdir
+
+
+def setUpModule():
+    global data_dir
+    data_dir = init_app_in_tempdir()
+
+
+def tearDownModule():
+    cleanup_app(data_dir)
+
+
+def load_default():
+    with open(os.path.join(app.templates_dir, '812default.log'), 'r', encoding='utf-8-sig') as f:
+        return f.read().replace('\r\n', '\n')
+
+
+class ResultFileTest(unittest.TestCase):
+
+    def setUp(self):
+        app.result_cache.clear()
+        self.content = load_default()
+        self.digest = app.config_store.save(self.content, source='test')
+        self.result = app.analyze_content(self.content, app.baselines.match(app.detect_version(self.content)))
+
+    def test_round_trip_as_json(self):
+        app.config_store.save_result(self.digest, self.result)
+        app.config_store.flush()
+        current, digest, data = app.config_store.load_result(self.result['id'])
+        self.assertTrue(current)
+        self.assertEqual(digest, self.digest)
+        self.assertEqual(data['config'], app.config_to_dict(self.result['config']))
+        self.assertEqual(data['analysis'], json.loads(json.dumps(self.result['analysis'])))
+        with open(app.config_store.result_path(self.result['id']), 'rb') as f:
+            self.assertEqual(f.read(4), b'ACR2')
+
+    def test_legacy_pickle_file_is_reanalyzed(self):
+        app.config_store.flush()
+        path = app.config_store.result_path(self.result['id'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = app.RESULT_HEADER.pack(b'ACR1', app.PARSER_VERSION, app.RULESET_VERSION, bytes.fromhex(self.digest))
+        with open(path, 'wb') as f:
+            # 旧格式的内容不会被反序列化
+            f.write(header + b'\x80\x04not a pickle')
+        self.assertEqual(app.config_store.load_result(self.result['id']), (False, self.digest, None))
+
+        result = app.load_persisted_result(self.result['id'])
+        self.assertEqual(result['analysis'], self.result['analysis'])
+        self.assertTrue(app.config_store.load_result(self.result['id'])[0])
+
+
+class StoreWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='aruba-store-')
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def make_store(self, **kwargs):
+        store = app.ConfigStore(self.directory, **kwargs)
+        self.addCleanup(store.flush)
+        return store
+
+    def test_full_queue_writes_synchronously(self):
+        store = self.make_store(queue_size=1)
+        store.save('first\n!\n')
+        release = threading.Event()
+        self.addCleanup(release.set)
+        # 让后台线程停在一个任务上，再占满队列
+        started = threading.Event()
+        store._queue.put((lambda: (started.set(), release.wait()), ()))
+        started.wait(5)
+        store._queue.put((lambda: None, ()))
+
+        digest = store.save('second\n!\n')
+        self.assertTrue(os.path.exists(store.path_for(digest)))
+        self.assertIsNotNone(store.metadata(digest)['stored_size'])
+        release.set()
+
+    def test_reupload_keeps_stored_size(self):
+        store = self.make_store()
+        digest = store.save('config\n!\n')
+        store.save('config\n!\n')
+        store.flush()
+        record = store.metadata(digest)
+        self.assertEqual(record['uploads'], 2)
+        self.assertIsNotNone(record.get('stored_size'))
+        self.assertEqual(app.ConfigStore(self.directory).metadata(digest), record)
+
+    def test_evicts_least_recently_seen(self):
+        store = self.make_store(max_entries=2)
+        digests = [store.save(f'config {i}\n!\n') for i in range(2)]
+        store.flush()
+        # 再次上传最早的配置后，淘汰的是第二个
+        store.save('config 0\n!\n')
+        store.save('config 2\n!\n')
+        store.flush()
+        self.assertEqual(sorted(store.digests()), sorted([digests[0], app.content_hash('config 2\n!\n')]))
+        self.assertFalse(os.path.exists(store.path_for(digests[1])))
+        self.assertEqual(sorted(app.ConfigStore(self.directory).digests()), sorted(store.digests()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from support import app, cleanup_app, init_app_in_tempdir
+
+
+def setUpModule():
+    global data_dir
+    data_dir = init_app_in_tempdir()
+
+
+def tearDownModule():
+    cleanup_app(data_dir)
+
+
+class AsyncUploadTest(unittest.TestCase):
+
+    def test_failed_spool_is_removed(self):
+        client = app.app.test_client()
+        with mock.patch.object(app.shutil, 'copyfileobj', side_effect=OSError('connection reset')):
+            response = client.post('/upload', data={'async': '1', 'config_file': (io.BytesIO(b'vlan 1\n!\n'), 'a.log')})
+        self.assertIn('error', response.get_json())
+        self.assertEqual([name for name in os.listdir(app.config_store.staging_dir) if name.endswith('.upload')], [])
+
+
+# 超过采样长度的纯ASCII前缀，之后的非法字节不在采样范围内
+ASCII_PREFIX = b'vlan 1\n!\n' * (app.ENCODING_SAMPLE_SIZE // 9 + 1)
+
+
+class DecodeUploadTest(unittest.TestCase):
+
+    def test_utf8_bom(self):
+        data = b'\xef\xbb\xbfhostname "\xe6\xb5\x8b\xe8\xaf\x95"\n'
+        self.assertEqual(app.detect_encoding(data), ('utf-8-sig', 1.0))
+        self.assertEqual(app.decode_upload(data), ('hostname "测试"\n', 'utf-8-sig', 1.0))
+
+    def test_utf16_bom(self):
+        for encoding in ('utf-16-le', 'utf-16-be'):
+            data = '\ufeffhostname "测试"\n'.encode(encoding)
+            self.assertEqual(app.detect_encoding(data), ('utf-16', 1.0))
+            self.assertEqual(app.decode_upload(data), ('hostname "测试"\n', 'utf-16', 1.0))
+
+    def test_gbk(self):
+        data = 'ap-group "测试楼层"\n!\n'.encode('gbk')
+        self.assertEqual(app.detect_encoding(data), ('gbk', 0.8))
+        self.assertEqual(app.decode_upload(data), ('ap-group "测试楼层"\n!\n', 'gbk', 0.8))
+
+    def test_late_invalid_byte_falls_back_to_latin1(self):
+        data = ASCII_PREFIX + b'description caf\xe9\n'
+        self.assertEqual(app.detect_encoding(data), ('utf-8', 0.99))
+        content, encoding, confidence = app.decode_upload(data)
+        self.assertEqual(encoding, 'latin1')
+        self.assertEqual(confidence, 0.05)
+        self.assertTrue(content.endswith('description café\n'))
+
+    def test_stream_falls_back_after_sample(self):
+        staging_dir = tempfile.mkdtemp(prefix='aruba-staging-')
+        self.addCleanup(shutil.rmtree, staging_dir)
+        ingested = app.ingest_stream(io.BytesIO(ASCII_PREFIX + b'description caf\xe9\n'), staging_dir)
+        self.assertEqual((ingested.encoding, ingested.confidence), ('latin1', 0.05))
+        with open(ingested.staged_path, 'r', encoding='utf-8') as f:
+            self.assertTrue(f.read().endswith('description café\n'))
+        # 失败的候选编码不留下暂存文件
+        self.assertEqual(os.listdir(staging_dir), [os.path.basename(ingested.staged_path)])
+
+
+if __name__ == '__main__':
+    unittest.main()